@@ -6,6 +6,7 @@ auth_service 包
 主要包含：
 - SecretsManager: 密钥管理类，用于加载和访问密钥
 - 鉴权装饰器: 用于服务函数的密钥注入和权限验证
+- JwtTokenProvider: 缓存并提前刷新的JWT令牌提供者
 - 辅助函数: 提供密钥相关的实用功能
 
 使用示例:
@@ -32,9 +33,19 @@ from .auth_decorator import (
 __all__ = [
     'SecretsManager',
     'require_secret',
-    'require_secret_with_context'
+    'require_secret_with_context',
+    'JwtTokenProvider'
 ]
 
+
+def __getattr__(name):
+    # JwtTokenProvider 依赖 jwt/cryptography，只在首次使用时导入
+    if name == 'JwtTokenProvider':
+        from .token_provider import JwtTokenProvider
+        return JwtTokenProvider
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # 包初始化代码
 def _initialize():
     """包的初始化函数，在第一次导入时执行"""
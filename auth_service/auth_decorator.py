@@ -1,4 +1,6 @@
 
+import functools
+
 from .secrets_manager import SecretsManager
 
 
@@ -6,6 +8,7 @@ def require_secret(service_name, key_name):
     """服务鉴权装饰器 - 自动注入所需密钥。
 
     此装饰器会在函数执行前获取指定服务的密钥，并将其作为secret参数注入。
+    密钥句柄在装饰时创建，每次调用只需一次快照比较即可取得密钥。
 
     Args:
         service_name: 服务名称。
@@ -16,12 +19,12 @@ def require_secret(service_name, key_name):
     """
 
     def decorator(func):
-        def wrapper(*args, **kwargs):
-            # 获取所需密钥
-            secret = SecretsManager.get_secret(service_name, key_name)
+        handle = SecretsManager.handle(service_name, key_name)
 
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
             # 将密钥注入到函数参数中
-            return func(*args, secret=secret, **kwargs)
+            return func(*args, secret=handle.get(), **kwargs)
 
         return wrapper
 
@@ -43,10 +46,12 @@ def require_secret_with_context(service_name, key_name):
     """
 
     def decorator(func):
-        def wrapper(args, *kwargs):
+        handle = SecretsManager.handle(service_name, key_name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
             try:
-                secret = SecretsManager.get_secret(service_name, key_name)
-                return func(args, secret=secret, *kwargs)
+                secret = handle.get()
             except KeyError as e:
                 # 提供更详细的错误信息
                 error_msg = (
@@ -54,6 +59,7 @@ def require_secret_with_context(service_name, key_name):
                     f"原因: {str(e)}"
                 )
                 raise PermissionError(error_msg) from e
+            return func(*args, secret=secret, **kwargs)
 
         return wrapper
 
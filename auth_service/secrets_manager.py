@@ -37,11 +37,12 @@ admin_token = admin_secure_token_xyz
 db.password = P@ssw0rd!123
 '''
 
-import chardet
+import logging
+from function_base import metrics
 import os
 import re
-from collections import defaultdict
-from functools import lru_cache
+import threading
+from types import MappingProxyType
 
 class SecretsManager:
     """管理应用程序密钥的加载和访问。
@@ -49,8 +50,12 @@ class SecretsManager:
     该类负责从指定文件中加载密钥，并提供安全的访问接口。
     密钥文件格式应为每行一个密钥，格式为"密钥名 = 密钥值"。
 
+    加载结果是一个只读快照，重新加载时先完整解析新文件，再整体替换快照引用，
+    因此 get_secret 读取时无需加锁，也不会看到加载到一半的数据；
+    解析失败时继续使用旧快照。
+
     属性:
-        _secrets: 存储所有加载的密钥，格式为字典的字典。
+        _secrets: 当前密钥快照，格式为只读的字典的字典。
         DEFAULT_FILE_PATH: 默认密钥文件路径。
     """
 
@@ -61,87 +66,191 @@ class SecretsManager:
         'key.txt'
     )
 
+    # 热加载：按 (修改时间, 文件大小) 判断密钥文件是否变化
+    _loaded_signature = None
+    _reload_thread = None
+    _reload_stop = None
+    _reload_lock = threading.Lock()
+    # 首次加载的单飞锁：只有一个线程解析文件，其余线程等待其结果
+    _load_lock = threading.Lock()
+
+    @staticmethod
+    def _file_signature(file_path):
+        stat = os.stat(file_path)
+        return stat.st_mtime_ns, stat.st_size
 
+    @staticmethod
+    def _parse_file(file_path):
+        """解析密钥文件，返回 (只读快照, 文件编码)。
+
+        Raises:
+            FileNotFoundError: 如果指定的密钥文件不存在。
+            ValueError: 如果密钥文件中有格式错误的行。
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"密钥文件不存在: {file_path}")
+
+        with open(file_path, 'rb') as f:
+            raw_data = f.read()
+
+        try:
+            # 密钥文件通常是UTF-8（可能带BOM）或纯ASCII，能直接解码时无需检测编码
+            content = raw_data.decode('utf-8-sig')
+            file_encoding = 'utf-8'
+        except UnicodeDecodeError:
+            content, file_encoding = SecretsManager._decode_detected(raw_data)
+
+        secrets = {}
+        # 按行处理文件内容
+        for line_num, line in enumerate(content.splitlines(), 1):
+            line = line.strip()
+            # 跳过空行和注释
+            if not line or line.startswith('#'):
+                continue
+
+            # 解析 "密钥名 = 密钥值" 格式
+            match = re.match(r'^([\w\.\-]+)\s*=\s*(.+)$', line)
+            if not match:
+                raise ValueError(
+                    f"第 {line_num} 行格式错误: '{line}'。"
+                    "应为 '密钥名 = 密钥值' 格式"
+                )
+
+            key_name = match.group(1)
+            key_value = match.group(2).strip()
+
+            # 处理带命名空间的密钥 (service.key)
+            if '.' in key_name:
+                service, key = key_name.split('.', 1)
+                secrets.setdefault(service, {})[key] = key_value
+            else:
+                # 全局密钥
+                secrets.setdefault('global', {})[key_name] = key_value
+
+        snapshot = MappingProxyType({service: MappingProxyType(keys) for service, keys in secrets.items()})
+        return snapshot, file_encoding
+
+    @staticmethod
+    def _decode_detected(raw_data):
+        """自动检测文件编码并解码，返回 (内容, 编码)。只在文件不能按UTF-8解码时调用。"""
+        import chardet
+
+        encoding_result = chardet.detect(raw_data)
+        file_encoding = encoding_result['encoding'] or 'utf-8'
+
+        # 如果检测到的编码置信度较低，尝试使用gbk
+        if encoding_result['confidence'] < 0.7:
+            try:
+                return raw_data.decode('gbk'), 'gbk'
+            except UnicodeDecodeError:
+                return raw_data.decode(file_encoding, errors='replace'), file_encoding
+        return raw_data.decode(file_encoding), file_encoding
 
     @classmethod
-    @lru_cache(maxsize=1)
     def load_secrets(cls, file_path=None):
         """加载并缓存密钥文件。
 
-        该方法会解析密钥文件，并将结果存储在类变量中。使用LRU缓存确保
-        文件只被读取一次，后续调用直接返回缓存结果。
+        首次调用时解析密钥文件并保存为只读快照，后续调用直接返回当前快照。
+        多个线程同时首次调用时只有一个线程解析文件，其余线程等待并共享同一结果。
+        需要重新读取文件时使用 reload()，或通过 start_hot_reload() 自动重新加载。
 
         Args:
             file_path: 可选，指定密钥文件路径。如果未提供，则使用默认路径。
 
         Returns:
-            dict: 包含所有密钥的嵌套字典，格式为 {服务名: {密钥名: 密钥值}}
+            Mapping: 包含所有密钥的只读嵌套映射，格式为 {服务名: {密钥名: 密钥值}}
 
         Raises:
-            FileNotFoundError: 如果指定的密钥文件不存在。
-            ValueError: 如果密钥文件中有格式错误的行。
-            RuntimeError: 如果加载过程中发生其他错误。
+            RuntimeError: 如果密钥文件不存在、格式错误或加载过程中发生其他错误。
         """
-        file_path = file_path or cls.DEFAULT_FILE_PATH
+        secrets = cls._secrets
+        if secrets is not None:
+            return secrets
 
-        if cls._secrets is None:
-            cls._secrets = defaultdict(dict)
-            try:
-                if not os.path.exists(file_path):
-                    raise FileNotFoundError(f"密钥文件不存在: {file_path}")
-
-                # 自动检测文件编码
-                with open(file_path, 'rb') as f:
-                    raw_data = f.read()
-                    encoding_result = chardet.detect(raw_data)
-                    file_encoding = encoding_result['encoding'] or 'utf-8'
-
-                    # 如果检测到的编码置信度较低，尝试使用utf-8和gbk
-                    if encoding_result['confidence'] < 0.7:
-                        try:
-                            content = raw_data.decode('utf-8')
-                        except UnicodeDecodeError:
-                            try:
-                                content = raw_data.decode('gbk')
-                            except UnicodeDecodeError:
-                                content = raw_data.decode(file_encoding, errors='replace')
-                    else:
-                        content = raw_data.decode(file_encoding)
-
-                # 按行处理文件内容
-                for line_num, line in enumerate(content.splitlines(), 1):
-                    line = line.strip()
-                    # 跳过空行和注释
-                    if not line or line.startswith('#'):
-                        continue
-
-                    # 解析 "密钥名 = 密钥值" 格式
-                    match = re.match(r'^([\w\.\-]+)\s*=\s*(.+)$', line)
-                    if not match:
-                        raise ValueError(
-                            f"第 {line_num} 行格式错误: '{line}'。"
-                            "应为 '密钥名 = 密钥值' 格式"
-                        )
-
-                    key_name = match.group(1)
-                    key_value = match.group(2).strip()
-
-                    # 处理带命名空间的密钥 (service.key)
-                    if '.' in key_name:
-                        service, key = key_name.split('.', 1)
-                        cls._secrets[service][key] = key_value
-                    else:
-                        # 全局密钥
-                        cls._secrets['global'][key_name] = key_value
-
-                print(f"成功加载密钥文件: {file_path} (编码: {file_encoding})")
-                print(f"发现 {len(cls._secrets)} 个服务密钥组")
+        with cls._load_lock:
+            secrets = cls._secrets
+            if secrets is not None:
+                return secrets
 
+            file_path = file_path or cls.DEFAULT_FILE_PATH
+            try:
+                with metrics.span("secrets", "load"):
+                    signature = cls._file_signature(file_path) if os.path.exists(file_path) else None
+                    secrets, file_encoding = cls._parse_file(file_path)
             except Exception as e:
-                cls._secrets = None
                 raise RuntimeError(f"加载密钥失败: {str(e)}")
 
-        return cls._secrets
+            cls._loaded_signature = signature
+            cls._secrets = secrets
+        print(f"成功加载密钥文件: {file_path} (编码: {file_encoding})")
+        print(f"发现 {len(secrets)} 个服务密钥组")
+        return secrets
+
+    @classmethod
+    def reload(cls, file_path=None):
+        """重新解析密钥文件并原子替换快照。
+
+        解析失败时记录错误并保留旧快照。
+
+        Returns:
+            bool: 是否成功替换。
+        """
+        file_path = file_path or cls.DEFAULT_FILE_PATH
+        try:
+            with metrics.span("secrets", "reload"):
+                signature = cls._file_signature(file_path)
+                secrets, file_encoding = cls._parse_file(file_path)
+        except Exception as e:
+            logging.error("重新加载密钥文件失败，继续使用旧密钥: %s", e)
+            return False
+
+        cls._loaded_signature = signature
+        cls._secrets = secrets
+        logging.info("已重新加载密钥文件: %s (编码: %s)，共 %d 个服务密钥组", file_path, file_encoding, len(secrets))
+        return True
+
+    @classmethod
+    def start_hot_reload(cls, interval=5.0, file_path=None):
+        """启动后台线程轮询密钥文件，修改时间或大小变化时调用 reload()。
+
+        解析在后台线程中完成，不占用 get_secret 的调用路径。重复调用不会启动多个线程。
+
+        Args:
+            interval: 轮询间隔（秒）。
+            file_path: 可选，指定密钥文件路径。
+        """
+        file_path = file_path or cls.DEFAULT_FILE_PATH
+        with cls._reload_lock:
+            if cls._reload_thread is not None and cls._reload_thread.is_alive():
+                return
+            stop_event = threading.Event()
+            cls._reload_stop = stop_event
+            cls._reload_thread = threading.Thread(
+                target=cls._watch, args=(file_path, interval, stop_event), name="SecretsReload", daemon=True
+            )
+            cls._reload_thread.start()
+
+    @classmethod
+    def stop_hot_reload(cls):
+        """停止后台轮询线程。"""
+        with cls._reload_lock:
+            if cls._reload_stop is not None:
+                cls._reload_stop.set()
+            cls._reload_thread = None
+            cls._reload_stop = None
+
+    @classmethod
+    def _watch(cls, file_path, interval, stop_event):
+        while not stop_event.wait(interval):
+            try:
+                signature = cls._file_signature(file_path)
+            except OSError:
+                # 文件被替换的瞬间可能短暂不存在，下一轮再检查
+                continue
+            if signature != cls._loaded_signature:
+                if not cls.reload(file_path):
+                    # 记住失败的版本，避免对同一个损坏文件反复解析；文件再次修改后会重试
+                    cls._loaded_signature = signature
 
     @classmethod
     def get_secret(cls, service_name, key_name):
@@ -182,6 +291,11 @@ class SecretsManager:
             f"可用密钥: {available_keys}"
         )
 
+    @classmethod
+    def handle(cls, service_name, key_name):
+        """返回预绑定的密钥句柄，见 SecretHandle。"""
+        return SecretHandle(cls, service_name, key_name)
+
     @classmethod
     def list_secrets(cls):
         """列出所有加载的密钥（用于调试）。
@@ -199,3 +313,33 @@ class SecretsManager:
         return "\n".join(result)
 
 
+class SecretHandle:
+    """预绑定到某个 服务名.密钥名 的密钥句柄。
+
+    第一次调用时通过 get_secret 解析，之后只要密钥快照没有被替换就直接返回缓存值，
+    每次调用只有一次引用比较；热加载替换快照后自动重新解析。
+
+    Args:
+        manager: SecretsManager 类。
+        service_name: 服务名称。
+        key_name: 密钥名称。
+    """
+
+    __slots__ = ('manager', 'service_name', 'key_name', '_cached')
+
+    def __init__(self, manager, service_name, key_name):
+        self.manager = manager
+        self.service_name = service_name
+        self.key_name = key_name
+        # (解析时的快照, 密钥值) 作为一个整体替换
+        self._cached = (None, None)
+
+    def get(self):
+        snapshot, value = self._cached
+        if snapshot is not None and snapshot is self.manager._secrets:
+            return value
+        value = self.manager.get_secret(self.service_name, self.key_name)
+        self._cached = (self.manager._secrets, value)
+        return value
+
+    __call__ = get
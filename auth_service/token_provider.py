@@ -0,0 +1,94 @@
+
+import threading
+import time
+
+import jwt
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+from function_base import metrics
+
+
+class JwtTokenProvider:
+    """缓存并提前刷新的JWT令牌提供者。
+
+    私钥文件只在首次使用时读取并解析一次；签出的令牌在有效期内重复使用。
+    进入刷新窗口（距过期不足 refresh_margin 秒）后，调用方仍拿到当前令牌，
+    同时由后台线程签发新令牌；只有令牌已经过期时才会同步签发。
+    可在多个线程中并发调用 get_token()。
+
+    Args:
+        key_path: PEM格式私钥文件路径。
+        claims: 返回 (sub, kid) 的可调用对象，在每次签发时调用，
+            以便密钥轮换后自动生效。
+        lifetime: 令牌有效期（秒）。
+        refresh_margin: 提前刷新的时间窗口（秒）。
+        algorithm: 签名算法。
+    """
+
+    def __init__(self, key_path, claims, lifetime=900, refresh_margin=120, algorithm='EdDSA'):
+        self.key_path = key_path
+        self.claims = claims
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self.algorithm = algorithm
+        self._private_key = None
+        # (令牌, 过期时间戳) 作为一个整体替换，读取时无需加锁
+        self._current = (None, 0)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        self.issued = 0
+
+    def _load_key(self):
+        if self._private_key is None:
+            with open(self.key_path, 'rb') as file:
+                self._private_key = load_pem_private_key(file.read(), password=None)
+        return self._private_key
+
+    def _issue(self):
+        """签发新令牌并替换当前令牌，调用方需持有锁。"""
+        sub, kid = self.claims()
+        now = int(time.time())
+        payload = {
+            'iat': now - 30,
+            'exp': now + self.lifetime,
+            'sub': sub
+        }
+        with metrics.span("jwt", "sign"):
+            token = jwt.encode(payload, self._load_key(), algorithm=self.algorithm, headers={'kid': kid})
+        self._current = (token, payload['exp'])
+        self.issued += 1
+        return token
+
+    def _refresh_in_background(self):
+        try:
+            with self._lock:
+                token, expires_at = self._current
+                if expires_at - time.time() <= self.refresh_margin:
+                    self._issue()
+        finally:
+            self._refreshing = False
+
+    def get_token(self):
+        token, expires_at = self._current
+        remaining = expires_at - time.time()
+        if remaining > self.refresh_margin:
+            return token
+
+        if remaining > 0:
+            # 仍然有效：先返回旧令牌，后台提前刷新
+            with self._refresh_lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, name="JwtRefresh", daemon=True).start()
+            return token
+
+        with self._lock:
+            token, expires_at = self._current
+            if expires_at - time.time() > 0:
+                return token
+            return self._issue()
+
+    def invalidate(self):
+        """丢弃当前令牌（例如上游返回401时），下次调用会重新签发。"""
+        self._current = (None, 0)
@@ -0,0 +1,138 @@
+"""
+本地模拟的和风天气接口，可注入延迟与错误
+
+在本机启动 /v7/grid-weather/24h，返回 fixtures/qweather_24h.json。延迟与错误比例
+可以在运行时修改，用于验证 ResilientClient 的自适应超时、对冲请求、重试与熔断。
+
+用法:
+    python benchmarks/fake_qweather.py                                  # 对比普通请求与弹性客户端
+    python benchmarks/fake_qweather.py --slow-ratio 0.01 --slow-latency 5
+    python benchmarks/fake_qweather.py --error-ratio 1                  # 接口全部失败，观察熔断
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from function_base.http_client import HttpClient
+from function_base.resilient_client import ResilientClient
+
+
+class FakeQWeatherServer:
+    """模拟接口服务。
+
+    每个请求先等待 latency 秒；以 slow_ratio 的概率改为等待 slow_latency 秒（长尾）；
+    以 error_ratio 的概率返回 503。属性可以在运行时直接修改。
+
+    Args:
+        latency: 正常请求的延迟（秒）。
+        slow_ratio: 长尾请求的比例。
+        slow_latency: 长尾请求的延迟（秒）。
+        error_ratio: 返回503的比例。
+        seed: 随机种子，固定后每次运行的延迟序列相同。
+    """
+
+    def __init__(self, latency=0.02, slow_ratio=0.0, slow_latency=2.0, error_ratio=0.0, seed=0):
+        self.latency = latency
+        self.slow_ratio = slow_ratio
+        self.slow_latency = slow_latency
+        self.error_ratio = error_ratio
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        with open(os.path.join(BENCH_DIR, 'fixtures', 'qweather_24h.json'), 'rb') as f:
+            self.body = f.read()
+        self._server = None
+
+    def _plan(self):
+        """决定本次请求的 (延迟, 状态码)。"""
+        with self._lock:
+            self.requests += 1
+            slow = self._random.random() < self.slow_ratio
+            failed = self._random.random() < self.error_ratio
+        return (self.slow_latency if slow else self.latency), (503 if failed else 200)
+
+    def start(self, host='127.0.0.1', port=0):
+        """在后台线程中启动服务，返回 "host:port"，可作为 rain_report 的 api_host。"""
+        fake = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                delay, status = fake._plan()
+                time.sleep(delay)
+                body = fake.body if status == 200 else b'{"code":"503"}'
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    # 客户端已超时断开
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="FakeQWeather", daemon=True).start()
+        return f"{host}:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _run(name, call, count):
+    latencies, errors = [], {}
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            call()
+        except Exception as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    print(f"{name:<10} p50={p(0.5):8.1f}ms p95={p(0.95):8.1f}ms p99={p(0.99):8.1f}ms "
+          f"max={latencies[-1] * 1000:8.1f}ms 平均={statistics.mean(latencies) * 1000:8.1f}ms 错误={errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用本地模拟接口对比普通请求与弹性客户端')
+    parser.add_argument('--requests', type=int, default=200, help='每种客户端的请求数')
+    parser.add_argument('--latency', type=float, default=0.02, help='正常延迟（秒）')
+    parser.add_argument('--slow-ratio', dest='slow_ratio', type=float, default=0.02, help='长尾请求比例')
+    parser.add_argument('--slow-latency', dest='slow_latency', type=float, default=1.0, help='长尾延迟（秒）')
+    parser.add_argument('--error-ratio', dest='error_ratio', type=float, default=0.0, help='返回503的比例')
+    args = parser.parse_args()
+
+    fake = FakeQWeatherServer(args.latency, args.slow_ratio, args.slow_latency, args.error_ratio)
+    url = f"http://{fake.start()}/v7/grid-weather/24h"
+    params = {'location': '105.44,28.89'}
+
+    _run("普通请求", lambda: HttpClient.shared().get(url, params=params), args.requests)
+    client = ResilientClient(min_samples=20, reset_timeout=5.0)
+    _run("弹性客户端", lambda: client.get(url, params=params), args.requests)
+    for endpoint, stats in client.stats().items():
+        print(f"{endpoint}: {stats}")
+    fake.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,420 @@
+"""
+热点函数的微基准测试
+
+使用 benchmarks/fixtures 中录制的样本（和风天气JSON、不同大小的RFC822邮件、
+不同编码的密钥文件），对每个基准分别测量单次调用耗时（perf_counter，多轮取中位数与最小值）
+和峰值内存（tracemalloc，单独测量，避免影响计时），并与保存的基线比较，
+超过容差即视为性能回退，以非零状态码退出。
+
+机器负载与CPU频率会让绝对耗时整体漂移，因此每轮计时前紧接着测一轮固定的纯Python
+校准负载，比较的是两者多轮最小值之比（relative），而不是绝对耗时；
+依赖磁盘或本地网络的基准波动更大，注册时单独放宽容差。
+
+用法:
+    python benchmarks/run_benchmarks.py                   # 运行并与基线比较
+    python benchmarks/run_benchmarks.py --save-baseline   # 运行并保存为新的基线
+    python benchmarks/run_benchmarks.py -k email          # 只运行名称包含 email 的基准
+"""
+
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from email import policy
+from email.parser import BytesParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from auth_service import SecretsManager
+from function_plugin.dingtalk_notify import dingtalk_notify
+from function_plugin.email_monitor import email_monitor
+from function_plugin.mime_stream import ContentAddressedStore, StreamingMimeParser
+from function_plugin.rain_report import rain_report
+
+BENCHMARKS = []
+# {基准名: 耗时容差} / {基准名: 峰值内存容差}，未登记的基准使用 --tolerance / --memory-tolerance
+TOLERANCES = {}
+MEMORY_TOLERANCES = {}
+
+
+def benchmark(name, tolerance=None, memory_tolerance=None):
+    """注册基准。被装饰的函数负责准备数据，返回要测量的无参可调用对象。
+
+    Args:
+        tolerance: 该基准允许的耗时增幅，用于 fsync、本地HTTP等波动较大的基准。
+        memory_tolerance: 该基准允许的峰值内存增幅，用于峰值随线程调度变化的并发基准。
+    """
+
+    def decorator(setup):
+        BENCHMARKS.append((name, setup))
+        if tolerance is not None:
+            TOLERANCES[name] = tolerance
+        if memory_tolerance is not None:
+            MEMORY_TOLERANCES[name] = memory_tolerance
+        return setup
+
+    return decorator
+
+
+def fixture_path(name):
+    return os.path.join(FIXTURE_DIR, name)
+
+
+def read_fixture(name):
+    with open(fixture_path(name), 'rb') as f:
+        return f.read()
+
+
+def large_email(attachment_size):
+    """在多部件样本的基础上追加指定大小的附件（固定随机种子，每次生成的内容相同）。"""
+    message = BytesParser(policy=policy.default).parsebytes(read_fixture('email_multipart.eml'))
+    payload = random.Random(attachment_size).randbytes(attachment_size)
+    message.add_attachment(payload, maintype='application', subtype='octet-stream', filename='large.bin')
+    return bytes(message)
+
+
+# ---------------------------------------------------------------- 天气预报
+
+@benchmark("rain.extract_weather_data_json")
+def bench_extract_weather():
+    report = rain_report()
+    data = json.loads(read_fixture('qweather_24h.json'))
+    return lambda: report.extract_weather_data_json(data)
+
+
+@benchmark("rain.check_single_location_rain")
+def bench_check_single_location():
+    report = rain_report()
+    weather = report.extract_weather_data_json(json.loads(read_fixture('qweather_24h.json')))
+    return lambda: report.check_single_location_rain(weather)
+
+
+@benchmark("rain.incremental_unchanged[1000]")
+def bench_incremental_unchanged():
+    # 1000个坐标点的预报均已缓存且未变化：预热一次完整运行后，之后的运行整体复用上次结果
+    from function_base.ttl_cache import TTLCache
+
+    forecast = json.loads(read_fixture('qweather_24h.json'))
+    locations = [f"{100 + index * 0.1:.2f},30.00" for index in range(1000)]
+
+    class _CachedReport(rain_report):
+        max_workers = 1
+        dedupe_grid = False
+        _forecast_cache = TTLCache(ttl=24 * 3600, max_entries=len(locations))
+        _rain_evaluator = None
+
+        def grid_weather_24h(self, location):
+            return self.forecast_cache().get(location)
+
+    for location in locations:
+        _CachedReport.forecast_cache().put(location, forecast)
+    report = _CachedReport()
+    with contextlib.redirect_stdout(None):
+        report.check_rain_for_locations(locations)
+
+    def run():
+        with contextlib.redirect_stdout(None):
+            return report.check_rain_for_locations(locations)
+
+    return run
+
+
+# ---------------------------------------------------------------- 密钥
+
+def _load_secrets(path):
+    def run():
+        SecretsManager._secrets = None
+        SecretsManager.load_secrets(path)
+
+    return run
+
+
+@benchmark("secrets.load_secrets[utf8]")
+def bench_load_secrets_utf8():
+    return _load_secrets(fixture_path('secrets_utf8.txt'))
+
+
+@benchmark("secrets.load_secrets[gbk]")
+def bench_load_secrets_gbk():
+    return _load_secrets(fixture_path('secrets_gbk.txt'))
+
+
+# ---------------------------------------------------------------- 钉钉
+
+@benchmark("dingtalk.sign")
+def bench_dingtalk_sign():
+    secret = 'SEC' + 'abcdef0123456789' * 4
+    timestamp = str(round(time.time() * 1000))
+    return lambda: dingtalk_notify.sign(secret, timestamp)
+
+
+def _local_robot_server():
+    """在本机启动返回 {"errcode": 0} 的假钉钉接口，返回其地址。"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            body = b'{"errcode":0,"errmsg":"ok"}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    atexit.register(server.shutdown)
+    return f"http://127.0.0.1:{server.server_address[1]}/robot/send"
+
+
+def _bench_outbox():
+    from function_base.outbox import DurableOutbox
+
+    root = tempfile.mkdtemp(prefix='bench-outbox-')
+    outbox = DurableOutbox(root, lambda payload: True)
+    atexit.register(shutil.rmtree, root, ignore_errors=True)
+    atexit.register(outbox.close)
+    return outbox
+
+
+@benchmark("dingtalk.send_direct[local]", tolerance=0.5)
+def bench_send_direct():
+    # 直接发送（本机假接口，不含公网延迟）作为发件箱开销的对照
+    notifier = dingtalk_notify()
+    notifier.api_url = _local_robot_server()
+    secret = 'SEC' + 'abcdef0123456789' * 4
+    return lambda: notifier.send_via_robot('benchmark', secret, '测试消息')
+
+
+@benchmark("dingtalk.outbox_append", tolerance=0.5)
+def bench_outbox_append():
+    # 单线程写入：每条消息等待一次 write + fsync
+    outbox = _bench_outbox()
+    payload = {'msg': '测试消息', 'at_user_ids': [], 'at_mobiles': [], 'is_at_all': False}
+    return lambda: outbox.append(payload)
+
+
+@benchmark("dingtalk.outbox_append[64 concurrent]", tolerance=0.5, memory_tolerance=0.5)
+def bench_outbox_append_concurrent():
+    # 8个线程同时写入64条消息：组提交把并发写入合并为少量 fsync
+    from concurrent.futures import ThreadPoolExecutor
+
+    outbox = _bench_outbox()
+    executor = ThreadPoolExecutor(max_workers=8)
+    atexit.register(executor.shutdown)
+    payload = {'msg': '测试消息', 'at_user_ids': [], 'at_mobiles': [], 'is_at_all': False}
+
+    def run():
+        for future in [executor.submit(outbox.append, payload) for _ in range(64)]:
+            future.result()
+
+    return run
+
+
+# ---------------------------------------------------------------- 邮件
+
+def _parse_email(raw):
+    monitor = email_monitor()
+    return lambda: monitor.parse_email_bytes(raw)
+
+
+@benchmark("email.parse_email[plain]")
+def bench_parse_plain():
+    return _parse_email(read_fixture('email_plain.eml'))
+
+
+@benchmark("email.parse_email[multipart]")
+def bench_parse_multipart():
+    return _parse_email(read_fixture('email_multipart.eml'))
+
+
+@benchmark("email.parse_email[1MB]")
+def bench_parse_1mb():
+    return _parse_email(large_email(1024 * 1024))
+
+
+@benchmark("email.stream_parse[1MB]")
+def bench_stream_parse_1mb():
+    raw = large_email(1024 * 1024)
+    root = tempfile.mkdtemp(prefix='bench-attachments-')
+    atexit.register(shutil.rmtree, root, ignore_errors=True)
+    store = ContentAddressedStore(root)
+    chunk_size = email_monitor.stream_chunk_size
+
+    def run():
+        parser = StreamingMimeParser(store)
+        for start in range(0, len(raw), chunk_size):
+            parser.feed(raw[start:start + chunk_size])
+        return parser.close()
+
+    return run
+
+
+# ---------------------------------------------------------------- 测量与比较
+
+def _calibration_workload():
+    """固定的纯Python负载（字典、字符串与排序），用于估计本机当前的相对速度。"""
+    counts = {}
+    for i in range(2000):
+        key = f"k{i % 97}"
+        counts[key] = counts.get(key, 0) + i
+    return ",".join(sorted(counts, key=counts.get))
+
+
+def _calls_per_round(func, min_time):
+    """确定每轮的调用次数，使一轮耗时不少于 min_time 秒。"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return number
+        number *= 10 if elapsed < min_time / 10 else 2
+
+
+def _timed_round(func, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def measure(func, repeat=15, min_time=0.05):
+    """返回 {"median_us", "min_us", "relative", "peak_kb"}。
+
+    先自动确定每轮的调用次数，再测 repeat 轮；每轮之前紧接着测一轮校准负载，
+    relative 为基准与校准负载各自多轮最小值之比，机器整体变快或变慢时基本不变。
+    峰值内存在计时结束后单独调用一次测量。
+    """
+    func()  # 预热
+    number = _calls_per_round(func, min_time)
+    calibration_number = _calls_per_round(_calibration_workload, min_time / 5)
+
+    samples, calibration = [], []
+    for _ in range(repeat):
+        calibration.append(_timed_round(_calibration_workload, calibration_number))
+        samples.append(_timed_round(func, number))
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'median_us': round(statistics.median(samples), 3),
+        'min_us': round(min(samples), 3),
+        'relative': round(min(samples) / min(calibration), 5),
+        'peak_kb': round(peak / 1024, 1)
+    }
+
+
+def compare(results, baseline, tolerance, memory_tolerance, memory_slack_kb=16):
+    """返回回退列表：[(基准名, 指标, 基线值, 当前值)]。
+
+    耗时比较 relative（相对校准负载的耗时），不受机器整体快慢的影响；
+    旧基线没有 relative 时退回比较 min_us。
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        metric = 'relative' if 'relative' in previous else 'min_us'
+        if current[metric] > previous[metric] * (1 + TOLERANCES.get(name, tolerance)):
+            regressions.append((name, metric, previous[metric], current[metric]))
+        # 很小的峰值内存波动较大，额外允许 memory_slack_kb 的绝对误差
+        memory_limit = previous['peak_kb'] * (1 + MEMORY_TOLERANCES.get(name, memory_tolerance)) + memory_slack_kb
+        if current['peak_kb'] > memory_limit:
+            regressions.append((name, 'peak_kb', previous['peak_kb'], current['peak_kb']))
+    return regressions
+
+
+def run(selected, repeat):
+    results = {}
+    # 被测函数中的 print 输出不计入结果，也不干扰报告
+    with open(os.devnull, 'w', encoding='utf-8') as devnull:
+        for name, setup in selected:
+            with contextlib.redirect_stdout(devnull):
+                results[name] = measure(setup(), repeat=repeat)
+            print(f"{name:<36} {results[name]['median_us']:>12.2f} us {results[name]['min_us']:>12.2f} us "
+                  f"{results[name]['peak_kb']:>10.1f} KB")
+    SecretsManager._secrets = None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='运行热点函数的微基准测试')
+    parser.add_argument('-k', dest='keyword', help='只运行名称包含该关键字的基准')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线文件路径')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线（与已有基线合并）')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='允许的耗时增幅，默认0.25即25%%')
+    parser.add_argument('--memory-tolerance', type=float, default=0.10, help='允许的峰值内存增幅，默认0.10即10%%')
+    parser.add_argument('--repeat', type=int, default=15, help='每个基准的计时轮数')
+    parser.add_argument('--confirm', type=int, default=2, help='疑似回退的基准最多重测的次数')
+    args = parser.parse_args()
+
+    selected = [(name, setup) for name, setup in BENCHMARKS if not args.keyword or args.keyword in name]
+    print(f"{'基准':<34} {'耗时中位数':>10} {'最小值':>12} {'峰值内存':>10}")
+    results = run(selected, args.repeat)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"基线已保存: {args.baseline}")
+        return 0
+
+    if not baseline:
+        print("没有基线文件，使用 --save-baseline 生成")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+    for _ in range(args.confirm):
+        if not regressions:
+            break
+        # 偶发的干扰只影响一次测量：只有重测后仍然超出容差才算回退，每项指标取各次中的最好值
+        suspects = {name for name, *_ in regressions}
+        print(f"重测 {len(suspects)} 个疑似回退的基准")
+        for name, result in run([(n, setup) for n, setup in selected if n in suspects], args.repeat).items():
+            results[name] = {key: min(value, results[name][key]) for key, value in result.items()}
+        regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+    for name, metric, previous, current in regressions:
+        print(f"性能回退: {name} {metric} {previous} -> {current} ({current / previous - 1:+.0%})")
+    if regressions:
+        return 1
+    print("未发现性能回退")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
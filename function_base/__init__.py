@@ -0,0 +1,50 @@
+"""
+function_base 包
+
+该包提供各功能插件共用的基础设施：
+- scheduler: 常驻调度器，按间隔或cron表达式反复执行服务
+- http_client: 进程级共享的HTTP连接池客户端
+- metrics: 按服务/阶段聚合的耗时与计数指标，支持Prometheus文本导出
+- process_pool: 带任务时限与子进程自动替换的进程池
+- idempotency: 基于SQLite的幂等记录，跳过重复的告警推送与邮件转发
+- outbox: 落盘后再发送的发件箱（分段日志、组提交、启动时重放）
+- resilient_client: 自适应超时、对冲请求、抖动重试与熔断的上游客户端
+"""
+
+import importlib
+
+__all__ = [
+    "CronExpression",
+    "ServiceScheduler",
+    "HttpClient",
+    "MetricsRegistry",
+    "ProcessTaskPool",
+    "IdempotencyStore",
+    "DurableOutbox",
+    "ResilientClient",
+]
+
+# 按需导入：只用到 metrics 或 scheduler 时不必加载 requests
+_LAZY_ATTRIBUTES = {
+    "CronExpression": ".scheduler",
+    "ServiceScheduler": ".scheduler",
+    "HttpClient": ".http_client",
+    "MetricsRegistry": ".metrics",
+    "ProcessTaskPool": ".process_pool",
+    "IdempotencyStore": ".idempotency",
+    "DurableOutbox": ".outbox",
+    "ResilientClient": ".resilient_client",
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,87 @@
+
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpClient:
+    """进程级共享的HTTP客户端。
+
+    每个目标主机（scheme://host:port）对应一个长连接的 requests.Session，
+    连接池在多次调用和调度器的多次触发之间复用，从而避免每次请求都重新进行
+    TCP+TLS握手。会话按需创建，创建过程加锁，可在多个服务线程中并发使用。
+
+    Args:
+        pool_connections: 每个会话缓存的连接池数量。
+        pool_maxsize: 每个主机连接池的最大连接数，应不小于并发线程数。
+        timeout: 默认超时时间（秒），可为 (连接超时, 读取超时) 元组。
+        max_retries: 连接级别的重试次数。
+    """
+
+    DEFAULT_TIMEOUT = (5, 15)
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, pool_connections=4, pool_maxsize=16, timeout=DEFAULT_TIMEOUT, max_retries=0):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """获取进程级共享实例，首次调用时按默认配置创建。"""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    @classmethod
+    def configure(cls, **kwargs):
+        """以新的配置替换共享实例，旧实例的连接会被关闭。"""
+        with cls._shared_lock:
+            old, cls._shared = cls._shared, cls(**kwargs)
+        if old is not None:
+            old.close()
+        return cls._shared
+
+    def _session_for(self, url):
+        parts = urlsplit(url)
+        host_key = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(host_key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host_key)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=self.pool_connections,
+                        pool_maxsize=self.pool_maxsize,
+                        max_retries=self.max_retries
+                    )
+                    session.mount(f"{parts.scheme}://", adapter)
+                    self._sessions[host_key] = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self._session_for(url).request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        """关闭所有会话及其连接池。"""
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
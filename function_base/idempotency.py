@@ -0,0 +1,209 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+class IdempotencyStore:
+    """按键（告警指纹、邮件Message-ID等）记录已完成的操作，用于跳过重复的推送与请求。
+
+    数据保存在WAL模式的SQLite中；打开时把未过期的键全部读入内存字典，
+    查询只访问内存，为O(1)。写入先进入缓冲区，由后台线程按 flush_interval 批量提交
+    （缓冲达到 batch_size 时立即提交），进程退出时自动提交剩余写入。
+    过期的键定期从数据库与内存中清理。
+
+    还未确认完成的操作先用 reserve() 以较短的 pending_ttl 占位，完成后再由
+    confirm_on_success() 回调改为正式的过期时间；进程在完成前退出时占位很快过期，
+    下一次运行可以重试，而不会在整个 ttl 内被误判为已完成。
+
+    多个进程共用同一数据库文件时，各进程的内存视图只在打开时同步一次，
+    check_and_mark 只在单个进程内是原子的。
+
+    Args:
+        path: 数据库文件路径。
+        flush_interval: 批量提交的间隔（秒）。
+        batch_size: 缓冲的写入达到该数量时立即提交。
+        compact_interval: 清理过期键的间隔（秒）。
+        pending_ttl: reserve() 占位的有效期（秒）。
+    """
+
+    DEFAULT_FILE_PATH = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'ignore_file',
+        'idempotency.sqlite3'
+    )
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path=None, flush_interval=1.0, batch_size=100, compact_interval=3600, pending_ttl=600):
+        self.path = path or self.DEFAULT_FILE_PATH
+        self.pending_ttl = pending_ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.compact_interval = compact_interval
+        self._expires = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._closed = False
+        self._last_compact = time.time()
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+            "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, created_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys (expires_at)")
+        now = time.time()
+        for key, expires_at in self._conn.execute(
+                "SELECT key, expires_at FROM idempotency_keys WHERE expires_at > ?", (now,)):
+            self._expires[key] = expires_at
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="IdempotencyFlush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def shared(cls):
+        """获取进程级共享实例，使用默认数据库文件。"""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def seen(self, key):
+        """键存在且未过期时返回True。"""
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at > time.time():
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def mark(self, key, ttl):
+        """记录键，ttl 秒后过期。"""
+        now = time.time()
+        with self._lock:
+            self._expires[key] = now + ttl
+            self._pending[key] = (now + ttl, now)
+            pending = len(self._pending)
+        if pending >= self.batch_size:
+            self._flush_event.set()
+
+    def check_and_mark(self, key, ttl):
+        """键不存在时记录并返回True；已存在（重复操作）时返回False。"""
+        now = time.time()
+        with self._lock:
+            expires_at = self._expires.get(key)
+            if expires_at is not None and expires_at > now:
+                self.hits += 1
+                return False
+            self.misses += 1
+            self._expires[key] = now + ttl
+            self._pending[key] = (now + ttl, now)
+            pending = len(self._pending)
+        if pending >= self.batch_size:
+            self._flush_event.set()
+        return True
+
+    def reserve(self, key):
+        """为即将执行的操作占位（有效期 pending_ttl）；键已存在时返回False。"""
+        return self.check_and_mark(key, self.pending_ttl)
+
+    def forget(self, key):
+        """删除键，例如操作失败、需要允许重试时。"""
+        with self._lock:
+            self._expires.pop(key, None)
+            # 过期时间为0的写入在提交时会覆盖数据库中的记录，随后被清理
+            self._pending[key] = (0, time.time())
+        self._flush_event.set()
+
+    @staticmethod
+    def confirm_on_success(store, key, ttl):
+        """返回Future完成回调：操作成功后把 reserve() 的占位改为 ttl 秒后过期；
+        抛出异常或钉钉返回非零errcode时删除键，下一次可以重试。"""
+        def callback(future):
+            if future.exception() is not None:
+                store.forget(key)
+                return
+            # 经发件箱发送时结果为True，直接发送时为钉钉API响应
+            result = future.result()
+            if isinstance(result, dict) and result.get('errcode', 0) != 0:
+                store.forget(key)
+            else:
+                store.mark(key, ttl)
+        return callback
+
+    def flush(self):
+        """把缓冲的写入在一个事务中提交。"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        rows = [(key, expires_at, created_at) for key, (expires_at, created_at) in pending.items()]
+        with self._db_lock:
+            try:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO idempotency_keys (key, expires_at, created_at) VALUES (?, ?, ?)", rows
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._conn.execute("ROLLBACK")
+                logging.error("提交幂等记录失败: %s", e)
+                with self._lock:
+                    for key, value in pending.items():
+                        self._pending.setdefault(key, value)
+                return 0
+        return len(rows)
+
+    def compact(self):
+        """清理数据库与内存中已过期的键，返回删除的行数。"""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, expires_at in self._expires.items() if expires_at <= now]
+            for key in expired:
+                del self._expires[key]
+        with self._db_lock:
+            deleted = self._conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,)).rowcount
+        self._last_compact = now
+        return deleted
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            if self._closed:
+                break
+            try:
+                self.flush()
+                if time.time() - self._last_compact >= self.compact_interval:
+                    self.compact()
+            except Exception as e:
+                logging.error("幂等记录后台提交出错: %s", e)
+
+    def stats(self):
+        return {'keys': len(self._expires), 'pending': len(self._pending), 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        """提交剩余写入并关闭数据库。"""
+        if self._closed:
+            return
+        self._closed = True
+        self._flush_event.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
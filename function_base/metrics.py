@@ -0,0 +1,258 @@
+
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 直方图桶上界（秒），覆盖从毫秒级的签名到分钟级的IMAP同步
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _quantile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """耗时直方图：累计分桶计数用于Prometheus导出，最近 window 个样本用于计算分位数。"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1024):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, seconds, error=False):
+        self.bucket_counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+        self._recent.append(seconds)
+
+    def quantiles(self, quantiles=QUANTILES):
+        recent = sorted(self._recent)
+        return {q: _quantile(recent, q) for q in quantiles}
+
+
+class Span:
+    """一次计时区间，结束后 elapsed 为耗时（秒）。"""
+
+    __slots__ = ('service', 'phase', 'start', 'elapsed', 'error')
+
+    def __init__(self, service, phase):
+        self.service = service
+        self.phase = phase
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.error = False
+
+
+class MetricsRegistry:
+    """按 服务/阶段 聚合耗时与计数的指标注册表。
+
+    插件通过 span() 记录某个阶段的耗时（例如密钥读取、JWT签名、HTTP往返、
+    JSON解码、IMAP获取），通过 inc() 记录计数；区间内抛出异常时同时计入错误数。
+    结果可以通过本地HTTP端点以Prometheus文本格式导出，也可以定期写入日志。
+
+    Args:
+        buckets: 直方图桶上界（秒）。
+        window: 每个 服务/阶段 保留用于计算分位数的最近样本数。
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1024):
+        self.buckets = tuple(buckets)
+        self.window = window
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._dump_stop = None
+
+    @classmethod
+    def shared(cls):
+        """获取进程级共享实例。"""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    @contextmanager
+    def span(self, service, phase):
+        """记录代码块的耗时：with metrics.span("rain_report", "http"): ..."""
+        span = Span(service, phase)
+        try:
+            yield span
+        except BaseException:
+            span.error = True
+            raise
+        finally:
+            span.elapsed = time.perf_counter() - span.start
+            self.observe(service, phase, span.elapsed, error=span.error)
+
+    def observe(self, service, phase, seconds, error=False):
+        key = (service, phase)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets, self.window)
+            histogram.observe(seconds, error)
+
+    def inc(self, name, value=1, **labels):
+        """计数器加 value，name 按Prometheus惯例以 _total 结尾。"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self):
+        """返回 {"phases": {(服务, 阶段): {...}}, "counters": {(名称, 标签): 值}}。"""
+        with self._lock:
+            phases = {
+                key: {
+                    'count': histogram.count,
+                    'errors': histogram.errors,
+                    'sum': histogram.sum,
+                    'buckets': list(histogram.bucket_counts),
+                    'quantiles': histogram.quantiles()
+                }
+                for key, histogram in self._histograms.items()
+            }
+            counters = dict(self._counters)
+        return {'phases': phases, 'counters': counters}
+
+    def render_prometheus(self):
+        """以Prometheus文本格式导出全部指标。"""
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP service_phase_duration_seconds 各服务各阶段耗时",
+            "# TYPE service_phase_duration_seconds histogram"
+        ]
+        for (service, phase), data in sorted(snapshot['phases'].items()):
+            base = (('service', service), ('phase', phase))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), data['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f"service_phase_duration_seconds_bucket{_labels(base + (('le', le),))} {cumulative}")
+            lines.append(f"service_phase_duration_seconds_sum{_labels(base)} {data['sum']}")
+            lines.append(f"service_phase_duration_seconds_count{_labels(base)} {data['count']}")
+
+        lines += [
+            "# HELP service_phase_duration_quantile_seconds 最近样本的耗时分位数",
+            "# TYPE service_phase_duration_quantile_seconds gauge"
+        ]
+        for (service, phase), data in sorted(snapshot['phases'].items()):
+            for q, value in data['quantiles'].items():
+                labels = _labels((('service', service), ('phase', phase), ('quantile', q)))
+                lines.append(f"service_phase_duration_quantile_seconds{labels} {value}")
+
+        lines += [
+            "# HELP service_phase_errors_total 各服务各阶段抛出异常的次数",
+            "# TYPE service_phase_errors_total counter"
+        ]
+        for (service, phase), data in sorted(snapshot['phases'].items()):
+            lines.append(f"service_phase_errors_total{_labels((('service', service), ('phase', phase)))} {data['errors']}")
+
+        typed = set()
+        for (name, labels), value in sorted(snapshot['counters'].items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """返回便于阅读的汇总文本，每个 服务/阶段 一行。"""
+        snapshot = self.snapshot()
+        lines = []
+        for (service, phase), data in sorted(snapshot['phases'].items()):
+            quantiles = data['quantiles']
+            lines.append(
+                f"{service}/{phase}: 次数={data['count']} 错误={data['errors']} "
+                f"p50={quantiles[0.5] * 1000:.1f}ms p95={quantiles[0.95] * 1000:.1f}ms "
+                f"p99={quantiles[0.99] * 1000:.1f}ms"
+            )
+        for (name, labels), value in sorted(snapshot['counters'].items()):
+            lines.append(f"{name}{_labels(labels)} = {value}")
+        return "\n".join(lines)
+
+    def start_http_server(self, port=9108, host='127.0.0.1'):
+        """在后台线程中启动 /metrics 端点，返回实际监听的端口（port=0 时自动分配）。"""
+        if self._server is not None:
+            return self._server.server_address[1]
+        registry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("指标端点: " + format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="MetricsHttp", daemon=True).start()
+        logging.info("指标端点已启动: http://%s:%d/metrics", host, self._server.server_address[1])
+        return self._server.server_address[1]
+
+    def start_periodic_dump(self, interval=300):
+        """启动后台线程，每 interval 秒把汇总写入日志。"""
+        if self._dump_stop is not None:
+            return
+        self._dump_stop = threading.Event()
+
+        def loop(stop_event):
+            while not stop_event.wait(interval):
+                logging.info("指标汇总:\n%s", self.summary())
+
+        threading.Thread(target=loop, args=(self._dump_stop,), name="MetricsDump", daemon=True).start()
+
+    def stop(self):
+        """停止HTTP端点和定期汇总线程。"""
+        if self._dump_stop is not None:
+            self._dump_stop.set()
+            self._dump_stop = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def span(service, phase):
+    """在共享注册表上记录耗时，见 MetricsRegistry.span。"""
+    return MetricsRegistry.shared().span(service, phase)
+
+
+def inc(name, value=1, **labels):
+    """在共享注册表上累加计数，见 MetricsRegistry.inc。"""
+    MetricsRegistry.shared().inc(name, value, **labels)
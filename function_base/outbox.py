@@ -0,0 +1,478 @@
+
+import atexit
+import heapq
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 每条记录：4字节长度 + 4字节CRC32（大端），随后是UTF-8编码的JSON
+_HEADER = struct.Struct('>II')
+_SEGMENT_SUFFIX = '.log'
+DEAD_LETTER_FILE = 'dead_letter.jsonl'
+
+
+class UndeliverableError(Exception):
+    """handler 抛出此异常表示消息无法投递（如配置错误），不再重试，直接转入死信。"""
+
+
+def _encode(record):
+    body = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return _HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def _read_segment(path):
+    """读取段文件中的全部完整记录；返回 (记录列表, 最后一条完整记录的结束位置, 是否有残缺尾部)。"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    records = []
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, offset)
+        start = offset + _HEADER.size
+        body = data[start:start + length]
+        if len(body) < length or zlib.crc32(body) != crc:
+            break
+        try:
+            records.append(json.loads(body))
+        except ValueError:
+            break
+        offset = start + length
+    return records, offset, offset != len(data)
+
+
+def _try_lock(file):
+    """对打开的锁文件加非阻塞的独占锁，成功返回True。"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _lock_directory(directory):
+    """锁定发件箱目录；已被其他进程占用时依次尝试 directory.1、directory.2 ……
+
+    返回 (实际使用的目录, 锁文件对象)，锁在进程退出或文件关闭时释放。
+    """
+    index = 0
+    while True:
+        path = directory if index == 0 else f"{directory}.{index}"
+        os.makedirs(path, exist_ok=True)
+        lock_file = open(os.path.join(path, 'LOCK'), 'a+b')
+        if _try_lock(lock_file):
+            return path, lock_file
+        lock_file.close()
+        index += 1
+
+
+class _Segment:
+    __slots__ = ('seq', 'path', 'unacked', 'size')
+
+    def __init__(self, seq, path, size=0):
+        self.seq = seq
+        self.path = path
+        self.unacked = 0
+        self.size = size
+
+
+class _Append:
+    __slots__ = ('data', 'event', 'entry', 'error')
+
+    def __init__(self, data, entry=None):
+        self.data = data
+        self.event = threading.Event()
+        self.entry = entry
+        self.error = None
+
+
+class DurableOutbox:
+    """落盘后再发送的消息发件箱（只追加的分段日志 + 组提交）。
+
+    append() 把消息写入当前段文件，由提交线程把同一时刻到达的多条写入合并为一次
+    write + fsync（组提交），调用方在消息落盘后返回，fsync 的开销由并发写入分摊。
+    submit() 与 append() 相同，但返回在消息确认或转入死信时完成的 Future。
+    已落盘的消息交给发送线程池调用 handler(payload)：返回True表示完成，写入确认记录；
+    返回False或抛出异常时按指数退避重试（retry_interval、2×retry_interval……，
+    不超过 max_retry_interval），每次失败写入一条失败记录，重启后继续累计次数。
+    handler 也可以返回 concurrent.futures.Future（结果为上述布尔值），发送线程不必等待。
+    失败达到 max_attempts 次或 handler 抛出 UndeliverableError 时，消息连同错误信息
+    追加到目录下的 dead_letter.jsonl（死信），并写入死信记录，之后不再重放。
+    段文件达到 segment_size 后切换到新段，最早的段中的消息全部确认后删除该段。
+
+    每个目录同一时间只由一个进程使用（文件锁），其他进程（如进程池中的子进程）
+    自动改用 directory.1、directory.2 等目录，重启后由获得该目录的进程重放。
+    启动时按顺序重放全部段文件，没有确认记录的消息重新发送（至少一次语义：
+    进程在发送成功与写入确认之间退出时，消息会在下次启动时再发送一次）。
+    最后一个段尾部不完整的记录（写入一半时断电）会被截断。
+
+    Args:
+        directory: 段文件所在目录。
+        handler: 发送函数 handler(payload) -> bool 或 Future。
+        segment_size: 单个段文件的大小上限（字节）。
+        retry_interval: 第一次失败后的重试间隔（秒），之后每次翻倍。
+        max_retry_interval: 重试间隔的上限（秒）。
+        max_attempts: 每条消息最多尝试发送的次数，None 表示不限。
+        workers: 发送线程数。
+        fsync: 是否在每次组提交时调用 os.fsync，关闭后只保证写入操作系统缓存。
+    """
+
+    def __init__(self, directory, handler, segment_size=4 * 1024 * 1024, retry_interval=5.0, max_retry_interval=300.0,
+                 max_attempts=10, workers=2, fsync=True):
+        self.directory = directory
+        self.handler = handler
+        self.segment_size = segment_size
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.max_attempts = max_attempts
+        self.fsync = fsync
+        self._segments = []
+        self._entry_segments = {}
+        self._attempts = {}
+        # submit() 返回的Future，消息确认或转入死信时完成
+        self._watchers = {}
+        self._dead_letter_lock = threading.Lock()
+        self._queue = []
+        self._committed = []
+        self._retry_heap = []
+        self._condition = threading.Condition()
+        self._drain_condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="OutboxSend")
+        self._in_flight = 0
+        self._closed = False
+        self.appended = 0
+        self.acked = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.commits = 0
+        self.replayed = 0
+
+        self.directory, self._lock_file = _lock_directory(directory)
+        pending = self._replay()
+        self._next_id = max([entry_id for entry_id, _ in pending] + [self._last_id], default=0) + 1
+        self._open_segment((self._segments[-1].seq if self._segments else 0) + 1)
+
+        self._committer = threading.Thread(target=self._commit_loop, name="OutboxCommit", daemon=True)
+        self._committer.start()
+        self._drainer = threading.Thread(target=self._drain_loop, name="OutboxDrain", daemon=True)
+        self._drainer.start()
+        with self._drain_condition:
+            self._committed.extend(pending)
+            self._drain_condition.notify()
+        atexit.register(self.close)
+
+    # ------------------------------------------------------------ 重放与段文件
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{seq:08d}{_SEGMENT_SUFFIX}")
+
+    def _replay(self):
+        """读取已有段文件，返回未确认的 [(消息ID, payload)]，按写入顺序排列。"""
+        self._last_id = 0
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(_SEGMENT_SUFFIX))
+        pending = {}
+        for name in names:
+            path = os.path.join(self.directory, name)
+            records, valid_size, torn = _read_segment(path)
+            if torn:
+                logging.warning("发件箱段 %s 尾部有不完整的记录，截断到 %d 字节", name, valid_size)
+                with open(path, 'r+b') as f:
+                    f.truncate(valid_size)
+            segment = _Segment(int(name[:-len(_SEGMENT_SUFFIX)]), path, valid_size)
+            self._segments.append(segment)
+            for record in records:
+                entry_id = record['id']
+                self._last_id = max(self._last_id, entry_id)
+                if record['op'] == 'put':
+                    pending[entry_id] = (segment, record['data'])
+                elif record['op'] == 'fail':
+                    self._attempts[entry_id] = self._attempts.get(entry_id, 0) + 1
+                elif record['op'] in ('ack', 'dead'):
+                    pending.pop(entry_id, None)
+                    self._attempts.pop(entry_id, None)
+
+        for entry_id, (segment, _) in pending.items():
+            segment.unacked += 1
+            self._entry_segments[entry_id] = segment
+        self._remove_acked_segments(keep_last=False)
+        self.replayed = len(pending)
+        if pending:
+            logging.info("发件箱重放 %d 条未确认的消息", len(pending))
+        return [(entry_id, data) for entry_id, (_, data) in sorted(pending.items())]
+
+    def _open_segment(self, seq):
+        segment = _Segment(seq, self._segment_path(seq))
+        self._file = open(segment.path, 'ab')
+        self._segments.append(segment)
+        self._active = segment
+
+    def _remove_acked_segments(self, keep_last=True):
+        """按顺序删除最早的、消息已全部确认的段。
+
+        只删除前缀，保证留下的段中消息的确认记录（总是写在同一段或更新的段里）不会丢失。
+        """
+        while self._segments and self._segments[0].unacked == 0:
+            if keep_last and len(self._segments) == 1:
+                break
+            segment = self._segments.pop(0)
+            try:
+                os.remove(segment.path)
+            except OSError as e:
+                logging.warning("删除发件箱段 %s 失败: %s", segment.path, e)
+
+    # ------------------------------------------------------------ 写入与组提交
+
+    def append(self, payload, wait=True):
+        """写入一条消息，wait=True 时阻塞到消息落盘；返回消息ID。
+
+        Raises:
+            OSError: wait=True 且写盘失败时。
+        """
+        return self._append(payload, wait)
+
+    def submit(self, payload):
+        """写入一条消息并阻塞到落盘，返回 concurrent.futures.Future。
+
+        消息确认后 Future 结果为True，转入死信时为发送失败的异常；future.entry_id 为消息ID。
+        进程在发送完成前退出时 Future 不会完成，消息在下次启动时重放。
+
+        Raises:
+            OSError: 写盘失败时。
+        """
+        future = Future()
+        future.entry_id = self._append(payload, True, future)
+        return future
+
+    def _append(self, payload, wait, future=None):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("发件箱已关闭")
+            entry_id = self._next_id
+            self._next_id += 1
+            request = _Append(_encode({'op': 'put', 'id': entry_id, 'data': payload}), (entry_id, payload))
+            self._queue.append(request)
+            self.appended += 1
+            if future is not None:
+                self._watchers[entry_id] = future
+            self._condition.notify()
+        if wait:
+            request.event.wait()
+            if request.error is not None:
+                with self._condition:
+                    self._watchers.pop(entry_id, None)
+                raise request.error
+        return entry_id
+
+    def _record(self, op, entry_id):
+        # 确认、失败与死信记录不需要等待落盘：丢失时只会导致重复发送或少计一次失败，符合至少一次语义
+        with self._condition:
+            self._queue.append(_Append(_encode({'op': op, 'id': entry_id})))
+            self._condition.notify()
+
+    def _commit_loop(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue and self._closed:
+                    return
+                batch, self._queue = self._queue, []
+            try:
+                self._commit(batch)
+            except OSError as e:
+                # 写盘失败：截掉可能写了一半的数据，避免后续记录在重放时被丢弃，并把错误交给等待者
+                logging.error("发件箱写入失败: %s", e)
+                try:
+                    self._file.truncate(self._active.size)
+                except OSError:
+                    pass
+                for request in batch:
+                    request.error = e
+                    request.event.set()
+                continue
+            with self._drain_condition:
+                self._committed.extend(request.entry for request in batch if request.entry is not None)
+                self._drain_condition.notify()
+            for request in batch:
+                request.event.set()
+
+    def _commit(self, batch):
+        data = b''.join(request.data for request in batch)
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.commits += 1
+        with self._condition:
+            self._active.size += len(data)
+            for request in batch:
+                if request.entry is not None:
+                    self._entry_segments[request.entry[0]] = self._active
+                    self._active.unacked += 1
+            if self._active.size >= self.segment_size:
+                self._file.close()
+                self._open_segment(self._active.seq + 1)
+            self._remove_acked_segments()
+
+    # ------------------------------------------------------------ 发送
+
+    def _drain_loop(self):
+        while True:
+            with self._drain_condition:
+                now = time.monotonic()
+                while self._retry_heap and self._retry_heap[0][0] <= now:
+                    _, entry_id, payload = heapq.heappop(self._retry_heap)
+                    self._committed.append((entry_id, payload))
+                if self._closed:
+                    # 已关闭：未发送的消息留在段文件中，下次启动时重放
+                    return
+                if not self._committed:
+                    timeout = self._retry_heap[0][0] - now if self._retry_heap else None
+                    self._drain_condition.wait(timeout)
+                    continue
+                ready, self._committed = self._committed, []
+                self._in_flight += len(ready)
+            for entry_id, payload in ready:
+                try:
+                    self._executor.submit(self._send, entry_id, payload)
+                except RuntimeError:
+                    # 解释器退出时线程池已不接受新任务，改在当前线程发送
+                    self._send(entry_id, payload)
+
+    def _send(self, entry_id, payload):
+        try:
+            result = self.handler(payload)
+        except Exception as e:
+            self._complete(entry_id, payload, False, e)
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: self._complete_future(entry_id, payload, future))
+        else:
+            self._complete(entry_id, payload, bool(result))
+
+    def _complete_future(self, entry_id, payload, future):
+        try:
+            done = bool(future.result())
+        except Exception as e:
+            self._complete(entry_id, payload, False, e)
+        else:
+            self._complete(entry_id, payload, done)
+
+    def retry_delay(self, attempts):
+        """第 attempts 次失败后的重试间隔：指数退避，不超过 max_retry_interval。"""
+        return min(self.max_retry_interval, self.retry_interval * (2 ** (attempts - 1)))
+
+    def _complete(self, entry_id, payload, done, error=None):
+        dead = isinstance(error, UndeliverableError)
+        delay = None
+        if not done and not dead:
+            with self._condition:
+                attempts = self._attempts[entry_id] = self._attempts.get(entry_id, 0) + 1
+            if self.max_attempts is not None and attempts >= self.max_attempts:
+                dead = True
+            else:
+                delay = self.retry_delay(attempts)
+                self._record('fail', entry_id)
+                logging.warning("发件箱消息 %d 第 %d 次发送失败，%.0f 秒后重试: %s",
+                                entry_id, attempts, delay, error or "handler 返回失败")
+
+        if done or dead:
+            if dead:
+                self._dead_letter(entry_id, payload, error)
+            self._record('dead' if dead else 'ack', entry_id)
+            with self._condition:
+                segment = self._entry_segments.pop(entry_id, None)
+                if segment is not None:
+                    segment.unacked -= 1
+                self._attempts.pop(entry_id, None)
+                watcher = self._watchers.pop(entry_id, None)
+                if dead:
+                    self.dead_lettered += 1
+                else:
+                    self.acked += 1
+            if watcher is not None:
+                if dead:
+                    watcher.set_exception(error or UndeliverableError(f"消息 {entry_id} 超过最大尝试次数"))
+                else:
+                    watcher.set_result(True)
+        with self._drain_condition:
+            self._in_flight -= 1
+            if delay is not None:
+                self.retried += 1
+                heapq.heappush(self._retry_heap, (time.monotonic() + delay, entry_id, payload))
+            self._drain_condition.notify_all()
+
+    def _dead_letter(self, entry_id, payload, error):
+        """把无法投递的消息追加到死信文件，供人工排查或补发。"""
+        attempts = self._attempts.get(entry_id, 0)
+        logging.error("发件箱消息 %d 无法投递（已尝试 %d 次），转入死信: %s", entry_id, attempts, error)
+        line = json.dumps({
+            'id': entry_id,
+            'data': payload,
+            'attempts': attempts,
+            'error': None if error is None else f"{type(error).__name__}: {error}",
+            'time': time.time()
+        }, ensure_ascii=False)
+        with self._dead_letter_lock:
+            try:
+                with open(os.path.join(self.directory, DEAD_LETTER_FILE), 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+            except OSError as e:
+                logging.error("写入死信文件失败: %s，消息内容: %s", e, line)
+
+    def pending(self):
+        """返回尚未确认的消息数。"""
+        with self._condition:
+            return len(self._entry_segments) + sum(1 for request in self._queue if request.entry is not None)
+
+    def stats(self):
+        with self._condition:
+            segments = len(self._segments)
+        return {
+            'pending': self.pending(),
+            'appended': self.appended,
+            'acked': self.acked,
+            'retried': self.retried,
+            'dead_lettered': self.dead_lettered,
+            'replayed': self.replayed,
+            'commits': self.commits,
+            'segments': segments
+        }
+
+    def close(self, timeout=10):
+        """等待已落盘的消息在 timeout 秒内发送完毕，然后停止后台线程。
+
+        超时或发送失败的消息仍保存在段文件中，下次启动时重放。
+        """
+        deadline = time.monotonic() + timeout
+        with self._drain_condition:
+            if self._closed:
+                return
+            while (self._committed or self._in_flight) and time.monotonic() < deadline:
+                self._drain_condition.wait(max(0.0, deadline - time.monotonic()))
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        with self._drain_condition:
+            self._drain_condition.notify_all()
+        self._committer.join(timeout=5)
+        self._executor.shutdown(wait=False)
+        with self._condition:
+            self._file.close()
+        self._lock_file.close()
@@ -0,0 +1,301 @@
+
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+
+class TaskTimeout(Exception):
+    """任务超过时限，执行它的子进程已被终止。"""
+
+
+class WorkerCrashed(Exception):
+    """执行任务的子进程意外退出。"""
+
+
+class RemoteError(Exception):
+    """任务在子进程中抛出的异常，remote_traceback 为子进程中的堆栈文本。"""
+
+    def __init__(self, type_name, message, remote_traceback):
+        super().__init__(f"{type_name}: {message}")
+        self.type_name = type_name
+        self.remote_traceback = remote_traceback
+
+
+def _worker_main(conn):
+    """子进程主循环：从管道接收 (任务ID, 函数, 位置参数, 关键字参数)，回传 (任务ID, 是否成功, 结果, 耗时)。
+
+    spawn 启动的子进程返回后经 sys.exit 正常退出，atexit 回调（缓存落盘、后台队列发送）照常执行。
+    """
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        task_id, func, args, kwargs = message
+        start = time.perf_counter()
+        try:
+            reply = (task_id, True, func(*args, **kwargs))
+        except BaseException as e:
+            reply = (task_id, False, (type(e).__name__, str(e), traceback.format_exc()))
+        elapsed = time.perf_counter() - start
+        try:
+            conn.send(reply + (elapsed,))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # 结果无法序列化（如返回了线程、连接对象）时只回传其文本表示
+            conn.send((task_id, reply[1], repr(reply[2]), elapsed))
+
+
+class _Worker:
+    __slots__ = ('process', 'conn', 'task', 'deadline', 'tasks_done')
+
+    def __init__(self, context):
+        parent_conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.task = None
+        self.deadline = None
+        self.tasks_done = 0
+
+
+class _Task:
+    __slots__ = ('task_id', 'func', 'args', 'kwargs', 'timeout', 'future')
+
+    def __init__(self, task_id, func, args, kwargs, timeout):
+        self.task_id = task_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.future = Future()
+
+
+class ProcessTaskPool:
+    """在常驻子进程中执行任务的进程池。
+
+    每个子进程通过一条 Pipe 与父进程通信，任务和结果以 pickle 后的元组传输；
+    父进程中的调度线程负责派发任务、收取结果并监控子进程：任务超时时终止该子进程，
+    子进程意外退出时把任务标记为失败，两种情况下都会启动新的子进程补位。
+
+    stats() 中的 restarts 只统计子进程崩溃或超时被终止后补位启动的进程，
+    首次按需启动与达到 max_tasks_per_worker 后的替换不计入。
+
+    submit() 返回 concurrent.futures.Future，完成后 future.elapsed 为子进程内的执行耗时（秒），
+    future.worker_pid 为执行它的子进程号。
+
+    Args:
+        max_workers: 子进程数，默认CPU核数。
+        task_timeout: 默认的单个任务时限（秒），None 表示不限。
+        start_method: 子进程启动方式，默认 spawn，避免复制父进程中的线程与连接状态；
+            fork/forkserver 启动的子进程退出时不执行 atexit 回调。
+        max_tasks_per_worker: 每个子进程最多执行的任务数，达到后替换为新进程，None 表示不限。
+    """
+
+    def __init__(self, max_workers=None, task_timeout=300, start_method='spawn', max_tasks_per_worker=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.task_timeout = task_timeout
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self._context = multiprocessing.get_context(start_method)
+        self._task_ids = itertools.count(1)
+        self._pending = deque()
+        self._workers = []
+        self._retired = []
+        self._lock = threading.Lock()
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(duplex=False)
+        self._closing = False
+        self._dispatcher = None
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.restarts = 0
+        # 崩溃或超时后尚未补位的子进程数
+        self._replacements_due = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def submit(self, func, *args, timeout=None, **kwargs):
+        """提交任务。func 与参数必须可被 pickle（模块级函数、类等）。
+
+        Args:
+            timeout: 本任务的时限（秒），默认使用 task_timeout。
+        """
+        task = _Task(next(self._task_ids), func, args, kwargs, timeout if timeout is not None else self.task_timeout)
+        with self._lock:
+            if self._closing:
+                raise RuntimeError("进程池已关闭")
+            self._pending.append(task)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, name="ProcessPoolDispatcher",
+                                                    daemon=True)
+                self._dispatcher.start()
+        self._wake()
+        return task.future
+
+    def _wake(self):
+        try:
+            self._wakeup_writer.send_bytes(b'')
+        except OSError:
+            pass
+
+    def _dispatch_loop(self):
+        while True:
+            self._assign_pending()
+            with self._lock:
+                if self._closing and not self._pending and all(w.task is None for w in self._workers):
+                    break
+
+            busy = [worker for worker in self._workers if worker.task is not None]
+            deadlines = [worker.deadline for worker in busy if worker.deadline is not None]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            waitables = [self._wakeup_reader] + [w.conn for w in busy] + [w.process.sentinel for w in self._workers]
+            ready = wait(waitables, timeout)
+
+            if self._wakeup_reader in ready:
+                while self._wakeup_reader.poll():
+                    self._wakeup_reader.recv_bytes()
+            for worker in list(self._workers):
+                if worker.task is not None and worker.conn in ready:
+                    self._receive(worker)
+                elif worker.process.sentinel in ready:
+                    self._handle_exit(worker)
+            self._check_deadlines()
+        self._shutdown_workers()
+
+    def _assign_pending(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return
+                worker = next((w for w in self._workers if w.task is None), None)
+                if worker is None and len(self._workers) >= self.max_workers:
+                    return
+                task = self._pending.popleft()
+            if not task.future.set_running_or_notify_cancel():
+                continue
+            if worker is None:
+                worker = _Worker(self._context)
+                self._workers.append(worker)
+                if self._replacements_due:
+                    self._replacements_due -= 1
+                    self.restarts += 1
+            try:
+                worker.conn.send((task.task_id, task.func, task.args, task.kwargs))
+            except Exception as e:
+                # 任务本身无法序列化，子进程不受影响
+                task.future.set_exception(e)
+                self.failed += 1
+                continue
+            worker.task = task
+            worker.deadline = time.monotonic() + task.timeout if task.timeout is not None else None
+
+    def _receive(self, worker):
+        try:
+            task_id, ok, result, elapsed = worker.conn.recv()
+        except (EOFError, OSError):
+            self._handle_exit(worker)
+            return
+        task, worker.task, worker.deadline = worker.task, None, None
+        worker.tasks_done += 1
+        task.future.elapsed = elapsed
+        task.future.worker_pid = worker.process.pid
+        if ok:
+            self.completed += 1
+            task.future.set_result(result)
+        else:
+            self.failed += 1
+            task.future.set_exception(RemoteError(*result))
+        if self.max_tasks_per_worker and worker.tasks_done >= self.max_tasks_per_worker:
+            self._retire(worker)
+
+    def _handle_exit(self, worker):
+        worker.process.join(timeout=1)
+        task = worker.task
+        self._workers.remove(worker)
+        worker.conn.close()
+        self._replacements_due += 1
+        if task is not None:
+            self.crashes += 1
+            logging.warning("子进程 %s 意外退出（退出码 %s），任务 %s 失败",
+                            worker.process.pid, worker.process.exitcode, task.task_id)
+            task.future.set_exception(
+                WorkerCrashed(f"子进程 {worker.process.pid} 意外退出，退出码 {worker.process.exitcode}")
+            )
+
+    def _check_deadlines(self):
+        now = time.monotonic()
+        for worker in list(self._workers):
+            if worker.task is not None and worker.deadline is not None and worker.deadline <= now:
+                task = worker.task
+                logging.warning("任务 %s 超过 %s 秒，终止子进程 %s", task.task_id, task.timeout, worker.process.pid)
+                self._kill(worker)
+                self._workers.remove(worker)
+                self.timeouts += 1
+                self._replacements_due += 1
+                task.future.set_exception(TaskTimeout(f"任务超过 {task.timeout} 秒"))
+
+    def _retire(self, worker):
+        self._workers.remove(worker)
+        self._retired.append(worker)
+        try:
+            worker.conn.send(None)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _kill(worker):
+        worker.process.terminate()
+        worker.process.join(timeout=2)
+        if worker.process.is_alive():
+            worker.process.kill()
+            worker.process.join()
+        worker.conn.close()
+
+    def _shutdown_workers(self):
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in self._workers + self._retired:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                self._kill(worker)
+            worker.conn.close()
+        self._workers = []
+        self._retired = []
+
+    def stats(self):
+        return {
+            'workers': len(self._workers),
+            'pending': len(self._pending),
+            'completed': self.completed,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+            'crashes': self.crashes,
+            'restarts': self.restarts
+        }
+
+    def close(self, wait=True):
+        """不再接受新任务；wait=True 时等待已提交的任务完成后退出全部子进程。"""
+        with self._lock:
+            self._closing = True
+            dispatcher = self._dispatcher
+        self._wake()
+        if dispatcher is not None and wait:
+            dispatcher.join()
@@ -0,0 +1,59 @@
+
+import threading
+import time
+
+
+class TokenBucket:
+    """线程安全的令牌桶限流器。
+
+    Args:
+        rate: 每秒补充的令牌数，例如钉钉机器人每分钟20条即 20 / 60。
+        capacity: 桶容量，即允许的最大突发数。
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, count):
+        return cls(count / 60.0, count)
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """尝试立即取出令牌，成功返回True，不阻塞。"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens=1):
+        """返回还需等待多少秒才能取出指定数量的令牌。"""
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = tokens - self._tokens
+            return 0.0 if missing <= 0 else missing / self.rate
+
+    def acquire(self, tokens=1, timeout=None):
+        """阻塞直到取出令牌；超过timeout仍未取得则返回False。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.try_acquire(tokens):
+                return True
+            wait = self.wait_time(tokens)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
@@ -0,0 +1,316 @@
+"""
+上游接口的弹性请求客户端
+
+- CircuitBreaker: 按连续失败次数打开、超时后半开探测的熔断器
+- Endpoint: 单个接口（主机+路径）的延迟直方图与熔断状态
+- ResilientClient: 按接口的延迟分位数计算自适应超时，慢请求发出对冲请求，
+  连接错误、超时、429与5xx按指数退避加全抖动重试，连续失败时熔断
+"""
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+
+from . import metrics
+from .http_client import HttpClient
+from .metrics import Histogram
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求未发出即失败。"""
+
+
+class CircuitBreaker:
+    """按连续失败次数打开的熔断器。
+
+    连续失败 failure_threshold 次后打开，reset_timeout 秒内的请求直接失败；
+    之后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """当前是否允许发出请求。"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def retry_after(self):
+        """打开状态下距离下次允许探测的秒数。"""
+        with self._lock:
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class Endpoint:
+    """单个上游接口（主机+路径）的延迟统计与熔断状态。"""
+
+    def __init__(self, name, breaker, window):
+        self.name = name
+        self.breaker = breaker
+        self.latency = Histogram(window=window)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retries = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, error=False):
+        with self._lock:
+            self.latency.observe(seconds, error)
+
+    def quantiles(self):
+        with self._lock:
+            return self.latency.count, self.latency.quantiles()
+
+
+class ResilientClient:
+    """面向不稳定上游的HTTP客户端（基于 HttpClient 的共享连接池）。
+
+    - 自适应超时：每个接口按最近的成功请求耗时计算 p99 × timeout_multiplier，
+      限制在 [min_timeout, max_timeout] 内；样本少于 min_samples 时使用 max_timeout。
+    - 对冲请求：第一个请求超过该接口的 p95 仍未返回时，再发出一个相同的请求，
+      先返回的结果生效（只用于GET等幂等请求）。
+    - 抖动重试：连接错误、超时、429与5xx按指数退避加全抖动重试，最多 max_attempts 次。
+    - 熔断：接口连续失败 failure_threshold 次后打开熔断器，reset_timeout 秒内直接抛出
+      CircuitOpenError，不再占用线程等待。
+
+    Args:
+        http_client: 底层客户端，默认 HttpClient.shared()。
+        min_timeout / max_timeout: 自适应超时的上下限（秒）。
+        connect_timeout: 连接超时（秒）。
+        timeout_multiplier: 超时相对 p99 的倍数。
+        hedge: 是否启用对冲请求。
+        min_samples: 开始使用自适应超时与对冲前需要的样本数。
+        max_attempts: 每次调用最多尝试的次数（含第一次）。
+        backoff_base / backoff_cap: 重试退避的基数与上限（秒）。
+        failure_threshold / reset_timeout: 熔断器参数。
+        max_concurrency: 执行请求的线程数。
+        window: 每个接口保留的最近耗时样本数。
+    """
+
+    RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, http_client=None, min_timeout=1.0, max_timeout=15.0, connect_timeout=5.0,
+                 timeout_multiplier=3.0, hedge=True, min_samples=20, max_attempts=3, backoff_base=0.2,
+                 backoff_cap=5.0, failure_threshold=5, reset_timeout=30.0, max_concurrency=16, window=256):
+        if max_attempts < 1:
+            raise ValueError(f"max_attempts 至少为1，当前为 {max_attempts}")
+        self.http_client = http_client
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.connect_timeout = connect_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.hedge = hedge
+        self.min_samples = min_samples
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.window = window
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ResilientHttp")
+
+    @classmethod
+    def shared(cls):
+        """获取进程级共享实例。"""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def endpoint(self, url):
+        parts = urlsplit(url)
+        name = f"{parts.netloc}{parts.path}"
+        endpoint = self._endpoints.get(name)
+        if endpoint is None:
+            with self._lock:
+                endpoint = self._endpoints.get(name)
+                if endpoint is None:
+                    breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                    endpoint = self._endpoints[name] = Endpoint(name, breaker, self.window)
+        return endpoint
+
+    def timeouts(self, endpoint):
+        """返回 (读取超时, 对冲等待时间)，样本不足时不对冲。"""
+        count, quantiles = endpoint.quantiles()
+        if count < self.min_samples:
+            return self.max_timeout, None
+        timeout = min(self.max_timeout, max(self.min_timeout, quantiles[0.99] * self.timeout_multiplier))
+        return timeout, (quantiles[0.95] if self.hedge else None)
+
+    def backoff(self, attempt):
+        """第 attempt 次重试前的等待时间：指数退避加全抖动。"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """发送请求，返回 requests.Response。
+
+        重试用尽后返回最后一次的响应（如5xx），或抛出最后一次的异常。
+
+        Raises:
+            CircuitOpenError: 接口熔断中。
+            requests.RequestException: 连接错误或超时且重试用尽。
+        """
+        endpoint = self.endpoint(url)
+        idempotent = method.upper() in ('GET', 'HEAD', 'OPTIONS')
+        last_error = None
+        response = None
+        for attempt in range(self.max_attempts):
+            if attempt:
+                endpoint.retries += 1
+                metrics.inc("upstream_retries_total", endpoint=endpoint.name)
+                time.sleep(self.backoff(attempt))
+            if not endpoint.breaker.allow():
+                metrics.inc("upstream_circuit_rejected_total", endpoint=endpoint.name)
+                raise CircuitOpenError(
+                    f"{endpoint.name} 已熔断，{endpoint.breaker.retry_after():.1f} 秒后重新探测"
+                ) from last_error
+            endpoint.requests += 1
+            try:
+                response = self._attempt(endpoint, method, url, kwargs, hedge=idempotent)
+            except requests.RequestException as e:
+                last_error = e
+                endpoint.failures += 1
+                endpoint.breaker.record_failure()
+                logging.warning("请求 %s 失败（第 %d 次）: %s", endpoint.name, attempt + 1, e)
+                continue
+            except Exception:
+                # 非网络错误（如参数错误）不重试，但要结束半开状态下的探测
+                endpoint.breaker.record_failure()
+                raise
+            if response.status_code in self.RETRY_STATUS:
+                endpoint.failures += 1
+                endpoint.breaker.record_failure()
+                logging.warning("请求 %s 返回 %d（第 %d 次）", endpoint.name, response.status_code, attempt + 1)
+                continue
+            endpoint.breaker.record_success()
+            return response
+        if response is not None:
+            return response
+        raise last_error
+
+    def _attempt(self, endpoint, method, url, kwargs, hedge):
+        timeout, hedge_delay = self.timeouts(endpoint)
+        call_kwargs = dict(kwargs, timeout=(min(self.connect_timeout, timeout), timeout))
+        futures = [self._executor.submit(self._send, endpoint, method, url, call_kwargs)]
+        # 整体等待上限：读取超时只限制单次socket读取，这里保证调用方不会无限等待
+        deadline = time.monotonic() + self.connect_timeout + timeout
+        if hedge and hedge_delay is not None:
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                endpoint.hedges += 1
+                metrics.inc("upstream_hedges_total", endpoint=endpoint.name)
+                futures.append(self._executor.submit(self._send, endpoint, method, url, call_kwargs))
+
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.RequestException as e:
+                    error = e
+                    continue
+                if future is not futures[0]:
+                    endpoint.hedge_wins += 1
+                for other in pending:
+                    other.add_done_callback(self._close_response)
+                return response
+        if error is not None:
+            raise error
+        raise requests.Timeout(f"{endpoint.name} 在 {self.connect_timeout + timeout:.1f} 秒内没有响应")
+
+    def _send(self, endpoint, method, url, kwargs):
+        client = self.http_client or HttpClient.shared()
+        start = time.perf_counter()
+        try:
+            response = client.request(method, url, **kwargs)
+        except requests.RequestException:
+            endpoint.observe(time.perf_counter() - start, error=True)
+            raise
+        # 只用成功返回的耗时推算超时，失败（多为超时）的耗时会把超时越推越长
+        if response.status_code < 500:
+            endpoint.observe(time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def _close_response(future):
+        # 对冲中落败的请求：读完后关闭，连接归还连接池
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+    def stats(self):
+        """返回每个接口的 {"requests", "hedges", "hedge_wins", "retries", "failures", "circuit",
+        "timeout", "p50", "p95", "p99"}。"""
+        result = {}
+        for name, endpoint in list(self._endpoints.items()):
+            count, quantiles = endpoint.quantiles()
+            timeout, _ = self.timeouts(endpoint)
+            result[name] = {
+                'requests': endpoint.requests,
+                'hedges': endpoint.hedges,
+                'hedge_wins': endpoint.hedge_wins,
+                'retries': endpoint.retries,
+                'failures': endpoint.failures,
+                'circuit': endpoint.breaker.state,
+                'timeout': round(timeout, 3),
+                'p50': round(quantiles[0.5], 4),
+                'p95': round(quantiles[0.95], 4),
+                'p99': round(quantiles[0.99], 4)
+            }
+        return result
@@ -0,0 +1,209 @@
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+
+class CronExpression:
+    """标准5段式cron表达式（分 时 日 月 周）。
+
+    支持 `*`、数字、逗号列表、`a-b` 区间以及 `*/n`、`a-b/n` 步长写法。
+    周字段取值0-6（0为周日），7同样视为周日。
+    """
+
+    _FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron表达式应包含5个字段: '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            self._parse_field(field, low, high)
+            for field, (low, high) in zip(fields, self._FIELD_RANGES)
+        ]
+        # 与crontab一致：日、周字段都被限制时，任一满足即可
+        self._day_restricted = fields[2] != '*'
+        self._weekday_restricted = fields[4] != '*'
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step_text = part.split('/', 1)
+                step = int(step_text)
+                if step <= 0:
+                    raise ValueError(f"cron步长必须为正数: '{field}'")
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start_text, end_text = part.split('-', 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = end = int(part)
+            if high == 6 and end == 7:
+                # 周字段允许用7表示周日
+                values.add(0)
+                end = 6
+            if start < low or end > high or start > end:
+                raise ValueError(f"cron字段超出范围 {low}-{high}: '{field}'")
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def matches(self, dt):
+        if dt.minute not in self.minutes or dt.hour not in self.hours or dt.month not in self.months:
+            return False
+        return self._day_matches(dt)
+
+    def next_after(self, dt):
+        """返回严格晚于dt的下一个触发时间（精确到分钟）。"""
+        candidate = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # 最多向后搜索约4年，足以覆盖2月29日这类稀疏表达式
+        limit = candidate + timedelta(days=366 * 4)
+        while candidate <= limit:
+            if candidate.month not in self.months:
+                candidate = (candidate.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"cron表达式没有可用的触发时间: '{self.expression}'")
+
+    def _day_matches(self, dt):
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._day_restricted and self._weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+
+class ScheduledTask:
+    """调度器中的单个任务，记录触发规则与运行状态。
+
+    cron 表达式按 tz 时区的墙上时间匹配（时区名如 "Asia/Shanghai" 或 tzinfo 对象），
+    未指定时使用本机时区。
+    """
+
+    def __init__(self, name, instance, method_name, args=(), interval=None, cron=None, jitter=0.0, tz=None):
+        if (interval is None) == (cron is None):
+            raise ValueError(f"任务 {name} 必须且只能指定 interval 或 cron 之一")
+        self.name = name
+        self.instance = instance
+        self.method_name = method_name
+        self.args = tuple(args)
+        self.interval = interval
+        self.cron = CronExpression(cron) if isinstance(cron, str) else cron
+        self.jitter = jitter
+        self.tz = ZoneInfo(tz) if isinstance(tz, str) else tz
+        self.running = False
+        self.next_run = None
+        self.run_count = 0
+        self.skip_count = 0
+
+    def schedule_next(self, now):
+        """根据当前时间计算下一次触发时间（time.time()时间戳）。"""
+        if self.interval is not None:
+            base = now + self.interval
+        else:
+            base = self.cron.next_after(datetime.fromtimestamp(now, self.tz)).timestamp()
+        if self.jitter:
+            base += random.uniform(0, self.jitter)
+        self.next_run = base
+        return base
+
+
+class ServiceScheduler:
+    """常驻调度器：按间隔或cron表达式反复执行服务方法。
+
+    服务实例在各次触发之间复用，任务由有界线程池执行；
+    若某个任务上一次执行尚未结束，本次触发会被跳过，避免重叠运行。
+
+    Args:
+        runner: 执行任务的函数，签名为 runner(instance, method_name, *args)，
+            通常传入 main_temp.run_service。
+        max_workers: 线程池最大并发数。
+        tz: cron 任务默认使用的时区，add_task 可单独指定；为None时使用本机时区。
+    """
+
+    def __init__(self, runner, max_workers=4, tz=None):
+        self.runner = runner
+        self.max_workers = max_workers
+        self.tz = tz
+        self.tasks = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._executor = None
+
+    def add_task(self, name, instance, method_name, args=(), interval=None, cron=None, jitter=0.0,
+                 run_immediately=False, tz=None):
+        task = ScheduledTask(name, instance, method_name, args, interval=interval, cron=cron, jitter=jitter,
+                             tz=tz or self.tz)
+        now = time.time()
+        if run_immediately:
+            task.next_run = now + (random.uniform(0, jitter) if jitter else 0)
+        else:
+            task.schedule_next(now)
+        with self._lock:
+            self.tasks.append(task)
+        return task
+
+    def _run_task(self, task):
+        try:
+            self.runner(task.instance, task.method_name, *task.args)
+        except Exception:
+            logging.exception("调度任务 %s 执行异常", task.name)
+        finally:
+            with self._lock:
+                task.running = False
+                task.run_count += 1
+
+    def _dispatch_due(self, now):
+        with self._lock:
+            due = [task for task in self.tasks if task.next_run <= now]
+            for task in due:
+                task.schedule_next(now)
+                if task.running:
+                    task.skip_count += 1
+                    logging.warning("任务 %s 上一次执行尚未结束，跳过本次触发", task.name)
+                    continue
+                task.running = True
+                self._executor.submit(self._run_task, task)
+
+    def run_forever(self):
+        """阻塞运行调度循环，直到调用 stop()。"""
+        self._stop_event.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="SchedulerWorker")
+        logging.info("调度器启动，共 %d 个任务，最大并发 %d", len(self.tasks), self.max_workers)
+        try:
+            while not self._stop_event.is_set():
+                now = time.time()
+                self._dispatch_due(now)
+                with self._lock:
+                    next_run = min((task.next_run for task in self.tasks), default=now + 60)
+                self._stop_event.wait(max(0.0, min(next_run - time.time(), 60)))
+        finally:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            logging.info("调度器已停止")
+
+    def start(self):
+        """在后台守护线程中运行调度循环。"""
+        thread = threading.Thread(target=self.run_forever, name="ServiceScheduler", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,179 @@
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheEntry:
+    """缓存条目，保存值以及用于条件请求的校验信息。"""
+
+    __slots__ = ('value', 'expires_at', 'etag', 'last_modified', 'version')
+
+    def __init__(self, value, expires_at, etag=None, last_modified=None, version=0):
+        self.value = value
+        self.expires_at = expires_at
+        self.etag = etag
+        self.last_modified = last_modified
+        self.version = version
+
+    def is_fresh(self, now=None):
+        return (now or time.time()) < self.expires_at
+
+    def to_dict(self):
+        return {
+            'value': self.value,
+            'expires_at': self.expires_at,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'version': self.version
+        }
+
+
+class TTLCache:
+    """带过期时间与LRU淘汰的线程安全缓存，可选持久化到磁盘。
+
+    过期的条目不会立即删除，而是保留给调用方做条件请求
+    （If-None-Match / If-Modified-Since），上游返回304时调用 refresh() 续期即可。
+    持久化文件为JSON格式，写入时先写临时文件再原子替换；进程退出时自动保存，
+    重启后可直接命中上次的缓存。
+
+    Args:
+        ttl: 条目有效期（秒）。
+        max_entries: 最大条目数，超出时淘汰最久未使用的条目。
+        persist_path: 可选，持久化文件路径。
+        persist_interval: 两次自动保存之间的最小间隔（秒）。
+    """
+
+    def __init__(self, ttl=600, max_entries=1024, persist_path=None, persist_interval=30):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.persist_interval = persist_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 0
+        self._dirty = False
+        self._last_saved = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        if persist_path:
+            self.load()
+            atexit.register(self.save)
+
+    def get(self, key):
+        """返回未过期的值；不存在或已过期时返回None。会计入命中/未命中次数。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.is_fresh():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def get_entry(self, key):
+        """返回条目（无论是否过期），用于条件请求；不计入统计。"""
+        with self._lock:
+            return self._entries.get(key)
+
+    @property
+    def version(self):
+        """每次 put() 递增的版本号；版本号不变说明期间没有写入新的值。"""
+        with self._lock:
+            return self._version
+
+    def min_expiry(self, keys):
+        """返回给定键中最早的过期时间（时间戳），有键不存在时返回0。"""
+        with self._lock:
+            expiry = float('inf')
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    return 0.0
+                expiry = min(expiry, entry.expires_at)
+            return expiry
+
+    def put(self, key, value, etag=None, last_modified=None):
+        with self._lock:
+            self._version += 1
+            self._entries[key] = CacheEntry(value, time.time() + self.ttl, etag, last_modified, self._version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+        self._maybe_save()
+
+    def refresh(self, key):
+        """上游确认内容未变化（如HTTP 304）时为条目续期，返回续期后的值。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.expires_at = time.time() + self.ttl
+            self._entries.move_to_end(key)
+            self.revalidated += 1
+            self._dirty = True
+        self._maybe_save()
+        return entry.value
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+    def _maybe_save(self):
+        if self.persist_path and time.time() - self._last_saved >= self.persist_interval:
+            self.save()
+
+    def save(self):
+        """把缓存写入持久化文件（无变化时跳过）。"""
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = {key: entry.to_dict() for key, entry in self._entries.items()}
+            self._dirty = False
+            self._last_saved = time.time()
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            directory = os.path.dirname(self.persist_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            logging.warning("缓存持久化失败 %s: %s", self.persist_path, e)
+
+    def load(self):
+        """从持久化文件恢复缓存，文件不存在或损坏时从空缓存开始。"""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning("读取缓存文件失败 %s: %s", self.persist_path, e)
+            return
+        with self._lock:
+            for key, data in snapshot.items():
+                self._entries[key] = CacheEntry(**data)
+                self._version = max(self._version, data.get('version', 0))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self._last_saved = time.time()
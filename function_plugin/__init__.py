@@ -5,16 +5,47 @@ function_plugin 包
 - dingtalk_notify: 钉钉机器人通知模块
 - email_monitor: 邮件监控与解析模块
 - rain_report: 天气预报与自动推送模块
-"""
 
-from .dingtalk_notify import dingtalk_notify
+插件通过 registry.PluginRegistry 按需导入：`from function_plugin import dingtalk_notify`
+只会加载钉钉相关的模块。其他包可以在 "function_plugin.plugins" 入口点组下注册插件，
+同样以 `function_plugin.<插件名>` 访问。
+"""
 
-from .email_monitor import email_monitor
+import sys as _sys
+from types import ModuleType as _ModuleType
 
-from .rain_report import rain_report
+from .registry import default_registry as _registry
 
 __all__ = [
     "dingtalk_notify",
     "email_monitor",
     "rain_report",
 ]
+
+
+def __getattr__(name):
+    try:
+        _registry.target(name)
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    plugin = _registry.load(name)
+    globals()[name] = plugin
+    return plugin
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_registry.names()))
+
+
+class _PluginPackage(_ModuleType):
+    """导入插件子模块时，导入系统会把子模块对象绑定到包的同名属性上；
+    这里把它换成插件对象，保证 `from function_plugin import dingtalk_notify` 始终得到插件类。"""
+
+    def __setattr__(self, name, value):
+        if isinstance(value, _ModuleType) and name in _registry.builtin \
+                and _registry.builtin[name].partition(':')[0] == value.__name__:
+            value = _registry.load(name)
+        super().__setattr__(name, value)
+
+
+_sys.modules[__name__].__class__ = _PluginPackage
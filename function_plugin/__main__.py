@@ -0,0 +1,7 @@
+"""统计插件冷启动导入耗时，见 registry.main。"""
+
+import sys
+
+from .registry import main
+
+sys.exit(main())
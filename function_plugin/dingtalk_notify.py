@@ -1,19 +1,64 @@
 
 import argparse
 import logging
+import os
 import time
 import hmac
 import hashlib
 import base64
+import threading
 import urllib.parse
-import requests
+from concurrent.futures import Future
 
 
 from auth_service.auth_decorator import require_secret
+from auth_service.secrets_manager import SecretsManager
+from function_base import metrics
+from function_base.http_client import HttpClient
+from function_base.outbox import DurableOutbox, UndeliverableError
+from .dingtalk_queue import DingtalkDeliveryQueue, THROTTLED_ERRCODES
 
 
 class dingtalk_notify:
 
+    # 钉钉自定义机器人发送接口
+    api_url = 'https://oapi.dingtalk.com/robot/send'
+
+    # 开启后 send_custom_robot_group_message / push_notification_with_args 先把消息写入落盘的发件箱，
+    # 返回发件箱中的消息ID，push_notification_async 返回发件箱的Future；由后台经发送队列与机器人池发出，
+    # 进程崩溃后重启时补发。默认关闭，保持同步发送；插件的告警路径通过 durable 参数单独开启
+    use_outbox = False
+    # 发件箱重试：首次间隔（秒，之后每次翻倍）、间隔上限与最多尝试次数，用尽后转入死信
+    outbox_retry_interval = 5.0
+    outbox_max_retry_interval = 300.0
+    outbox_max_attempts = 10
+    outbox_path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'ignore_file',
+        'dingtalk_outbox'
+    )
+    _outbox = None
+    _outbox_lock = threading.Lock()
+
+    # 进程内共享的后台合并发送队列，首次异步推送时创建
+    _delivery_queue = None
+    _queue_lock = threading.Lock()
+
+    # 机器人池：key.txt 中的 dingtalk_notify.robots（默认分组）或 dingtalk_notify.robots.<分组>，
+    # 值为 "access_token:secret/access_token:secret"；未配置时使用 access_token/secret 这一个机器人
+    DEFAULT_GROUP = 'default'
+    # 每个机器人每分钟允许发送的消息数、并发发送数
+    rate_per_minute = 20
+    max_concurrency = 4
+    _robot_handles = {}
+    # {分组: (配置值, 机器人元组)}，配置值变化（密钥轮换）时整组替换
+    _robot_pools = {}
+    # 同步发送时各分组轮流使用机器人的游标
+    _robot_cursors = {}
+    _robot_lock = threading.Lock()
+    # 默认分组退回单个机器人时用于读取 access_token/secret 的共享实例
+    _fallback_notifier = None
+
     def setup_logger(self):
         logger = logging.getLogger()
         handler = logging.StreamHandler()
@@ -49,51 +94,147 @@ class dingtalk_notify:
         return secret
 
     @require_secret("dingtalk_notify", "secret")
-    def send_custom_robot_group_message(self, msg, secret=None, at_user_ids=None, at_mobiles=None, is_at_all=False):
+    def dingtalk_secret(self, secret=None):
+        return secret
+
+    @staticmethod
+    def parse_robots(value):
+        """解析 "access_token:secret/access_token:secret" 格式的机器人列表"""
+        robots = []
+        for entry in value.split('/'):
+            entry = entry.strip()
+            if not entry:
+                continue
+            access_token, _, robot_secret = entry.partition(':')
+            if not access_token or not robot_secret:
+                raise ValueError("钉钉机器人配置格式错误，应为 access_token:secret，多个用 / 分隔")
+            robots.append((access_token.strip(), robot_secret.strip()))
+        return tuple(robots)
+
+    @classmethod
+    def robot_pool(cls, group=None):
+        """
+        返回分组内的机器人 ((access_token, secret), ...)
+
+        默认分组未配置 robots 时退回到 access_token/secret 这一个机器人；
+        其他分组未配置时抛出 KeyError。
+        """
+        group = group or cls.DEFAULT_GROUP
+        key_name = 'robots' if group == cls.DEFAULT_GROUP else f'robots.{group}'
+        handle = cls._robot_handles.get(key_name)
+        if handle is None:
+            handle = cls._robot_handles.setdefault(key_name, SecretsManager.handle("dingtalk_notify", key_name))
+        try:
+            value = handle.get()
+        except KeyError:
+            if group != cls.DEFAULT_GROUP:
+                raise
+            if cls._fallback_notifier is None:
+                cls._fallback_notifier = cls()
+            notifier = cls._fallback_notifier
+            value = f"{notifier.dingtalk_access_token()}:{notifier.dingtalk_secret()}"
+
+        cached = cls._robot_pools.get(group)
+        if cached is not None and cached[0] == value:
+            return cached[1]
+        robots = cls.parse_robots(value)
+        with cls._robot_lock:
+            cls._robot_pools[group] = (value, robots)
+        return robots
+
+    @classmethod
+    def next_robots(cls, group=None):
+        """同步发送时使用：返回分组内的机器人列表，从上次使用的下一个开始轮流"""
+        group = group or cls.DEFAULT_GROUP
+        robots = cls.robot_pool(group)
+        with cls._robot_lock:
+            start = cls._robot_cursors.get(group, 0) % len(robots)
+            cls._robot_cursors[group] = start + 1
+        return robots[start:] + robots[:start]
+
+    @staticmethod
+    def sign(secret, timestamp):
+        """按钉钉加签规则计算 sign 参数（HmacSHA256 + Base64 + URL编码）"""
+        string_to_sign = f'{timestamp}\n{secret}'
+        hmac_code = hmac.new(secret.encode('utf-8'), string_to_sign.encode('utf-8'), digestmod=hashlib.sha256).digest()
+        return urllib.parse.quote_plus(base64.b64encode(hmac_code))
+
+    def send_custom_robot_group_message(self, msg, secret=None, at_user_ids=None, at_mobiles=None, is_at_all=False,
+                                        title=None, group=None):
         """
         发送钉钉自定义机器人群消息
         :param msg: 消息内容
         :param at_user_ids: @的用户ID列表
         :param at_mobiles: @的手机号列表
         :param is_at_all: 是否@所有人
-        :return: 钉钉API响应
+        :param title: 指定时按markdown消息发送，作为会话列表中显示的标题
+        :param secret: 指定时用 access_token 与该密钥这一个机器人发送，不经过机器人池
+        :param group: 机器人分组，默认 DEFAULT_GROUP；分组内的机器人轮流发送，被限流时换下一个重发
+        :return: 钉钉API响应；开启 use_outbox 时为发件箱中的消息ID（int），title 被忽略
+        """
+        if self.use_outbox:
+            return self.outbox().append(self.outbox_payload(msg, at_user_ids, at_mobiles, is_at_all, group))
+        if secret is not None:
+            robots = ((self.dingtalk_access_token(), secret),)
+        else:
+            robots = self.next_robots(group)
+        for access_token, robot_secret in robots:
+            result = self.send_via_robot(
+                access_token,
+                robot_secret,
+                msg,
+                at_user_ids=at_user_ids,
+                at_mobiles=at_mobiles,
+                is_at_all=is_at_all,
+                title=title
+            )
+            if result.get('errcode') not in THROTTLED_ERRCODES:
+                break
+            metrics.inc("dingtalk_throttled_total")
+            logging.warning("钉钉机器人被限流，改由同组下一个机器人重发")
+        return result
+
+    def send_via_robot(self, access_token, robot_secret, msg, at_user_ids=None, at_mobiles=None, is_at_all=False,
+                       title=None):
+        """
+        通过指定的机器人发送群消息，参数同 send_custom_robot_group_message
+        :param access_token: 机器人 access_token
+        :param robot_secret: 机器人加签密钥
         """
         timestamp = str(round(time.time() * 1000))
-        string_to_sign = f'{timestamp}\n{secret}'
-        hmac_code = hmac.new(secret.encode('utf-8'), string_to_sign.encode('utf-8'), digestmod=hashlib.sha256).digest()
-        sign = urllib.parse.quote_plus(base64.b64encode(hmac_code))
+        with metrics.span("dingtalk_notify", "sign"):
+            sign = self.sign(robot_secret, timestamp)
 
-        url = f'https://oapi.dingtalk.com/robot/send?access_token={self.dingtalk_access_token()}&timestamp={timestamp}&sign={sign}'
+        url = f'{self.api_url}?access_token={access_token}&timestamp={timestamp}&sign={sign}'
 
         body = {
             "at": {
                 "isAtAll": str(is_at_all).lower(),
                 "atUserIds": at_user_ids or [],
                 "atMobiles": at_mobiles or []
-            },
-            "text": {
-                "content": msg
-            },
-            "msgtype": "text"
+            }
         }
+        if title is None:
+            body["text"] = {"content": msg}
+            body["msgtype"] = "text"
+        else:
+            body["markdown"] = {"title": title, "text": msg}
+            body["msgtype"] = "markdown"
         headers = {'Content-Type': 'application/json'}
-        resp = requests.post(url, json=body, headers=headers)
+        with metrics.span("dingtalk_notify", "http"):
+            resp = HttpClient.shared().post(url, json=body, headers=headers)
         logging.info("钉钉自定义机器人群消息响应：%s", resp.text)
         return resp.json()
 
 
     def push_notification(self):
-
-        options = define_options()
+        """命令行版本，参数见 define_options"""
+        options = self.define_options()
         # 处理 @用户ID
-        at_user_ids = []
-        if options.userid:
-            at_user_ids = [u.strip() for u in options.userid.split(',') if u.strip()]
+        at_user_ids = self.split_targets(options.userid)
         # 处理 @手机号
-        at_mobiles = []
-        if options.at_mobiles:
-            at_mobiles = [m.strip() for m in options.at_mobiles.split(',') if m.strip()]
-        send_custom_robot_group_message(
+        at_mobiles = self.split_targets(options.at_mobiles)
+        return self.send_custom_robot_group_message(
             options.msg,
             at_user_ids=at_user_ids,
             at_mobiles=at_mobiles,
@@ -101,21 +242,141 @@ class dingtalk_notify:
         )
 
 
-    def push_notification_with_args(self, msg, at_mobiles=None, at_userids=None, is_at_all=False):
+    @staticmethod
+    def split_targets(value):
+        """把逗号分隔的@对象字符串拆分为列表"""
+        if not value:
+            return []
+        return [v.strip() for v in value.split(',') if v.strip()]
+
+    def push_notification_with_args(self, msg, at_mobiles=None, at_userids=None, is_at_all=False, group=None):
         """
         供其他脚本调用的函数版本
+
+        默认直接发送（返回None）；开启 use_outbox 时消息落盘后即返回发件箱中的消息ID（int），
+        由后台经发送队列与机器人池发出
+        :param group: 机器人分组，默认 DEFAULT_GROUP
         """
         # 处理 @用户ID
-        at_user_ids = []
-        if at_userids:
-            at_user_ids = [u.strip() for u in at_userids.split(',') if u.strip()]
+        at_user_ids = self.split_targets(at_userids)
 
         # 处理 @手机号
-        at_mobiles_list = []
-        if at_mobiles:
-            at_mobiles_list = [m.strip() for m in at_mobiles.split(',') if m.strip()]
+        at_mobiles_list = self.split_targets(at_mobiles)
 
-        self.send_custom_robot_group_message(
+        entry_id = self.send_custom_robot_group_message(
+            msg,
+            at_user_ids=at_user_ids,
+            at_mobiles=at_mobiles_list,
+            is_at_all=is_at_all,
+            group=group
+        )
+        if self.use_outbox:
+            return entry_id
+
+    @staticmethod
+    def outbox_payload(msg, at_user_ids=None, at_mobiles=None, is_at_all=False, group=None):
+        """写入发件箱的消息内容（需可JSON序列化）"""
+        return {
+            'msg': msg,
+            'at_user_ids': list(at_user_ids or []),
+            'at_mobiles': list(at_mobiles or []),
+            'is_at_all': bool(is_at_all),
+            'group': group
+        }
+
+    @classmethod
+    def outbox(cls):
+        """获取进程内共享的发件箱，首次使用时重放上次未发送成功的消息"""
+        if cls._outbox is None:
+            with cls._outbox_lock:
+                if cls._outbox is None:
+                    cls._outbox = DurableOutbox(
+                        cls.outbox_path,
+                        cls()._send_from_outbox,
+                        retry_interval=cls.outbox_retry_interval,
+                        max_retry_interval=cls.outbox_max_retry_interval,
+                        max_attempts=cls.outbox_max_attempts
+                    )
+        return cls._outbox
+
+    def _send_from_outbox(self, payload):
+        """
+        发件箱的发送函数：交给合并发送队列（机器人池、限流与合并摘要），返回Future
+
+        Future 结果为True表示发送完成；被限流时为False，由发件箱退避后重试；
+        钉钉返回其他错误码（如签名错误）时抛出 UndeliverableError，消息转入死信
+        """
+        sent = self.delivery_queue().submit(
+            payload.get('group') or self.DEFAULT_GROUP,
+            payload['msg'],
+            at_user_ids=payload['at_user_ids'],
+            at_mobiles=payload['at_mobiles'],
+            is_at_all=payload['is_at_all']
+        )
+        done = Future()
+
+        def on_sent(future):
+            try:
+                result = future.result()
+                errcode = result.get('errcode', 0)
+                if errcode in THROTTLED_ERRCODES:
+                    done.set_result(False)
+                elif errcode != 0:
+                    done.set_exception(UndeliverableError(f"钉钉返回错误: {result}"))
+                else:
+                    done.set_result(True)
+            except Exception as e:
+                # 网络错误、密钥缺失等交给发件箱按退避重试
+                done.set_exception(e)
+
+        sent.add_done_callback(on_sent)
+        return done
+
+
+    @classmethod
+    def delivery_queue(cls):
+        """获取进程内共享的合并发送队列"""
+        if cls._delivery_queue is None:
+            with cls._queue_lock:
+                if cls._delivery_queue is None:
+                    cls._delivery_queue = DingtalkDeliveryQueue(
+                        cls()._send_from_queue,
+                        rate_per_minute=cls.rate_per_minute,
+                        resolver=cls.robot_pool,
+                        max_concurrency=cls.max_concurrency
+                    )
+        return cls._delivery_queue
+
+    def _send_from_queue(self, robot, msg, at_user_ids, at_mobiles, is_at_all, title):
+        # robot 为挑选时解析出的 (access_token, secret)，密钥轮换后已在发送中的批次仍使用原密钥
+        access_token, robot_secret = robot
+        return self.send_via_robot(
+            access_token,
+            robot_secret,
+            msg,
+            at_user_ids=at_user_ids,
+            at_mobiles=at_mobiles,
+            is_at_all=is_at_all,
+            title=title
+        )
+
+    def push_notification_async(self, msg, at_mobiles=None, at_userids=None, is_at_all=False, group=None,
+                                durable=None):
+        """
+        非阻塞推送：消息进入后台队列，短时间内发往同一分组的消息会合并为一条摘要，
+        由分组内有发送额度的机器人并发发出
+        :param group: 机器人分组，默认 DEFAULT_GROUP
+        :param durable: 是否先写入落盘的发件箱（进程崩溃后重启时补发），默认取 use_outbox；
+            开启时调用方阻塞到消息落盘
+        :return: concurrent.futures.Future；结果为钉钉API响应，经发件箱发送时消息送达后结果为True，
+            转入死信时为发送失败的异常
+        """
+        at_user_ids = self.split_targets(at_userids)
+        at_mobiles_list = self.split_targets(at_mobiles)
+        if self.use_outbox if durable is None else durable:
+            return self.outbox().submit(self.outbox_payload(msg, at_user_ids, at_mobiles_list, is_at_all, group))
+        return self.delivery_queue().submit(
+            group or self.DEFAULT_GROUP,
             msg,
             at_user_ids=at_user_ids,
             at_mobiles=at_mobiles_list,
@@ -124,4 +385,6 @@ class dingtalk_notify:
 
 
 if __name__ == '__main__':
-    push_notification()
\ No newline at end of file
+    notifier = dingtalk_notify()
+    notifier.setup_logger()
+    notifier.push_notification()
@@ -0,0 +1,275 @@
+
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from function_base import metrics
+from function_base.rate_limit import TokenBucket
+
+# 钉钉返回的限流错误码（发送过快，机器人被暂时限制）
+THROTTLED_ERRCODES = frozenset({130101})
+
+
+class _PendingBatch:
+    """同一机器人在合并窗口内积累的待发送消息。"""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.items = []
+
+
+class DingtalkDeliveryQueue:
+    """钉钉消息的后台合并发送队列。
+
+    消息按目标分组排队，每个分组可以配置多个机器人（同一个群里的多个机器人）。
+    同一分组在合并窗口内收到的多条消息会合并为一条markdown摘要发送，
+    @用户ID、@手机号取并集，任意一条要求@所有人则整条摘要@所有人。
+    每个机器人各自有令牌桶限流（默认每分钟20条），分组内的批次轮流交给有令牌的机器人，
+    由发送线程池并发发出，总吞吐量随机器人数量线性增加；所有机器人都没有令牌时批次
+    继续等待并吸收后续消息，而不是阻塞调用方。某个机器人被钉钉限流（errcode 130101）时，
+    该机器人暂停 throttle_cooldown 秒，批次立即改由同组的其他机器人重发。
+    调用方提交后立即得到一个Future，其结果为钉钉API响应（批次中的所有消息共享同一响应）。
+
+    Args:
+        sender: 实际发送函数，签名为
+            sender(robot_key, msg, at_user_ids, at_mobiles, is_at_all, title)，
+            title 为 None 时按文本消息发送，否则按markdown消息发送。
+        window: 合并窗口（秒），自批次中第一条消息入队起计算。
+        rate_per_minute: 每个机器人每分钟允许发送的消息数。
+        max_batch: 单条摘要最多合并的消息数。
+        resolver: resolver(分组) 返回该分组的机器人标识列表；默认每个分组就是一个机器人。
+        max_concurrency: 同时发送的请求数。
+        throttle_cooldown: 机器人被限流后暂停使用的时间（秒）。
+        max_attempts: 被限流时每条消息最多尝试发送的次数。
+    """
+
+    def __init__(self, sender, window=2.0, rate_per_minute=20, max_batch=20, resolver=None, max_concurrency=4,
+                 throttle_cooldown=60, max_attempts=3):
+        self.sender = sender
+        self.window = window
+        self.rate_per_minute = rate_per_minute
+        self.max_batch = max_batch
+        self.resolver = resolver or (lambda destination: [destination])
+        self.throttle_cooldown = throttle_cooldown
+        self.max_attempts = max_attempts
+        self.max_concurrency = max_concurrency
+        self._in_flight = 0
+        self._pending = {}
+        self._buckets = {}
+        self._cooldown_until = {}
+        self._cursors = {}
+        self._attempts = {}
+        self.sent = {}
+        self.throttled = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="DingtalkSend")
+        self._thread = threading.Thread(target=self._run, name="DingtalkDelivery", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, destination, msg, at_user_ids=None, at_mobiles=None, is_at_all=False):
+        """将消息放入目标分组的队列并立即返回Future。"""
+        future = Future()
+        item = (future, msg, list(at_user_ids or []), list(at_mobiles or []), bool(is_at_all))
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("钉钉发送队列已关闭")
+            batch = self._pending.get(destination)
+            if batch is None:
+                batch = self._pending[destination] = _PendingBatch(time.monotonic() + self.window)
+            batch.items.append(item)
+            self._condition.notify()
+        return future
+
+    def _bucket(self, robot_key):
+        bucket = self._buckets.get(robot_key)
+        if bucket is None:
+            bucket = self._buckets[robot_key] = TokenBucket.per_minute(self.rate_per_minute)
+        return bucket
+
+    def _acquire_robot(self, robots, destination, now, flush_all):
+        """从分组中轮流挑选一个未被暂停且有令牌的机器人；返回 (机器人, 需要等待的秒数)。"""
+        start = self._cursors.get(destination, 0)
+        wait = None
+        for offset in range(len(robots)):
+            index = (start + offset) % len(robots)
+            robot_key = robots[index]
+            cooldown = self._cooldown_until.get(robot_key, 0) - now
+            if not flush_all:
+                if cooldown > 0:
+                    wait = cooldown if wait is None else min(wait, cooldown)
+                    continue
+                bucket = self._bucket(robot_key)
+                if not bucket.try_acquire():
+                    wait = bucket.wait_time() if wait is None else min(wait, bucket.wait_time())
+                    continue
+            self._cursors[destination] = index + 1
+            return robot_key, 0.0
+        return None, wait
+
+    def _take_due_batches(self, now, flush_all=False):
+        """取出已到期且拿到发送令牌的批次；返回 (待发送列表, 下次唤醒时间)。"""
+        ready = []
+        next_deadline = None
+        for destination, batch in list(self._pending.items()):
+            # 发送中的请求数达到上限时等待其完成，之后再按最新的限流状态挑选机器人
+            if not flush_all and self._in_flight >= self.max_concurrency:
+                break
+            if not flush_all and batch.deadline > now:
+                next_deadline = min(next_deadline or batch.deadline, batch.deadline)
+                continue
+            try:
+                robots = list(self.resolver(destination))
+                if not robots:
+                    raise KeyError(f"钉钉分组 {destination} 没有可用的机器人")
+            except Exception as e:
+                logging.error("解析钉钉分组 %s 的机器人失败: %s", destination, e)
+                del self._pending[destination]
+                for item in batch.items:
+                    self._attempts.pop(item[0], None)
+                    item[0].set_exception(e)
+                continue
+            robot_key, wait = self._acquire_robot(robots, destination, now, flush_all)
+            if robot_key is None:
+                # 分组内的机器人都被限流：顺延批次，期间的新消息继续合并进来
+                batch.deadline = now + wait
+                next_deadline = min(next_deadline or batch.deadline, batch.deadline)
+                continue
+            items, rest = batch.items[:self.max_batch], batch.items[self.max_batch:]
+            ready.append((destination, robot_key, items))
+            self._in_flight += 1
+            if rest:
+                # 剩余消息立即尝试交给下一个机器人
+                batch.items = rest
+                batch.deadline = now
+                next_deadline = now
+            else:
+                del self._pending[destination]
+        return ready, next_deadline
+
+    def _run(self):
+        while True:
+            with self._condition:
+                ready, next_deadline = self._take_due_batches(time.monotonic(), flush_all=self._closed)
+                if not ready:
+                    if self._closed and not self._pending:
+                        return
+                    timeout = None if next_deadline is None else max(0.0, next_deadline - time.monotonic())
+                    self._condition.wait(timeout)
+                    continue
+            for destination, robot_key, items in ready:
+                try:
+                    self._executor.submit(self._deliver, destination, robot_key, items)
+                except RuntimeError:
+                    # 解释器退出时（atexit 中 close 之前）线程池已不接受新任务，改在当前线程发送
+                    self._deliver(destination, robot_key, items)
+
+    def _deliver(self, destination, robot_key, items):
+        try:
+            self._send(destination, robot_key, items)
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify()
+
+    def _send(self, destination, robot_key, items):
+        try:
+            if len(items) == 1:
+                _, msg, at_user_ids, at_mobiles, is_at_all = items[0]
+                result = self.sender(robot_key, msg, at_user_ids, at_mobiles, is_at_all, None)
+            else:
+                title, text, at_user_ids, at_mobiles, is_at_all = self.build_digest(items)
+                result = self.sender(robot_key, text, at_user_ids, at_mobiles, is_at_all, title)
+        except Exception as e:
+            logging.exception("钉钉消息发送失败，共 %d 条", len(items))
+            self._finish(items, exception=e)
+            return
+
+        if isinstance(result, dict) and result.get('errcode') in THROTTLED_ERRCODES:
+            items = self._retry_throttled(destination, robot_key, items)
+        else:
+            with self._condition:
+                self.sent[robot_key] = self.sent.get(robot_key, 0) + 1
+        self._finish(items, result=result)
+
+    def _retry_throttled(self, destination, robot_key, items):
+        """机器人被限流：暂停该机器人，把还能重试的消息放回分组队首；返回不再重试的消息。"""
+        metrics.inc("dingtalk_throttled_total")
+        with self._condition:
+            self.throttled += 1
+            self._cooldown_until[robot_key] = time.monotonic() + self.throttle_cooldown
+            if self._closed:
+                return items
+            retry, give_up = [], []
+            for item in items:
+                attempts = self._attempts.get(item[0], 1)
+                if attempts < self.max_attempts:
+                    self._attempts[item[0]] = attempts + 1
+                    retry.append(item)
+                else:
+                    give_up.append(item)
+            if retry:
+                batch = self._pending.get(destination)
+                if batch is None:
+                    batch = self._pending[destination] = _PendingBatch(time.monotonic())
+                batch.items[:0] = retry
+                batch.deadline = time.monotonic()
+                self._condition.notify()
+        logging.warning("钉钉机器人被限流，%d 条消息改由同组其他机器人重发", len(retry))
+        return give_up
+
+    def _finish(self, items, result=None, exception=None):
+        with self._condition:
+            for item in items:
+                self._attempts.pop(item[0], None)
+        for future, *_ in items:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'pending': sum(len(batch.items) for batch in self._pending.values()),
+                'sent': sum(self.sent.values()),
+                'robots_used': len(self.sent),
+                'throttled': self.throttled
+            }
+
+    @staticmethod
+    def build_digest(items):
+        """把多条消息合并为markdown摘要，并合并@对象。
+
+        markdown消息只有在正文中出现 @手机号 / @用户ID 时才会真正提醒对方，
+        因此合并后的@对象会追加在摘要末尾。
+        """
+        at_user_ids, at_mobiles, is_at_all = [], [], False
+        lines = [f"#### 通知汇总（{len(items)} 条）", ""]
+        for index, (_, msg, item_user_ids, item_mobiles, item_at_all) in enumerate(items, 1):
+            lines.append(f"{index}. {msg}")
+            for user_id in item_user_ids:
+                if user_id not in at_user_ids:
+                    at_user_ids.append(user_id)
+            for mobile in item_mobiles:
+                if mobile not in at_mobiles:
+                    at_mobiles.append(mobile)
+            is_at_all = is_at_all or item_at_all
+        mentions = [f"@{mobile}" for mobile in at_mobiles] + [f"@{user_id}" for user_id in at_user_ids]
+        if mentions:
+            lines.extend(["", " ".join(mentions)])
+        title = f"通知汇总（{len(items)} 条）"
+        return title, "\n".join(lines), at_user_ids, at_mobiles, is_at_all
+
+    def close(self, timeout=10):
+        """停止接收新消息，并在timeout内尽量把已入队的消息全部发出。"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
@@ -1,11 +1,65 @@
 import imaplib
 import email
 from email.header import decode_header
+import atexit
+import hashlib
 import os
+import re
+import threading
 from auth_service.auth_decorator import require_secret
+from function_base import metrics
+from function_base.idempotency import IdempotencyStore
+from .dingtalk_notify import dingtalk_notify
+from .email_rules import EmailRuleEngine
+from .email_sync import MailboxSyncState, UidSyncEngine
+from .imap_idle import ImapIdle
+from .imap_pool import ImapConnectionManager
+from .mime_stream import ContentAddressedStore, MessageTooLarge, StreamingMimeParser
+
+_FETCH_UID_RE = re.compile(rb'UID (\d+)')
+_FETCH_SIZE_RE = re.compile(rb'RFC822\.SIZE (\d+)')
 
 
 class email_monitor:
+    # 批量模式下每条FETCH命令包含的邮件数
+    fetch_chunk_size = 50
+
+    # IDLE模式下重新发起IDLE的间隔（秒），需小于服务器的29分钟超时
+    idle_timeout = 25 * 60
+    # 服务器不支持IDLE时的轮询间隔（秒）
+    poll_interval = 300
+    # IDLE连接中断后的重连等待（秒）
+    reconnect_delay = 30
+
+    # 使用基于UID的增量同步代替UNSEEN搜索，进度保存在 MailboxSyncState 中
+    use_uid_sync = True
+
+    # 超过 stream_threshold 字节的邮件改为分块流式获取与解析，附件边解码边写盘
+    stream_threshold = 1024 * 1024
+    stream_chunk_size = 256 * 1024
+    # 单封邮件与单个附件的大小上限（字节）
+    max_message_size = 100 * 1024 * 1024
+    max_attachment_size = 50 * 1024 * 1024
+    # 附件按内容哈希保存的目录
+    attachment_dir = "attachments"
+
+    _sync_state = None
+    _sync_state_lock = threading.Lock()
+
+    # 同一封邮件按同一条规则只转发一次（按Message-ID去重），送达后记录保留 forward_ttl 秒
+    dedupe_forwards = True
+    forward_ttl = 7 * 24 * 3600
+    # 转发先写入落盘的钉钉发件箱再发送，进程在发送前退出时下次启动补发
+    durable_forwards = True
+
+    # 邮件路由规则，首次使用时从 EmailRuleEngine.DEFAULT_FILE_PATH 加载
+    _rule_engine = None
+    _rule_engine_lock = threading.Lock()
+
+    # 进程内共享的IMAP连接管理器，连接在多次检查之间复用
+    _connection_manager = None
+    _connection_manager_lock = threading.Lock()
+
     def __init__(self):
         self.mail = None  # 添加实例变量来保存连接
 
@@ -21,11 +75,73 @@ class email_monitor:
     def email_monitor_url(self, secret=None):
         return secret
 
+    @classmethod
+    def connections(cls):
+        """获取进程内共享的IMAP连接管理器"""
+        if cls._connection_manager is None:
+            with cls._connection_manager_lock:
+                if cls._connection_manager is None:
+                    cls._connection_manager = ImapConnectionManager(imaplib.IMAP4_SSL)
+                    atexit.register(cls._connection_manager.close_all)
+        return cls._connection_manager
+
+    @classmethod
+    def rule_engine(cls):
+        """获取编译好的路由规则引擎；规则文件不存在时返回None"""
+        if cls._rule_engine is None:
+            with cls._rule_engine_lock:
+                if cls._rule_engine is None:
+                    if not os.path.exists(EmailRuleEngine.DEFAULT_FILE_PATH):
+                        return None
+                    cls._rule_engine = EmailRuleEngine.from_file()
+                    print(f"已加载 {len(cls._rule_engine.rules)} 条邮件路由规则")
+        return cls._rule_engine
+
+    def route_email(self, email_info):
+        """按路由规则匹配邮件，命中的规则通过钉钉队列推送"""
+        engine = self.rule_engine()
+        if engine is None:
+            return []
+        matched = engine.evaluate(email_info)
+        store = IdempotencyStore.shared() if self.dedupe_forwards else None
+        for rule in matched:
+            metrics.inc("email_rule_matches_total", rule=rule.name)
+            forward_key = f"email_forward:{self.message_key(email_info)}:{rule.name}"
+            if store is not None and not store.reserve(forward_key):
+                print(f"邮件 {email_info['subject']} 已按规则 {rule.name} 转发过，跳过")
+                continue
+            future = dingtalk_notify().push_notification_async(
+                msg=f"[{rule.name}] 新邮件\n发件人: {email_info['sender']}\n主题: {email_info['subject']}",
+                at_mobiles=rule.at_mobiles,
+                at_userids=rule.at_userids,
+                is_at_all=rule.is_at_all,
+                group=rule.group,
+                durable=self.durable_forwards
+            )
+            if store is not None:
+                future.add_done_callback(IdempotencyStore.confirm_on_success(store, forward_key, self.forward_ttl))
+        return matched
+
+    @staticmethod
+    def message_key(email_info):
+        """邮件的去重键：优先使用Message-ID，没有时使用发件人、主题与正文的摘要"""
+        if email_info.get("message_id"):
+            return email_info["message_id"]
+        digest = hashlib.sha256()
+        for field in ("sender", "subject", "body"):
+            digest.update((email_info.get(field) or "").encode("utf-8", errors="replace") + b"\0")
+        return digest.hexdigest()
+
     def connect_to_email(self):
         try:
             if self.mail is None:
-                self.mail = imaplib.IMAP4_SSL(self.email_monitor_url())
-                self.mail.login(self.email_monitor_username(), self.email_monitor_password())
+                # 优先复用已登录的连接，失效时由连接管理器自动重连
+                with metrics.span("email_monitor", "imap_connect"):
+                    self.mail = self.connections().acquire(
+                        self.email_monitor_url(),
+                        self.email_monitor_username(),
+                        self.email_monitor_password()
+                    )
                 print("连接成功")
             return self.mail
         except Exception as e:
@@ -66,78 +182,307 @@ class email_monitor:
                 return None
 
             email_body = data[0][1]
-            email_message = email.message_from_bytes(email_body)
-
-            # 获取发件人
-            from_header = decode_header(email_message["From"])[0]
-            sender = from_header[0].decode(from_header[1]) if isinstance(from_header[0], bytes) else from_header[0]
-
-            # 获取主题
-            subject_header = decode_header(email_message["Subject"])[0]
-            subject = subject_header[0].decode(subject_header[1]) if isinstance(subject_header[0], bytes) else \
-            subject_header[0]
-
-            # 获取正文（仅处理纯文本部分）
-            body = ""
-            for part in email_message.walk():
-                if part.get_content_type() == "text/plain":
-                    body_bytes = part.get_payload(decode=True)
-                    if body_bytes:
-                        charset = part.get_content_charset() or 'utf-8'
-                        try:
-                            body = body_bytes.decode(charset)
-                        except UnicodeDecodeError:
-                            body = body_bytes.decode('utf-8', errors='ignore')
-                    break
+            email_info = self.parse_email_bytes(email_body)
 
             # 将邮件设置为已读
             mail.store(message_id, "+FLAGS", "\\Seen")
-            return {"sender": sender, "subject": subject, "body": body}
+            return email_info
 
         except Exception as e:
             print(f"解析邮件 {message_id} 时出错: {e}")
             return None
 
+    def parse_email_bytes(self, email_body):
+        """把RFC822原文解析为 {"sender", "subject", "body"} 字典"""
+        email_message = email.message_from_bytes(email_body)
+        sender, subject = self.decode_sender_subject(email_message)
+
+        # 获取正文（仅处理纯文本部分）
+        body = ""
+        for part in email_message.walk():
+            if part.get_content_type() == "text/plain":
+                body_bytes = part.get_payload(decode=True)
+                if body_bytes:
+                    charset = part.get_content_charset() or 'utf-8'
+                    try:
+                        body = body_bytes.decode(charset)
+                    except UnicodeDecodeError:
+                        body = body_bytes.decode('utf-8', errors='ignore')
+                break
+
+        return {
+            "sender": sender,
+            "subject": subject,
+            "body": body,
+            "message_id": (email_message.get("Message-ID") or "").strip()
+        }
+
+    def decode_sender_subject(self, email_message):
+        """解码邮件头中的发件人与主题；缺少的邮件头解码为空字符串"""
+        sender = self._decode_header_value(email_message["From"])
+        subject = self._decode_header_value(email_message["Subject"])
+        return sender, subject
+
+    @staticmethod
+    def _decode_header_value(value):
+        """解码单个邮件头的第一段；字符集未知或内容损坏时按UTF-8宽松解码"""
+        text, charset = decode_header(str(value) if value is not None else "")[0]
+        if not isinstance(text, bytes):
+            return text
+        try:
+            return text.decode(charset or 'utf-8')
+        except (LookupError, UnicodeDecodeError):
+            return text.decode('utf-8', errors='replace')
+
+    def fetch_emails_batch(self, message_ids, chunk_size=None, uid=False):
+        """
+        批量获取并解析邮件（生成器）
+
+        每个分块只发送一条 FETCH 命令取回全部原文，解析后逐封产出，
+        再用一条 STORE 命令把该分块中的邮件批量标记为已读，
+        往返次数由每封邮件两次降为每个分块两次。无法解析的邮件同样标记为已读
+        （与 RFC822 获取时的隐式 \\Seen 一致），不会在每次检查时被重新获取。
+
+        Args:
+            message_ids: search_emails 返回的邮件序号列表（uid=True 时为UID列表）
+            chunk_size: 每个分块的邮件数，默认使用类属性 fetch_chunk_size
+            uid: 是否按UID获取和标记
+
+        Yields:
+            tuple: (邮件序号或UID, {"sender", "subject", "body"})
+
+        Raises:
+            imaplib.IMAP4.error: FETCH 命令出错或返回非OK，未处理的邮件不会被跳过
+        """
+        mail = self.connect_to_email()
+        if mail is None:
+            return
+
+        chunk_size = chunk_size or self.fetch_chunk_size
+        for start in range(0, len(message_ids), chunk_size):
+            chunk = message_ids[start:start + chunk_size]
+            message_set = b",".join(chunk).decode()
+            # BODY.PEEK[] 不会隐式设置 \Seen，解析成功后再统一标记
+            with metrics.span("email_monitor", "imap_fetch"):
+                if uid:
+                    status, data = mail.uid("FETCH", message_set, "(UID BODY.PEEK[])")
+                else:
+                    status, data = mail.fetch(message_set, "(BODY.PEEK[])")
+            if status != "OK":
+                raise mail.error(f"批量获取邮件 {message_set} 失败")
+
+            seen_ids = []
+            for item in data:
+                if not isinstance(item, tuple):
+                    continue
+                if uid:
+                    match = _FETCH_UID_RE.search(item[0])
+                    if match is None:
+                        continue
+                    message_id = match.group(1)
+                else:
+                    message_id = item[0].split(b" ", 1)[0]
+                seen_ids.append(message_id)
+                try:
+                    with metrics.span("email_monitor", "parse"):
+                        email_info = self.parse_email_bytes(item[1])
+                except Exception as e:
+                    # 解析错误每次都会重现，记录后跳过，不阻塞后续邮件
+                    print(f"解析邮件 {message_id} 时出错，已跳过: {e}")
+                    continue
+                yield message_id, email_info
+
+            if seen_ids:
+                try:
+                    if uid:
+                        mail.uid("STORE", b",".join(seen_ids).decode(), "+FLAGS", "\\Seen")
+                    else:
+                        mail.store(b",".join(seen_ids).decode(), "+FLAGS", "\\Seen")
+                except Exception as e:
+                    print(f"批量标记已读时出错: {e}")
+
     def save_attachments(self, email_message, save_dir="attachments"):
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
+        # 附件按内容哈希保存，相同附件只写入一次
+        store = ContentAddressedStore(save_dir)
         for part in email_message.walk():
             if part.get_content_maintype() == "multipart":
                 continue
             filename = part.get_filename()
             if filename:
-                filepath = os.path.join(save_dir, filename)
-                with open(filepath, "wb") as f:
-                    f.write(part.get_payload(decode=True))
-                print(f"附件已保存: {filepath}")
+                writer = store.writer(filename)
+                writer.write(part.get_payload(decode=True))
+                saved = writer.commit()
+                print(f"附件已保存: {filename} -> {saved['path']}")
+
+    def fetch_message_sizes(self, uids):
+        """按分块批量查询邮件大小，返回 {UID: 字节数}
+
+        Raises:
+            imaplib.IMAP4.error: FETCH 命令返回非OK
+        """
+        mail = self.connect_to_email()
+        sizes = {}
+        if mail is None:
+            return sizes
+        for start in range(0, len(uids), self.fetch_chunk_size):
+            message_set = b",".join(uids[start:start + self.fetch_chunk_size]).decode()
+            status, data = mail.uid("FETCH", message_set, "(UID RFC822.SIZE)")
+            if status != "OK":
+                raise mail.error(f"查询邮件 {message_set} 的大小失败")
+            for item in data:
+                line = item[0] if isinstance(item, tuple) else item
+                uid_match, size_match = _FETCH_UID_RE.search(line or b""), _FETCH_SIZE_RE.search(line or b"")
+                if uid_match and size_match:
+                    sizes[uid_match.group(1)] = int(size_match.group(1))
+        return sizes
+
+    def stream_email(self, uid, size):
+        """
+        分块流式获取并解析单封邮件
+
+        用 BODY.PEEK[]<起始.长度> 分段取回原文并喂给增量解析器，附件边解码边按内容哈希
+        写入 attachment_dir，内存占用与邮件大小无关。
+
+        Returns:
+            dict: {"sender", "subject", "body", "attachments", "skipped"}
+        """
+        mail = self.connect_to_email()
+        if mail is None:
+            return None
 
-    def check_emailbox(self):
+        parser = StreamingMimeParser(
+            ContentAddressedStore(self.attachment_dir),
+            max_message_size=self.max_message_size,
+            max_attachment_size=self.max_attachment_size
+        )
+        uid_text = uid.decode() if isinstance(uid, bytes) else str(uid)
+        for offset in range(0, size, self.stream_chunk_size):
+            with metrics.span("email_monitor", "imap_fetch"):
+                status, data = mail.uid("FETCH", uid_text, f"(BODY.PEEK[]<{offset}.{self.stream_chunk_size}>)")
+            if status != "OK":
+                raise mail.error(f"分块获取邮件 {uid_text} 失败")
+            chunk = next((item[1] for item in data if isinstance(item, tuple)), None)
+            if not chunk:
+                break
+            parser.feed(chunk)
+
+        result = parser.close()
+        sender, subject = self.decode_sender_subject(result["headers"])
+        mail.uid("STORE", uid_text, "+FLAGS", "\\Seen")
+        return {
+            "sender": sender,
+            "subject": subject,
+            "body": result["body"],
+            "message_id": (result["headers"].get("Message-ID") or "").strip(),
+            "attachments": result["attachments"],
+            "skipped": result["skipped"]
+        }
+
+    def _mark_seen(self, uid):
+        """把无法解析的邮件标记为已读，避免未读搜索反复返回它"""
+        try:
+            self.connect_to_email().uid("STORE", uid.decode() if isinstance(uid, bytes) else str(uid),
+                                        "+FLAGS", "\\Seen")
+        except Exception as e:
+            print(f"标记邮件 {uid} 为已读时出错: {e}")
+
+    def check_emailbox_incremental(self, folder="inbox"):
+        """
+        基于UID的增量检查：只获取上次处理之后到达的邮件
+
+        与 UNSEEN 搜索不同，已在客户端被人工打开过的新邮件同样会被处理。
+        进度只推进到第一封因网络或IMAP错误未能获取的邮件之前，该邮件及其后的邮件在下次检查时
+        重新获取；FETCH 出错时直接抛出，本次不推进进度。无法解析的邮件（解析错误每次都会重现）
+        记录后视为已处理，不阻塞进度。
+        """
+        mail = self.connect_to_email()
+        if mail is None:
+            return
+
+        account = f"{self.email_monitor_username()}@{self.email_monitor_url()}"
+        engine = UidSyncEngine(mail, account, self.sync_state())
+        new_uids, status = engine.pending_uids(folder)
+        print(f"新邮件数量: {len(new_uids)}")
+        if not new_uids:
+            # 首次同步且没有未读邮件时也要记录起点
+            engine.commit(folder, 0, status)
+            return
+
+        # 小邮件批量获取，大邮件逐封流式解析，超过上限的跳过
+        sizes = self.fetch_message_sizes(new_uids)
+        small_uids = [uid for uid in new_uids if sizes.get(uid, 0) <= self.stream_threshold]
+        failed = []
+        for uid, email_info in self.fetch_emails_batch(small_uids, uid=True):
+            self.handle_email(email_info)
+
+        for uid in new_uids:
+            size = sizes.get(uid, 0)
+            if size <= self.stream_threshold:
+                continue
+            if size > self.max_message_size:
+                print(f"邮件 {uid} 大小 {size} 字节，超过上限，已跳过")
+                continue
+            try:
+                email_info = self.stream_email(uid, size)
+            except MessageTooLarge as e:
+                print(f"邮件 {uid} 已跳过: {e}")
+                continue
+            except (imaplib.IMAP4.error, OSError) as e:
+                print(f"流式获取邮件 {uid} 时出错: {e}")
+                failed.append(uid)
+                continue
+            except Exception as e:
+                print(f"流式解析邮件 {uid} 时出错，已跳过: {e}")
+                self._mark_seen(uid)
+                continue
+            if email_info:
+                self.handle_email(email_info)
+                for attachment in email_info["attachments"]:
+                    print(f"附件已保存: {attachment['filename']} -> {attachment['path']}")
+
+        if failed:
+            first_failed = min(int(uid) for uid in failed)
+            print(f"{len(failed)} 封邮件获取失败，进度停在UID {first_failed} 之前，下次检查时重试")
+            # 进度未推进到最新，不记录 HIGHESTMODSEQ，否则下次会误判为邮箱没有变化
+            engine.commit(folder, first_failed - 1)
+        else:
+            engine.commit(folder, max(int(uid) for uid in new_uids), status)
+
+    @classmethod
+    def sync_state(cls):
+        """获取进程内共享的同步进度存储"""
+        if cls._sync_state is None:
+            with cls._sync_state_lock:
+                if cls._sync_state is None:
+                    cls._sync_state = MailboxSyncState()
+        return cls._sync_state
+
+    def check_emailbox(self, folder="inbox"):
         # 获取未读邮件数量
-        unseen_emails = self.search_emails()  # 修复：使用正确的变量名
+        unseen_emails = self.search_emails(folder)  # 修复：使用正确的变量名
         print(f"未读邮件数量: {len(unseen_emails)}")
 
-        # 获取所有邮件的内容
-        for msg_id in unseen_emails:  # 修复：使用正确的变量名
-            email_info = self.parse_email(msg_id)
-            if email_info:
-                print(f"发件人: {email_info['sender']}")
-                print(f"主题: {email_info['subject']}")
-                print(f"正文: {email_info['body'][:100]}...")  # 只显示前100个字符
+        # 分块批量获取所有邮件的内容
+        for msg_id, email_info in self.fetch_emails_batch(unseen_emails):
+            self.handle_email(email_info)
 
-    def close_connection(self):
-        """关闭IMAP连接"""
+    def close_connection(self, broken=False):
+        """归还IMAP连接；连接保持登录以供下次复用，broken=True 时直接断开"""
         if self.mail:
             try:
-                self.mail.close()
-                self.mail.logout()
-            except:
+                self.connections().release(self.email_monitor_url(), self.email_monitor_username(), broken=broken)
+            except Exception:
                 pass
             finally:
                 self.mail = None
 
     def email_service(self,arg1):
-        # 创建邮箱监控实例
-        monitor = email_monitor()
+        # 复用当前实例及其连接
+        monitor = self
+        broken = False
+        # 打开发件箱，补发上次进程退出前未送达的转发
+        if self.durable_forwards:
+            dingtalk_notify.outbox()
 
         try:
             # 测试连接
@@ -150,18 +495,109 @@ class email_monitor:
 
             # 检查邮箱
             print("\n开始检查邮箱...")
-            monitor.check_emailbox()
+            if monitor.use_uid_sync:
+                monitor.check_emailbox_incremental()
+            else:
+                monitor.check_emailbox()
+
+        except KeyboardInterrupt:
+            print("\n程序被用户中断")
+        except Exception as e:
+            print(f"程序运行出错: {e}")
+            broken = isinstance(e, (imaplib.IMAP4.abort, OSError))
+        finally:
+            # 归还连接，连接本身保持登录
+            print("正在归还邮箱连接...")
+            monitor.close_connection(broken=broken)
+            print(f"连接统计: {self.connections().stats()}")
+            if self.rule_engine() is not None:
+                print(f"路由规则统计: {self.rule_engine().stats()}")
+            print("程序退出")
+
+    def handle_email(self, email_info):
+        """处理一封解析后的邮件：打印摘要并按路由规则转发到钉钉"""
+        metrics.inc("emails_processed_total")
+        self.print_email(email_info)
+        self.route_email(email_info)
+
+    def print_email(self, email_info):
+        print(f"发件人: {email_info['sender']}")
+        print(f"主题: {email_info['subject']}")
+        print(f"正文: {email_info['body'][:100]}...")  # 只显示前100个字符
+
+    def email_idle_service(self, arg1, folder="inbox", stop_event=None):
+        """
+        推送模式：保持连接并通过IMAP IDLE等待新邮件
+
+        收到 EXISTS 通知后执行一次增量检查（UID SEARCH/UID FETCH，进度记录在与定时检查
+        相同的 UidSyncEngine 中，重连或轮询时不会重复处理），并在服务器超时前重新发起IDLE；
+        服务器不支持IDLE时退化为按 poll_interval 轮询。连接中断后等待 reconnect_delay
+        秒重新连接，重连后先补查断线期间到达的邮件。
+        """
+        stop_event = stop_event or threading.Event()
+        if self.durable_forwards:
+            dingtalk_notify.outbox()
+        try:
+            while not stop_event.is_set():
+                try:
+                    self._run_idle_session(folder, stop_event)
+                    return
+                except (imaplib.IMAP4.abort, OSError) as e:
+                    print(f"IDLE连接中断: {e}，{self.reconnect_delay} 秒后重连")
+                    self.close_connection(broken=True)
+                    stop_event.wait(self.reconnect_delay)
 
         except KeyboardInterrupt:
             print("\n程序被用户中断")
         except Exception as e:
             print(f"程序运行出错: {e}")
         finally:
-            # 确保关闭连接
-            print("正在关闭邮箱连接...")
-            monitor.close_connection()
+            print("正在归还邮箱连接...")
+            self.close_connection()
             print("程序退出")
 
+    def _check_once(self, folder="inbox"):
+        if self.use_uid_sync:
+            self.check_emailbox_incremental(folder)
+        else:
+            self.check_emailbox(folder)
+
+    def _run_idle_session(self, folder, stop_event):
+        print("正在连接邮箱服务器...")
+        mail = self.connect_to_email()
+        if mail is None:
+            raise OSError("邮箱连接失败")
+
+        # 先处理已有的新邮件
+        self._check_once(folder)
+
+        if not ImapIdle.supported(mail):
+            print("服务器不支持IDLE，改为轮询模式")
+            while not stop_event.wait(self.poll_interval):
+                self._check_once(folder)
+            return
+
+        status, _ = mail.select(folder)
+        if status != "OK":
+            print(f"选择文件夹 {folder} 失败")
+            return
+        idle = ImapIdle(mail)
+        print("已进入IDLE推送模式")
+
+        while not stop_event.is_set():
+            events = idle.wait(self.idle_timeout, stop_event=stop_event)
+            # 只把 EXISTS 当作"可能有新邮件"的信号，具体获取哪些邮件由UID进度决定，
+            # 不依赖会随删除前移的序号
+            if any(kind == b'EXISTS' for _, kind in events):
+                print("收到新邮件通知")
+                try:
+                    self._check_once(folder)
+                except imaplib.IMAP4.abort:
+                    raise
+                except imaplib.IMAP4.error as e:
+                    # 进度未推进，下次通知或重连时重新获取
+                    print(f"获取新邮件失败: {e}")
+
 '''
 # 示例：处理附件
 for msg_id in message_ids:
@@ -0,0 +1,201 @@
+
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from email.utils import parseaddr
+
+
+class AhoCorasick:
+    """Aho-Corasick 多模式匹配自动机（不区分大小写）。
+
+    一次扫描文本即可找出所有出现的关键词（包括相互重叠的关键词），
+    耗时与文本长度和命中数相关，与关键词数量基本无关。
+
+    Args:
+        patterns: (关键词, 附带值) 的可迭代对象；同一关键词可对应多个附带值。
+    """
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        for keyword, payload in patterns:
+            keyword = keyword.lower()
+            if not keyword:
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                state = next_state
+            self._output[state].add(payload)
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def find_all(self, text):
+        """返回文本中出现的所有关键词对应的附带值集合。"""
+        found = set()
+        state = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+
+class EmailRule:
+    """单条路由规则。
+
+    同一规则内，已配置的各类条件（发件人域名、主题关键词、正文关键词、正文正则）
+    需全部满足；同一类条件内任意一项命中即可。
+
+    Args:
+        name: 规则名称。
+        sender_domains: 发件人域名列表，子域名同样命中，如 "example.com" 命中 "mail.example.com"。
+        subject_keywords: 主题关键词列表。
+        body_keywords: 正文关键词列表。
+        body_patterns: 正文正则表达式列表。
+        at_mobiles / at_userids: 推送时@的手机号、用户ID，逗号分隔。
+        is_at_all: 推送时是否@所有人。
+        group: 推送使用的钉钉机器人分组，默认分组为 None。
+    """
+
+    def __init__(self, name, sender_domains=(), subject_keywords=(), body_keywords=(), body_patterns=(),
+                 at_mobiles=None, at_userids=None, is_at_all=False, group=None):
+        self.name = name
+        self.sender_domains = [domain.lower().lstrip('@.') for domain in sender_domains]
+        self.subject_keywords = list(subject_keywords)
+        self.body_keywords = list(body_keywords)
+        self.body_patterns = list(body_patterns)
+        self.at_mobiles = at_mobiles
+        self.at_userids = at_userids
+        self.is_at_all = is_at_all
+        self.group = group
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class EmailRuleEngine:
+    """把全部规则预编译为多模式匹配器的邮件路由引擎。
+
+    - 发件人域名：哈希表，按域名及其各级父域名查找；
+    - 主题/正文关键词：各编译为一个 Aho-Corasick 自动机；
+    - 正文正则：每条单独编译并逐条检测（合并为一个正则时，同一位置只能命中第一条，
+      且反向引用、内联标志等写法无法合并），同一规则的正则命中一条后不再检测其余正则。
+
+    除正文正则外，每封邮件的匹配耗时与规则数量基本无关。引擎同时统计每条规则的命中次数与总耗时。
+
+    Args:
+        rules: EmailRule 列表。
+    """
+
+    DEFAULT_FILE_PATH = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'ignore_file',
+        'email_rules.json'
+    )
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._domain_index = {}
+        subject_patterns, body_patterns = [], []
+        self._body_regexes = []
+        self._kinds = []
+        for index, rule in enumerate(self.rules):
+            kinds = set()
+            for domain in rule.sender_domains:
+                self._domain_index.setdefault(domain, set()).add(index)
+                kinds.add('sender')
+            for keyword in rule.subject_keywords:
+                subject_patterns.append((keyword, index))
+                kinds.add('subject')
+            for keyword in rule.body_keywords:
+                body_patterns.append((keyword, index))
+                kinds.add('body_keyword')
+            for pattern in rule.body_patterns:
+                self._body_regexes.append((re.compile(pattern, re.IGNORECASE), index))
+                kinds.add('body_pattern')
+            self._kinds.append(frozenset(kinds))
+
+        self._subject_matcher = AhoCorasick(subject_patterns)
+        self._body_matcher = AhoCorasick(body_patterns)
+        self._stats_lock = threading.Lock()
+        self.hits = [0] * len(self.rules)
+        self.evaluations = 0
+        self.total_seconds = 0.0
+
+    @classmethod
+    def from_file(cls, file_path=None):
+        """从JSON文件加载规则，文件内容为规则字典的列表。"""
+        with open(file_path or cls.DEFAULT_FILE_PATH, 'r', encoding='utf-8') as f:
+            return cls([EmailRule.from_dict(item) for item in json.load(f)])
+
+    def _sender_rules(self, sender):
+        address = parseaddr(sender or "")[1].lower()
+        domain = address.rsplit('@', 1)[-1] if '@' in address else ""
+        matched = set()
+        while domain:
+            matched |= self._domain_index.get(domain, set())
+            domain = domain.partition('.')[2]
+        return matched
+
+    def _pattern_rules(self, body):
+        matched = set()
+        for regex, index in self._body_regexes:
+            if index not in matched and regex.search(body):
+                matched.add(index)
+        return matched
+
+    def evaluate(self, email_info):
+        """返回命中的规则列表（按规则定义顺序）。"""
+        start = time.perf_counter()
+        body = email_info.get('body') or ""
+        matched_kinds = {}
+        for kind, indexes in (
+                ('sender', self._sender_rules(email_info.get('sender'))),
+                ('subject', self._subject_matcher.find_all(email_info.get('subject') or "")),
+                ('body_keyword', self._body_matcher.find_all(body)),
+                ('body_pattern', self._pattern_rules(body))):
+            for index in indexes:
+                matched_kinds.setdefault(index, set()).add(kind)
+
+        matched = [index for index, kinds in sorted(matched_kinds.items()) if kinds >= self._kinds[index]]
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.evaluations += 1
+            self.total_seconds += elapsed
+            for index in matched:
+                self.hits[index] += 1
+        return [self.rules[index] for index in matched]
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'evaluations': self.evaluations,
+                'avg_ms': self.total_seconds / self.evaluations * 1000 if self.evaluations else 0.0,
+                'hits': {rule.name: hits for rule, hits in zip(self.rules, self.hits)}
+            }
@@ -0,0 +1,151 @@
+
+import json
+import logging
+import os
+import re
+import threading
+
+_STATUS_ITEM_RE = re.compile(rb'(UIDNEXT|UIDVALIDITY|HIGHESTMODSEQ) (\d+)', re.IGNORECASE)
+
+
+class MailboxSyncState:
+    """按 账号/文件夹 持久化同步进度（UIDVALIDITY、已处理的最大UID、HIGHESTMODSEQ）。
+
+    状态以JSON格式保存，写入时先写临时文件再原子替换。
+
+    Args:
+        path: 状态文件路径。
+    """
+
+    DEFAULT_FILE_PATH = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'ignore_file',
+        'email_sync_state.json'
+    )
+
+    def __init__(self, path=None):
+        self.path = path or self.DEFAULT_FILE_PATH
+        self._lock = threading.Lock()
+        self._state = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._state = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning("读取邮箱同步状态失败 %s: %s，将重新同步", self.path, e)
+
+    def get(self, key):
+        with self._lock:
+            return dict(self._state.get(key, {}))
+
+    def update(self, key, **values):
+        with self._lock:
+            self._state.setdefault(key, {}).update(values)
+            snapshot = json.dumps(self._state, ensure_ascii=False, indent=2)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+        os.replace(tmp_path, self.path)
+
+
+class UidSyncEngine:
+    """基于UID区间的增量邮箱同步。
+
+    每次同步先用一条 STATUS 命令读取 UIDNEXT / UIDVALIDITY（服务器支持CONDSTORE时
+    还读取 HIGHESTMODSEQ），与本地记录比较：没有新邮件时无需 SELECT 即可返回；
+    有新邮件时只查询 `UID 上次最大UID+1:*`。单次成本只与新邮件数量有关，
+    与邮箱大小和邮件是否已被人工阅读无关。
+
+    UIDVALIDITY 变化（或首次同步）时本地进度作废，用一次 UNSEEN 搜索补上已有的未读邮件；
+    新的起点（当前 UIDNEXT）在这批邮件全部处理完、调用 commit 时才写入，中途失败或进程退出时
+    下次重新补同步（已处理的邮件已标记为已读，不会重复）。
+
+    Args:
+        mail: 已登录的 imaplib 连接。
+        account: 账号标识，用于区分状态文件中的记录，如 "user@imap.example.com"。
+        state: MailboxSyncState 实例。
+    """
+
+    def __init__(self, mail, account, state):
+        self.mail = mail
+        self.account = account
+        self.state = state
+        self.condstore = 'CONDSTORE' in getattr(mail, 'capabilities', ())
+        # 正在补同步的文件夹 -> 本次观察到的状态，commit 时才写入新的起点
+        self._resync = {}
+
+    def _key(self, folder):
+        return f"{self.account}/{folder}"
+
+    def mailbox_status(self, folder):
+        items = "(UIDNEXT UIDVALIDITY HIGHESTMODSEQ)" if self.condstore else "(UIDNEXT UIDVALIDITY)"
+        status, data = self.mail.status(folder, items)
+        if status != "OK":
+            raise self.mail.error(f"获取文件夹 {folder} 状态失败")
+        return {name.decode().upper(): int(value) for name, value in _STATUS_ITEM_RE.findall(data[0])}
+
+    def pending_uids(self, folder="inbox"):
+        """返回尚未处理的新邮件UID列表（bytes，升序），并返回本次观察到的状态。
+
+        Returns:
+            tuple: (UID列表, 文件夹状态字典)
+        """
+        status = self.mailbox_status(folder)
+        saved = self.state.get(self._key(folder))
+
+        if saved.get('uidvalidity') != status['UIDVALIDITY']:
+            # 首次同步或UIDVALIDITY变化：补上已有的未读邮件，处理完成后再以当前UIDNEXT为起点
+            self._select(folder)
+            typ, data = self.mail.uid('SEARCH', None, 'UNSEEN')
+            if typ != "OK":
+                raise self.mail.error(f"搜索文件夹 {folder} 的未读邮件失败")
+            self._resync[folder] = status
+            return (data[0].split() if data[0] else []), status
+
+        last_uid = saved.get('last_uid', 0)
+        if self.condstore and saved.get('highestmodseq') == status.get('HIGHESTMODSEQ'):
+            # 邮箱自上次同步以来没有任何变化
+            return [], status
+        if status['UIDNEXT'] - 1 <= last_uid:
+            self.state.update(self._key(folder), highestmodseq=status.get('HIGHESTMODSEQ'))
+            return [], status
+
+        self._select(folder)
+        typ, data = self.mail.uid('SEARCH', None, f'UID {last_uid + 1}:*')
+        if typ != "OK":
+            raise self.mail.error(f"搜索文件夹 {folder} 的新邮件失败")
+        # `n:*` 在没有更大UID时会返回当前最大的UID，需过滤
+        uids = [uid for uid in (data[0].split() if data[0] else []) if int(uid) > last_uid]
+        return uids, status
+
+    def _select(self, folder):
+        status, _ = self.mail.select(folder)
+        if status != "OK":
+            raise self.mail.error(f"选择文件夹 {folder} 失败")
+
+    def commit(self, folder, last_uid, status=None):
+        """记录已处理到的最大UID；应在邮件处理完成后调用，保证至少处理一次。
+
+        补同步时只有整批处理完成（传入 status）才写入新的起点，部分完成时不记录，
+        下次重新补同步。
+        """
+        resync = self._resync.pop(folder, None)
+        if resync is not None:
+            if status is None:
+                logging.warning("文件夹 %s 的补同步未全部完成，下次重新补同步", folder)
+                return
+            self.state.update(
+                self._key(folder),
+                uidvalidity=resync['UIDVALIDITY'],
+                last_uid=max(int(last_uid), resync['UIDNEXT'] - 1),
+                highestmodseq=status.get('HIGHESTMODSEQ')
+            )
+            return
+        saved = self.state.get(self._key(folder))
+        values = {'last_uid': max(int(last_uid), saved.get('last_uid', 0))}
+        if status is not None:
+            values['highestmodseq'] = status.get('HIGHESTMODSEQ')
+        self.state.update(self._key(folder), **values)
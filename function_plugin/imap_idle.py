@@ -0,0 +1,108 @@
+import itertools
+import re
+import select
+import socket
+import time
+
+# 未经请求的状态响应，如 "* 23 EXISTS"、"* 5 EXPUNGE"
+_UNTAGGED_RE = re.compile(rb'^\* (\d+) (EXISTS|EXPUNGE|RECENT)', re.IGNORECASE)
+
+# IDLE 命令使用自己的标签；imaplib 的标签前缀为大写字母，小写前缀不会与之冲突
+_TAG_COUNTER = itertools.count(1)
+
+
+class ImapIdle:
+    """基于 IMAP IDLE（RFC 2177）的推送等待。
+
+    Python 3.13 及以下的 imaplib 没有提供 IDLE 命令，这里在已登录并选中
+    文件夹的连接上用公开的 send() / readline() 收发命令，读取仍经过 imaplib
+    的缓冲文件。等待通知时只用 select 判断套接字是否可读，读取一行时设置
+    套接字超时，超时后连接不可再用，按 abort 处理；正常结束时发送 DONE，
+    连接随后仍可继续执行普通命令。
+
+    Args:
+        mail: 已登录并已 select 文件夹的 imaplib.IMAP4 / IMAP4_SSL 连接。
+    """
+
+    def __init__(self, mail):
+        self.mail = mail
+
+    @staticmethod
+    def supported(mail):
+        """登录后重新查询服务器能力；登录前的能力列表可能不包含 IDLE。"""
+        typ, data = mail.capability()
+        if typ != 'OK' or not data or data[-1] is None:
+            return False
+        capabilities = data[-1].decode('ascii', 'replace').upper().split()
+        return 'IDLE' in capabilities
+
+    def _readable(self, timeout):
+        sock = self.mail.sock
+        if hasattr(sock, 'pending') and sock.pending():
+            return True
+        ready, _, _ = select.select([sock], [], [], max(0.0, timeout))
+        return bool(ready)
+
+    def _read_line(self, timeout):
+        """经 imaplib 读取一行响应；timeout 秒内没有完整的一行时抛出 abort。"""
+        mail = self.mail
+        sock = mail.sock
+        previous = sock.gettimeout()
+        sock.settimeout(timeout)
+        try:
+            line = mail.readline()
+        except socket.timeout:
+            raise mail.abort("等待IMAP响应超时")
+        finally:
+            sock.settimeout(previous)
+        if not line:
+            raise mail.abort("IMAP连接已被服务器关闭")
+        return line.rstrip(b'\r\n')
+
+    def wait(self, timeout, stop_event=None, response_timeout=30):
+        """进入IDLE并等待邮箱变化。
+
+        Args:
+            timeout: 最长等待时间（秒），应小于服务器的IDLE超时（通常29分钟）。
+            stop_event: 可选的 threading.Event，置位后尽快结束等待。
+            response_timeout: 等待服务器应答 IDLE / DONE 的超时时间（秒）。
+
+        Returns:
+            list: 收到的 (序号, 类型) 列表，类型为 b'EXISTS'、b'EXPUNGE' 或 b'RECENT'；
+            超时且无变化时为空列表。
+        """
+        mail = self.mail
+        tag = b'idle%d' % next(_TAG_COUNTER)
+        mail.send(tag + b' IDLE\r\n')
+
+        line = self._read_line(response_timeout)
+        if not line.startswith(b'+'):
+            raise mail.error(f"服务器拒绝IDLE: {line!r}")
+
+        events = []
+        deadline = time.monotonic() + timeout
+        while not events:
+            if stop_event is not None and stop_event.is_set():
+                break
+            time_left = deadline - time.monotonic()
+            if time_left <= 0:
+                break
+            # 分段等待，以便及时响应stop_event；已缓冲但未读取的行会在收到
+            # 下一段数据或发送 DONE 后读出，不会丢失
+            if not self._readable(min(time_left, 1.0)):
+                continue
+            match = _UNTAGGED_RE.match(self._read_line(response_timeout))
+            if match:
+                events.append((int(match.group(1)), match.group(2).upper()))
+
+        mail.send(b'DONE\r\n')
+        while True:
+            line = self._read_line(response_timeout)
+            if line.startswith(tag):
+                if not line[len(tag):].strip().upper().startswith(b'OK'):
+                    raise mail.error(f"IDLE结束失败: {line!r}")
+                break
+            match = _UNTAGGED_RE.match(line)
+            if match:
+                events.append((int(match.group(1)), match.group(2).upper()))
+        return events
@@ -0,0 +1,181 @@
+
+import imaplib
+import logging
+import threading
+import time
+
+
+class _PooledConnection:
+    __slots__ = ('mail', 'in_use', 'probing', 'last_used')
+
+    def __init__(self, mail=None):
+        # mail 为 None 表示首次登录尚未完成（占位）
+        self.mail = mail
+        self.in_use = False
+        # 后台保活线程正在发送 NOOP
+        self.probing = False
+        self.last_used = time.monotonic()
+
+
+class ImapConnectionManager:
+    """跨多次检查复用已登录的IMAP连接。
+
+    连接按 (服务器, 账号) 缓存。取出连接时，若空闲超过 check_interval 秒，
+    先发送 NOOP 探活；探活失败或连接已处于LOGOUT状态时透明地重新连接并登录。
+    后台线程定期给空闲连接发送 NOOP，防止被服务器的空闲超时断开；
+    正在使用中的连接不会被后台线程触碰，取出时恰逢后台 NOOP 则等待其完成，
+    因此同一连接不会被并发使用。同一 (服务器, 账号) 首次登录时先占位，
+    并发取出的其他调用方不会再登录一个会话。
+
+    Args:
+        factory: 创建连接的函数，参数为服务器地址，默认 imaplib.IMAP4_SSL。
+        check_interval: 取出连接时需要探活的最小空闲时间（秒）。
+        keepalive_interval: 后台 NOOP 保活的间隔（秒），为 None 时不启动后台线程。
+    """
+
+    def __init__(self, factory=imaplib.IMAP4_SSL, check_interval=30, keepalive_interval=240):
+        self.factory = factory
+        self.check_interval = check_interval
+        self.keepalive_interval = keepalive_interval
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._keepalive_thread = None
+        self._stop_event = threading.Event()
+        self.opened = 0
+        self.reused = 0
+        self.reconnected = 0
+        self.keepalives = 0
+
+    def _open(self, host, username, password):
+        mail = self.factory(host)
+        mail.login(username, password)
+        return mail
+
+    @staticmethod
+    def _is_alive(mail):
+        if getattr(mail, 'state', None) == 'LOGOUT':
+            return False
+        try:
+            status, _ = mail.noop()
+            return status == 'OK'
+        except (imaplib.IMAP4.error, OSError):
+            return False
+
+    def acquire(self, host, username, password):
+        """取出可用的连接并标记为使用中，用完后调用 release()。
+
+        Raises:
+            RuntimeError: 连接正在被其他调用方使用。
+        """
+        key = (host, username)
+        with self._condition:
+            pooled = self._connections.get(key)
+            # 后台保活正在发送 NOOP 时等待其完成（NOOP 很快），而不是当作连接不可用
+            while pooled is not None and pooled.probing:
+                self._condition.wait()
+                pooled = self._connections.get(key)
+            if pooled is not None and pooled.in_use:
+                raise RuntimeError(f"IMAP连接 {username}@{host} 正在被使用")
+            if pooled is None:
+                pooled = self._connections[key] = _PooledConnection()
+            pooled.in_use = True
+
+        if pooled.mail is None:
+            self._login(key, pooled, password)
+            self.opened += 1
+        elif time.monotonic() - pooled.last_used >= self.check_interval and not self._is_alive(pooled.mail):
+            logging.info("IMAP连接 %s@%s 已失效，重新连接", username, host)
+            self._discard(pooled.mail)
+            self._login(key, pooled, password)
+            self.reconnected += 1
+        else:
+            self.reused += 1
+
+        self._ensure_keepalive()
+        return pooled.mail
+
+    def _login(self, key, pooled, password):
+        """为占位或失效的连接重新登录；失败时移除该连接，下次取出时重试。"""
+        try:
+            pooled.mail = self._open(key[0], key[1], password)
+        except Exception:
+            with self._condition:
+                if self._connections.get(key) is pooled:
+                    del self._connections[key]
+            raise
+        pooled.last_used = time.monotonic()
+
+    def release(self, host, username, broken=False):
+        """归还连接；broken=True 时直接丢弃，下次取出会重新连接。"""
+        key = (host, username)
+        with self._lock:
+            pooled = self._connections.get(key)
+            if pooled is None:
+                return
+            if broken:
+                del self._connections[key]
+            else:
+                pooled.in_use = False
+                pooled.last_used = time.monotonic()
+        if broken:
+            self._discard(pooled.mail)
+
+    @staticmethod
+    def _discard(mail):
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+    def _ensure_keepalive(self):
+        if self.keepalive_interval is None or self._keepalive_thread is not None:
+            return
+        with self._lock:
+            if self._keepalive_thread is None:
+                self._keepalive_thread = threading.Thread(target=self._keepalive_loop, name="ImapKeepalive",
+                                                          daemon=True)
+                self._keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        while not self._stop_event.wait(self.keepalive_interval):
+            now = time.monotonic()
+            with self._lock:
+                idle = [(key, pooled) for key, pooled in self._connections.items()
+                        if not pooled.in_use and now - pooled.last_used >= self.keepalive_interval]
+                for _, pooled in idle:
+                    pooled.probing = True
+            for key, pooled in idle:
+                alive = self._is_alive(pooled.mail)
+                self.keepalives += 1
+                with self._condition:
+                    pooled.probing = False
+                    if alive:
+                        pooled.last_used = time.monotonic()
+                    elif self._connections.get(key) is pooled:
+                        del self._connections[key]
+                    # 唤醒等待本次 NOOP 完成的 acquire()
+                    self._condition.notify_all()
+                if not alive:
+                    self._discard(pooled.mail)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._connections)
+        return {
+            'connections': size,
+            'opened': self.opened,
+            'reused': self.reused,
+            'reconnected': self.reconnected,
+            'keepalives': self.keepalives
+        }
+
+    def close_all(self):
+        """退出所有连接并停止后台保活线程。"""
+        self._stop_event.set()
+        with self._condition:
+            connections, self._connections = list(self._connections.values()), {}
+            self._condition.notify_all()
+        for pooled in connections:
+            if pooled.mail is not None:
+                self._discard(pooled.mail)
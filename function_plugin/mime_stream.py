@@ -0,0 +1,361 @@
+
+import binascii
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+
+# 超过该长度仍没有换行时，先把已缓冲的内容交给当前部件，避免单行无限增长
+_MAX_LINE = 64 * 1024
+_UNSAFE_FILENAME_RE = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+_NON_BASE64_RE = re.compile(rb'[^A-Za-z0-9+/]')
+
+
+class MessageTooLarge(Exception):
+    """邮件大小超过预算。"""
+
+
+class ContentAddressedStore:
+    """按内容哈希保存附件，相同内容只写入一次。
+
+    文件保存为 `<root>/<sha256><扩展名>`，写入过程先落到临时文件，
+    完成后再原子改名；目标已存在时直接丢弃临时文件。
+
+    Args:
+        root: 附件保存目录。
+    """
+
+    def __init__(self, root="attachments"):
+        self.root = root
+
+    def writer(self, filename):
+        os.makedirs(self.root, exist_ok=True)
+        return _BlobWriter(self, filename)
+
+
+class _BlobWriter:
+    def __init__(self, store, filename):
+        self.store = store
+        self.filename = filename
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self._tmp_path = tempfile.mkstemp(prefix=".part-", dir=store.root)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        if data:
+            self._file.write(data)
+            self._hash.update(data)
+            self.size += len(data)
+
+    def commit(self):
+        self._file.close()
+        digest = self._hash.hexdigest()
+        extension = os.path.splitext(self.filename)[1].lower()
+        path = os.path.join(self.store.root, digest + extension)
+        duplicate = os.path.exists(path)
+        if duplicate:
+            os.remove(self._tmp_path)
+        else:
+            os.replace(self._tmp_path, path)
+        return {
+            "filename": self.filename,
+            "path": path,
+            "sha256": digest,
+            "size": self.size,
+            "duplicate": duplicate
+        }
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def _decode_base64(data):
+    """宽松地解码base64，返回 (内容, 是否有缺陷)。
+
+    与 email 包的处理一致：填充缺失或位置错误时去掉非base64字符后重新分组，
+    补齐填充，最后不足一个字节的残缺分组直接丢弃，而不是让整封邮件解析失败。
+    """
+    try:
+        return binascii.a2b_base64(data), False
+    except binascii.Error:
+        pass
+    chars = _NON_BASE64_RE.sub(b"", data)
+    if len(chars) % 4 == 1:
+        chars = chars[:-1]
+    return binascii.a2b_base64(chars + b"=" * (-len(chars) % 4)), True
+
+
+class _Base64Decoder:
+    def __init__(self):
+        self._pending = b""
+        self.defective = False
+
+    def feed(self, data):
+        data = self._pending + b"".join(data.split())
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        return self._decode(data[:usable]) if usable else b""
+
+    def flush(self):
+        pending, self._pending = self._pending, b""
+        # 截断的尾部：补齐缺失的填充，尽量还原被截断的内容
+        return self._decode(pending) if pending else b""
+
+    def _decode(self, data):
+        decoded, defective = _decode_base64(data)
+        self.defective = self.defective or defective
+        return decoded
+
+
+class _QuotedPrintableDecoder:
+    """QP编码按行解码；不完整的行先缓存，避免把 =XX 转义拆开。"""
+
+    def __init__(self):
+        self._pending = b""
+
+    def feed(self, data):
+        data = self._pending + data
+        cut = data.rfind(b"\n") + 1
+        self._pending = data[cut:]
+        return binascii.a2b_qp(data[:cut]) if cut else b""
+
+    def flush(self):
+        pending, self._pending = self._pending, b""
+        return binascii.a2b_qp(pending) if pending else b""
+
+
+class _IdentityDecoder:
+    def feed(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+def _decoder_for(part):
+    encoding = (part.get("Content-Transfer-Encoding") or "").strip().lower()
+    if encoding == "base64":
+        return _Base64Decoder()
+    if encoding == "quoted-printable":
+        return _QuotedPrintableDecoder()
+    return _IdentityDecoder()
+
+
+def _attachment_filename(part):
+    filename = part.get_filename()
+    if not filename:
+        return None
+    try:
+        filename = str(make_header(decode_header(filename)))
+    except Exception:
+        pass
+    filename = _UNSAFE_FILENAME_RE.sub("_", os.path.basename(filename.replace("\\", "/")))
+    return filename or "attachment"
+
+
+class _PartSink:
+    """单个叶子部件的输出：附件写入磁盘、正文收集到内存，其余内容丢弃。
+
+    行尾换行符延迟写入：紧挨分隔线之前的换行属于分隔线本身，不属于部件内容。
+    """
+
+    def __init__(self, parser, part):
+        self.parser = parser
+        self.part = part
+        self.kind = "discard"
+        self.decoder = _decoder_for(part)
+        self.writer = None
+        self.text = None
+        self._pending_eol = b""
+
+        filename = _attachment_filename(part)
+        if filename:
+            self.kind = "attachment"
+            self.filename = filename
+            self.writer = parser.store.writer(filename)
+        elif part.get_content_type() == "text/plain" and parser.body_bytes is None:
+            self.kind = "text"
+            self.text = bytearray()
+
+    def write(self, content, eol):
+        if self.kind == "discard":
+            return
+        self._emit(self.decoder.feed(self._pending_eol + content))
+        self._pending_eol = eol
+
+    def _emit(self, data):
+        if not data:
+            return
+        if self.kind == "attachment":
+            if self.writer.size + len(data) > self.parser.max_attachment_size:
+                self.writer.abort()
+                self.parser.skipped.append({"filename": self.filename, "reason": "too_large"})
+                self.kind = "discard"
+                return
+            self.writer.write(data)
+        elif self.kind == "text":
+            room = self.parser.max_text_size - len(self.text)
+            self.text += data[:max(room, 0)]
+
+    def finish(self):
+        if self.kind == "discard":
+            return
+        self._emit(self.decoder.flush())
+        if getattr(self.decoder, "defective", False):
+            logging.warning("邮件部件 %s 的base64内容不完整或格式错误，已尽量解码",
+                            getattr(self, "filename", self.part.get_content_type()))
+        if self.kind == "attachment":
+            self.parser.attachments.append(self.writer.commit())
+        elif self.kind == "text":
+            self.parser.body_bytes = bytes(self.text)
+            self.parser.body_charset = self.part.get_content_charset() or "utf-8"
+
+    def abort(self):
+        if self.kind == "attachment":
+            self.writer.abort()
+        self.kind = "discard"
+
+
+class StreamingMimeParser:
+    """增量MIME解析器：按块喂入邮件原文，附件边解码边写盘。
+
+    与 email.message_from_bytes 不同，邮件原文和附件内容都不会整体驻留内存：
+    头部用 BytesHeaderParser 解析，正文按行在 multipart 分隔线之间切分，
+    附件部件按 base64 / quoted-printable 增量解码后写入 ContentAddressedStore。
+
+    Args:
+        store: ContentAddressedStore 实例。
+        max_message_size: 单封邮件原文的最大字节数，超过时抛出 MessageTooLarge。
+        max_attachment_size: 单个附件解码后的最大字节数，超过的附件被跳过。
+        max_text_size: 纯文本正文最多保留的字节数。
+    """
+
+    def __init__(self, store, max_message_size=100 * 1024 * 1024, max_attachment_size=50 * 1024 * 1024,
+                 max_text_size=1024 * 1024):
+        self.store = store
+        self.max_message_size = max_message_size
+        self.max_attachment_size = max_attachment_size
+        self.max_text_size = max_text_size
+        self.headers = None
+        self.body_bytes = None
+        self.body_charset = "utf-8"
+        self.attachments = []
+        self.skipped = []
+        self.received = 0
+        self._buffer = b""
+        self._in_headers = True
+        self._header_lines = []
+        self._boundaries = []
+        self._sink = None
+        self._mid_line = False
+
+    def feed(self, data):
+        self.received += len(data)
+        if self.received > self.max_message_size:
+            self._abort()
+            raise MessageTooLarge(f"邮件超过 {self.max_message_size} 字节")
+        self._buffer += data
+        start = 0
+        while True:
+            end = self._buffer.find(b"\n", start)
+            if end < 0:
+                break
+            self._handle_line(self._buffer[start:end + 1])
+            start = end + 1
+        self._buffer = self._buffer[start:]
+        if len(self._buffer) > _MAX_LINE and not self._in_headers:
+            self._handle_partial(self._buffer)
+            self._buffer = b""
+
+    def close(self):
+        """结束解析，返回 {"headers", "body", "attachments", "skipped"}。"""
+        if self._buffer:
+            self._handle_line(self._buffer)
+            self._buffer = b""
+        if self._in_headers and self._header_lines:
+            self._end_headers()
+        if self._sink is not None:
+            self._sink.finish()
+            self._sink = None
+
+        body = ""
+        if self.body_bytes:
+            try:
+                body = self.body_bytes.decode(self.body_charset)
+            except (UnicodeDecodeError, LookupError):
+                body = self.body_bytes.decode("utf-8", errors="ignore")
+        return {
+            "headers": self.headers,
+            "body": body,
+            "attachments": self.attachments,
+            "skipped": self.skipped
+        }
+
+    def _abort(self):
+        if self._sink is not None:
+            self._sink.abort()
+            self._sink = None
+
+    def _handle_partial(self, content):
+        if self._sink is not None:
+            self._sink.write(content, b"")
+        self._mid_line = True
+
+    def _handle_line(self, line):
+        if self._in_headers:
+            if line.strip(b"\r\n"):
+                self._header_lines.append(line)
+            else:
+                self._end_headers()
+            return
+
+        if self._mid_line:
+            # 超长行的剩余部分，不可能是分隔线
+            self._mid_line = False
+        elif line.startswith(b"--") and self._boundaries and self._handle_boundary(line.rstrip()):
+            return
+
+        if self._sink is not None:
+            content = line.rstrip(b"\r\n")
+            self._sink.write(content, line[len(content):])
+
+    def _handle_boundary(self, marker):
+        for depth in range(len(self._boundaries) - 1, -1, -1):
+            boundary = self._boundaries[depth]
+            if marker == b"--" + boundary:
+                self._finish_sink()
+                del self._boundaries[depth + 1:]
+                self._in_headers = True
+                self._header_lines = []
+                return True
+            if marker == b"--" + boundary + b"--":
+                self._finish_sink()
+                del self._boundaries[depth:]
+                return True
+        return False
+
+    def _finish_sink(self):
+        if self._sink is not None:
+            self._sink.finish()
+            self._sink = None
+
+    def _end_headers(self):
+        part = BytesHeaderParser().parsebytes(b"".join(self._header_lines))
+        self._header_lines = []
+        self._in_headers = False
+        if self.headers is None:
+            self.headers = part
+
+        boundary = part.get_boundary() if part.get_content_maintype() == "multipart" else None
+        if boundary:
+            # multipart 的前言部分直接丢弃
+            self._boundaries.append(boundary.encode("ascii", errors="replace"))
+            self._sink = None
+        else:
+            self._sink = _PartSink(self, part)
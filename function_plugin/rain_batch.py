@@ -0,0 +1,137 @@
+
+from datetime import datetime
+
+import numpy as np
+
+# 北京时间相对UTC的偏移；Asia/Shanghai自1991年起不再使用夏令时
+BEIJING_OFFSET = np.timedelta64(8, 'h')
+
+# 默认降雨检测时段：上午8-13时，下午14-18时
+DEFAULT_WINDOWS = (
+    tuple(range(8, 14)),
+    tuple(range(14, 19)),
+)
+
+
+def _parse_utc_hours(fx_times):
+    """把一组fxTime批量转换为北京时间的小时数，无法解析的位置为-1。
+
+    与 rain_report.extract_weather_data_json 保持一致：去掉 '+' 之后的时区部分，
+    把剩余的本地时间当作UTC处理后再换算为北京时间。
+    """
+    parts = [fx_time.split('+')[0] for fx_time in fx_times]
+    hours = np.full(len(parts), -1, dtype=np.int64)
+    if not parts:
+        return hours
+
+    try:
+        if any(len(part) < 16 or 'Z' in part or '-' in part[10:] for part in parts):
+            raise ValueError("存在需要逐条处理的时间")
+        stamps = np.array(parts, dtype='datetime64[s]')
+    except ValueError:
+        # 少数格式异常的时间逐条解析，行为与原实现相同
+        stamps = np.full(len(parts), np.datetime64('NaT'), dtype='datetime64[s]')
+        for index, part in enumerate(parts):
+            try:
+                dt = datetime.fromisoformat(part)
+                if dt.tzinfo is not None:
+                    raise ValueError("Not naive datetime (tzinfo is already set)")
+                stamps[index] = np.datetime64(dt, 's')
+            except Exception as e:
+                print(f"时间转换错误: {e}")
+
+    valid = ~np.isnat(stamps)
+    local_hours = (stamps[valid] + BEIJING_OFFSET).astype('datetime64[h]').astype(np.int64) % 24
+    hours[valid] = local_hours
+    return hours
+
+
+class ForecastBatch:
+    """多个坐标点24小时预报的列式表示（坐标点 × 北京时间小时）。
+
+    每个坐标点对应一行，24列分别为北京时间0-23时；同一小时出现多条预报时
+    以最后一条为准，与按字典逐条写入的结果一致。
+
+    属性:
+        locations: 坐标点列表。
+        present: bool矩阵，该坐标点该小时是否有预报。
+        rain: bool矩阵，该小时天气描述是否包含“雨”。
+        temp / icon / text: object矩阵，保存原始字段值。
+    """
+
+    def __init__(self, locations, present, rain, temp, icon, text):
+        self.locations = list(locations)
+        self.present = present
+        self.rain = rain
+        self.temp = temp
+        self.icon = icon
+        self.text = text
+
+    @classmethod
+    def from_responses(cls, locations, responses):
+        """由和风天气的JSON响应构建批次。
+
+        Args:
+            locations: 坐标点列表。
+            responses: 与 locations 一一对应的JSON响应字典。
+        """
+        row_count = len(locations)
+        rows, fx_times, temps, icons, texts = [], [], [], [], []
+        for row, response in enumerate(responses):
+            for item in response.get('hourly', []):
+                rows.append(row)
+                fx_times.append(item.get('fxTime', ''))
+                temps.append(item.get('temp', ''))
+                icons.append(item.get('icon', ''))
+                texts.append(item.get('text', ''))
+
+        present = np.zeros((row_count, 24), dtype=bool)
+        rain = np.zeros((row_count, 24), dtype=bool)
+        temp = np.full((row_count, 24), None, dtype=object)
+        icon = np.full((row_count, 24), None, dtype=object)
+        text = np.full((row_count, 24), None, dtype=object)
+        if not rows:
+            return cls(locations, present, rain, temp, icon, text)
+
+        rows = np.asarray(rows, dtype=np.int64)
+        hours = _parse_utc_hours(fx_times)
+        valid = np.nonzero(hours >= 0)[0]
+
+        # 同一(坐标点, 小时)保留最后一条：倒序后取首次出现的位置
+        cells = rows[valid] * 24 + hours[valid]
+        _, last_in_reversed = np.unique(cells[::-1], return_index=True)
+        keep = valid[len(valid) - 1 - last_in_reversed]
+
+        keep_rows, keep_hours = rows[keep], hours[keep]
+        keep_texts = np.array([texts[i] for i in keep], dtype=object)
+        present[keep_rows, keep_hours] = True
+        rain[keep_rows, keep_hours] = np.char.find(keep_texts.astype(str), '雨') >= 0
+        temp[keep_rows, keep_hours] = [temps[i] for i in keep]
+        icon[keep_rows, keep_hours] = [icons[i] for i in keep]
+        text[keep_rows, keep_hours] = keep_texts
+        return cls(locations, present, rain, temp, icon, text)
+
+    def rain_in_windows(self, windows=DEFAULT_WINDOWS):
+        """按小时窗口做降雨归约。
+
+        Args:
+            windows: 小时窗口序列，每个窗口为北京时间小时数的序列。
+
+        Returns:
+            numpy.ndarray: 形状为 (坐标点数, 窗口数) 的bool矩阵。
+        """
+        result = np.zeros((len(self.locations), len(windows)), dtype=bool)
+        for column, window in enumerate(windows):
+            result[:, column] = self.rain[:, list(window)].any(axis=1)
+        return result
+
+    def to_weather_dict(self, row):
+        """还原为 extract_weather_data_json 的字典格式，便于对照与兼容旧代码。"""
+        return {
+            f"{hour}时": {
+                'temp': self.temp[row, hour],
+                'icon': self.icon[row, hour],
+                'text': self.text[row, hour]
+            }
+            for hour in np.nonzero(self.present[row])[0].tolist()
+        }
@@ -0,0 +1,61 @@
+
+import math
+from collections import OrderedDict
+
+
+class ForecastGrid:
+    """把监测坐标吸附到预报格点，落在同一格点内的坐标只请求一次。
+
+    和风天气格点预报的空间分辨率约为3-5公里，且接口只接受两位小数的经纬度，
+    相距几百米的坐标点返回的是同一份预报。本类按 resolution（度）把坐标
+    吸附到格点中心，并记录格点与原始坐标的对应关系。
+
+    Args:
+        resolution: 格点边长（度），默认0.03度（约3公里）。
+    """
+
+    def __init__(self, resolution=0.03):
+        if resolution <= 0:
+            raise ValueError("格点分辨率必须为正数")
+        self.resolution = resolution
+        self.point_count = 0
+        self.cell_count = 0
+
+    def _snap(self, value):
+        return math.floor(float(value) / self.resolution + 0.5)
+
+    def cell_of(self, location):
+        """返回坐标所在格点的整数索引 (经度索引, 纬度索引)。"""
+        lon, lat = location.split(',')
+        return self._snap(lon), self._snap(lat)
+
+    def cell_location(self, cell):
+        """返回格点中心坐标，格式为和风天气接口要求的 "经度,纬度"。"""
+        lon_index, lat_index = cell
+        return f"{lon_index * self.resolution:.2f},{lat_index * self.resolution:.2f}"
+
+    def group(self, location_list):
+        """按格点对坐标分组。
+
+        Returns:
+            OrderedDict: {格点中心坐标: [落在该格点的原始坐标, ...]}，
+            按原始坐标首次出现的顺序排列。
+        """
+        groups = OrderedDict()
+        for location in location_list:
+            query = self.cell_location(self.cell_of(location.strip()))
+            groups.setdefault(query, []).append(location)
+        self.point_count = len(location_list)
+        self.cell_count = len(groups)
+        return groups
+
+    @property
+    def saved_calls(self):
+        return self.point_count - self.cell_count
+
+    def stats(self):
+        return {
+            'points': self.point_count,
+            'cells': self.cell_count,
+            'saved_calls': self.saved_calls
+        }
@@ -1,52 +1,169 @@
 
-import jwt
-import requests
-from datetime import datetime, timezone, time
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 import pytz
+import requests
 from auth_service.auth_decorator import require_secret
+from auth_service.token_provider import JwtTokenProvider
+from function_base import metrics
+from function_base.idempotency import IdempotencyStore
+from function_base.resilient_client import CircuitOpenError, ResilientClient
+from function_base.ttl_cache import TTLCache
+from .dingtalk_notify import dingtalk_notify
+from .rain_grid import ForecastGrid
+from .rain_windows import DEFAULT_ALERT_WINDOWS, IncrementalRainEvaluator
 
 class rain_report:
 
+    # 并发请求天气时的最大线程数，设为1则逐个请求
+    max_workers = 8
+
+    # 坐标点很多时可改用基于numpy的列式批量计算
+    use_batch_engine = False
+
+    # 落在同一预报格点（默认0.03度，约3公里）内的坐标点只请求一次
+    dedupe_grid = True
+    grid_resolution = 0.03
+
+    # 和风天气接口的协议，可改为 http 以连接本地的模拟服务
+    api_scheme = 'https'
+
+    # 24小时预报缓存：有效期（秒）、最大坐标点数与持久化文件
+    forecast_ttl = 600
+    forecast_cache_size = 4096
+    forecast_cache_path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'ignore_file',
+        'forecast_cache.json'
+    )
+    _forecast_cache = None
+    _forecast_cache_lock = threading.Lock()
+
+    # 设置为 function_base.process_pool.ProcessTaskPool 后，坐标点按格点分片到子进程中计算
+    shard_pool = None
+    # 单个分片的时限（秒）
+    shard_timeout = 120
+
+    # 降雨提醒时段（AlertWindow 序列）：检测哪些小时、在什么时间推送
+    alert_windows = DEFAULT_ALERT_WINDOWS
+
+    # 只对预报有变化的坐标点重新判断降雨，汇总结果增量维护
+    incremental_evaluation = True
+    _rain_evaluator = None
+    _rain_evaluator_lock = threading.Lock()
+
+    # 同一天同一时段的降雨提醒只推送一次；已推送后本时段内的定时运行不再请求天气
+    dedupe_alerts = True
+    alert_ttl = 24 * 3600
+    # 提醒先写入落盘的钉钉发件箱再发送，进程在发送前退出时下次启动补发
+    durable_alerts = True
+
+    # 按私钥文件路径缓存的JWT令牌提供者
+    _token_providers = {}
+    _token_providers_lock = threading.Lock()
+
+    @classmethod
+    def forecast_cache(cls):
+        """获取进程内共享的预报缓存，首次调用时从磁盘恢复"""
+        if cls._forecast_cache is None:
+            with cls._forecast_cache_lock:
+                if cls._forecast_cache is None:
+                    cls._forecast_cache = TTLCache(
+                        ttl=cls.forecast_ttl,
+                        max_entries=cls.forecast_cache_size,
+                        persist_path=cls.forecast_cache_path
+                    )
+        return cls._forecast_cache
+
+    @classmethod
+    def rain_evaluator(cls):
+        """获取进程内共享的增量降雨判断器，alert_windows 变化时重新创建"""
+        evaluator = cls._rain_evaluator
+        if evaluator is None or evaluator.windows != tuple(cls.alert_windows):
+            with cls._rain_evaluator_lock:
+                evaluator = cls._rain_evaluator
+                if evaluator is None or evaluator.windows != tuple(cls.alert_windows):
+                    evaluator = cls._rain_evaluator = IncrementalRainEvaluator(cls.alert_windows)
+        return evaluator
+
     @require_secret("rain_report", "kid")
     def hefeng_kid(self, secret=None):
         return secret
 
     @require_secret("rain_report", "sub")
-    def generate_jwt_token(self, file_path, secret=None):
-        # 使用with语句自动管理文件资源
-        with open(file_path, 'r', encoding='utf-8') as file:
-            private_key = file.read()  # 读取私钥明文到字符串变量
-
-        payload = {
-            'iat': int(datetime.now(timezone.utc).timestamp()) - 30,
-            'exp': int(datetime.now(timezone.utc).timestamp()) + 900,
-            'sub': secret
-        }
-        headers = {
-            'kid': self.hefeng_kid()
-        }
+    def hefeng_sub(self, secret=None):
+        return secret
 
-        # Generate JWT
-        encoded_jwt = jwt.encode(payload, private_key, algorithm='EdDSA', headers=headers)
-        return encoded_jwt
+    def token_provider(self, file_path):
+        """获取指定私钥文件对应的令牌提供者，私钥只解析一次"""
+        provider = self._token_providers.get(file_path)
+        if provider is None:
+            with self._token_providers_lock:
+                provider = self._token_providers.get(file_path)
+                if provider is None:
+                    provider = JwtTokenProvider(
+                        file_path,
+                        claims=lambda: (self.hefeng_sub(), self.hefeng_kid()),
+                        lifetime=900
+                    )
+                    self._token_providers[file_path] = provider
+        return provider
+
+    def generate_jwt_token(self, file_path):
+        # 令牌在有效期内复用，临近过期时后台提前刷新
+        return self.token_provider(file_path).get_token()
 
     @require_secret("rain_report", "api_host")
     def grid_weather_24h(self, location, secret=None):
+        # 缓存有效期内直接返回，不消耗API额度
+        cache = self.forecast_cache()
+        cached = cache.get(location)
+        if cached is not None:
+            metrics.inc("forecast_cache_total", result="hit")
+            return cached
+        metrics.inc("forecast_cache_total", result="miss")
+
         # 调用和风天气API请求天气
-        url = f"https://{secret}/v7/grid-weather/24h"
+        url = f"{self.api_scheme}://{secret}/v7/grid-weather/24h"
         # 定义查询地点
         params = {"location": location}
-        encoded_jwt=self.generate_jwt_token("ignore_file\\ed25519-private.pem")
+        with metrics.span("rain_report", "jwt"):
+            encoded_jwt=self.generate_jwt_token("ignore_file\\ed25519-private.pem")
         headers = {
             "Authorization": f"Bearer {encoded_jwt}",
             "Accept-Encoding": "gzip, deflate, br"  # 对应 --compressed 参数
         }
 
-        response = requests.get(
-            url,
-            params=params,
-            headers=headers
-        )
+        # 已过期的缓存条目带上校验信息做条件请求
+        stale = cache.get_entry(location)
+        if stale is not None:
+            if stale.etag:
+                headers["If-None-Match"] = stale.etag
+            if stale.last_modified:
+                headers["If-Modified-Since"] = stale.last_modified
+
+        try:
+            with metrics.span("rain_report", "http"):
+                # 自适应超时、对冲请求、抖动重试与熔断，见 ResilientClient
+                response = ResilientClient.shared().get(
+                    url,
+                    params=params,
+                    headers=headers
+                )
+        except (CircuitOpenError, requests.RequestException) as e:
+            # 接口异常时有过期缓存就先用过期的预报，避免整个服务失败
+            if stale is None:
+                raise
+            print(f"位置 {location} 的天气请求失败（{e}），使用过期缓存")
+            metrics.inc("forecast_cache_total", result="stale")
+            return stale.value
+
+        # 内容未变化，沿用缓存并续期
+        if response.status_code == 304 and stale is not None:
+            print(f"位置 {location} 的天气未变化，使用缓存")
+            return cache.refresh(location)
 
         # 检查响应状态
         if response.status_code == 200:
@@ -54,7 +171,31 @@ class rain_report:
         else:
             print(f"位置 {location} 的天气请求失败，状态码: {response.status_code}")
             print("错误信息:", response.text)
-        return response.json()
+        try:
+            with metrics.span("rain_report", "json_decode"):
+                data = response.json()
+        except ValueError:
+            data = None
+        failed = (
+            response.status_code == 429 or response.status_code >= 500
+            or not isinstance(data, dict) or data.get('code', '200') != '200'
+        )
+        if failed and stale is not None:
+            # 重试后仍是429/5xx、返回体无法解析或业务码非200时，和请求异常一样使用过期预报
+            print(f"位置 {location} 的天气接口返回异常，使用过期缓存")
+            metrics.inc("forecast_cache_total", result="stale")
+            return stale.value
+        if data is None:
+            # 没有过期缓存可用时保留原来的行为，向调用方抛出解析错误
+            return response.json()
+        if response.status_code == 200 and not failed:
+            cache.put(
+                location,
+                data,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified')
+            )
+        return data
 
 
     def extract_weather_data_json(self, json_respond):
@@ -110,75 +251,279 @@ class rain_report:
         return result_dict
 
 
-    def check_rain_for_locations(self, location_list):
+    def check_location_rain(self, location):
+        """
+        获取单个坐标点的天气并判断降雨情况
+
+        Args:
+            location: 坐标点，如 "105.44,28.89"
+
+        Returns:
+            tuple: 各提醒时段是否有雨，默认为 (上午有雨, 下午有雨)
+        """
+        return self.evaluate_location(location)[0]
+
+    def evaluate_location(self, location):
+        """
+        获取坐标点的预报并判断降雨，开启 incremental_evaluation 时预报未变化的坐标点直接复用上次的结果
+
+        Returns:
+            tuple: (各提醒时段是否有雨, 是否重新计算)
+        """
+        forecast = self.grid_weather_24h(location)
+        if self.incremental_evaluation:
+            # 预报来自缓存时带上条目版本号，版本号未变时无需重新计算指纹
+            entry = self.forecast_cache().get_entry(location)
+            version = entry.version if entry is not None and entry.value is forecast else None
+            return self.rain_evaluator().update(location, forecast, self.evaluate_forecast, version)
+        return self.evaluate_forecast(forecast), True
+
+    def evaluate_forecast(self, forecast):
+        """由24小时预报的JSON响应判断各提醒时段是否有雨"""
+        return self.check_single_location_rain(self.extract_weather_data_json(forecast))
+
+    def group_locations(self, location_list):
+        """
+        按预报格点对坐标点分组，同一格点只请求一次
+
+        Returns:
+            dict: {实际请求的坐标: [对应的原始坐标, ...]}；关闭 dedupe_grid 时每个坐标自成一组
+        """
+        if not self.dedupe_grid:
+            groups = {}
+            for location in location_list:
+                groups.setdefault(location, []).append(location)
+            return groups
+
+        grid = ForecastGrid(self.grid_resolution)
+        groups = grid.group(location_list)
+        self.grid_stats = grid.stats()
+        print(f"坐标点 {grid.point_count} 个，合并为 {grid.cell_count} 个格点，节省 {grid.saved_calls} 次请求")
+        return groups
+
+    def check_rain_for_locations(self, location_list, max_workers=None):
         """
         检查多个坐标点的降雨情况
 
+        坐标点先按预报格点去重，再并发请求，结果按完成顺序汇总；一旦所有提醒时段都已
+        确定有雨，尚未开始的请求会被取消。各坐标点的错误记录在 self.location_errors 中。
+        开启 incremental_evaluation 时只有预报变化的格点会重新判断；坐标列表与预报缓存
+        自上次完整运行以来都没有变化（且缓存未过期）时直接返回上次的结果，不再逐点检查。
+
         Args:
             location_list: 坐标点列表，值遵从和风天气接口规范，如 ["105.44,28.89", "105.441,28.887"]
+            max_workers: 最大并发数，默认使用类属性 max_workers
 
         Returns:
-            tuple: (上午有雨, 下午有雨) 的布尔值
+            tuple: 本次检查的坐标点中各提醒时段是否有雨，默认为 (上午有雨, 下午有雨)
         """
-        morning_rain_anywhere = False
-        afternoon_rain_anywhere = False
-
-        for location in location_list:
-            try:
-                # 获取天气数据
-                weather_condition = self.grid_weather_24h(location)
-                weather_dict = self.extract_weather_data_json(weather_condition)
+        windows = tuple(self.alert_windows)
+        rain_anywhere = [False] * len(windows)
+        self.location_errors = {}
+        evaluator = self.rain_evaluator() if self.incremental_evaluation else None
+        cache = self.forecast_cache()
+        run_key = (self.dedupe_grid, self.grid_resolution, tuple(location_list))
+        if evaluator is not None:
+            unchanged = evaluator.unchanged_result(run_key, cache.version)
+            if unchanged is not None:
+                print("坐标列表与预报均未变化，沿用上次的判断结果")
+                return unchanged
+
+        groups = self.group_locations(location_list)
+        if evaluator is not None:
+            evaluator.retain(groups)
+
+        def record(query, verdict, changed):
+            location = "、".join(groups[query])
+            # 更新总体降雨状态（只要有一个地方有雨就为True）
+            for index, rain in enumerate(verdict):
+                if rain:
+                    rain_anywhere[index] = True
+                    if changed:
+                        print(f"位置 {location} {windows[index].label}有雨")
+            return all(rain_anywhere)
+
+        def record_error(query, e):
+            if evaluator is not None:
+                evaluator.discard(query)
+            for location in groups[query]:
+                self.location_errors[location] = e
+            print(f"处理位置 {'、'.join(groups[query])} 时出错: {e}")
+
+        checked = []
+        max_workers = max_workers or self.max_workers
+        if max_workers <= 1 or len(groups) <= 1:
+            for query in groups:
+                checked.append(query)
+                try:
+                    if record(query, *self.evaluate_location(query)):
+                        break
+                except Exception as e:
+                    record_error(query, e)
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="RainReport") as executor:
+                futures = {executor.submit(self.evaluate_location, query): query for query in groups}
+                for future in as_completed(futures):
+                    query = futures[future]
+                    checked.append(query)
+                    try:
+                        all_rain = record(query, *future.result())
+                    except Exception as e:
+                        record_error(query, e)
+                        continue
+                    if all_rain:
+                        # 所有时段都已有雨，剩余坐标点不会改变结果
+                        for pending in futures:
+                            pending.cancel()
+                        break
+
+        print(f"预报缓存统计: {cache.stats()}")
+        if evaluator is not None:
+            print(f"增量判断统计: {evaluator.stats()}")
+            if not self.location_errors and (len(checked) == len(groups) or all(rain_anywhere)):
+                # 没有出错，且全部坐标点都已检查（或所有时段都已有雨）时，下次才能整体复用本次的结果
+                evaluator.record_run(run_key, cache.version, cache.min_expiry(checked), rain_anywhere)
+        return tuple(rain_anywhere)
+
+
+    def check_rain_for_locations_sharded(self, location_list, shards=None):
+        """
+        把去重后的格点分片，交给 shard_pool 中的子进程计算降雨情况
 
-                # 检查当前坐标点的降雨情况
-                morning_rain, afternoon_rain = self.check_single_location_rain(weather_dict)
+        JSON解析和时区换算在子进程中进行，不与主进程中的其他服务争用GIL；
+        某个分片超时或子进程崩溃时，只有该分片的坐标点记为错误。
 
-                # 更新总体降雨状态（只要有一个地方有雨就为True）
-                if morning_rain:
-                    morning_rain_anywhere = True
-                    print(f"位置 {location} 上午有雨")
+        Args:
+            location_list: 坐标点列表
+            shards: 分片数，默认等于进程池的子进程数
 
-                if afternoon_rain:
-                    afternoon_rain_anywhere = True
-                    print(f"位置 {location} 下午有雨")
+        Returns:
+            tuple: 各提醒时段是否有雨，默认为 (上午有雨, 下午有雨)
+        """
+        from .registry import invoke
+
+        self.location_errors = {}
+        groups = self.group_locations(location_list)
+        queries = list(groups)
+        shards = shards or self.shard_pool.max_workers
+        chunks = [queries[index::shards] for index in range(shards) if queries[index::shards]]
+        futures = {
+            self.shard_pool.submit(invoke, "rain_report", "check_rain_for_shard", chunk, timeout=self.shard_timeout): chunk
+            for chunk in chunks
+        }
 
+        rain_anywhere = [False] * len(self.alert_windows)
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                result = future.result()
             except Exception as e:
-                print(f"处理位置 {location} 时出错: {e}")
+                for query in chunk:
+                    for location in groups[query]:
+                        self.location_errors[location] = e
+                print(f"分片（{len(chunk)} 个格点）处理失败: {e}")
                 continue
+            print(f"分片（{len(chunk)} 个格点）完成 | 子进程: {future.worker_pid} | 耗时: {future.elapsed:.2f}s")
+            for query, error in result['errors'].items():
+                for location in groups.get(query, [query]):
+                    self.location_errors[location] = error
+            rain_anywhere = [before or rain for before, rain in zip(rain_anywhere, result['rain'])]
+            if all(rain_anywhere):
+                # 所有时段都已有雨，尚未开始的分片不会改变结果
+                for pending in futures:
+                    pending.cancel()
+                break
+
+        return tuple(rain_anywhere)
+
+    def check_rain_for_shard(self, queries):
+        """
+        在子进程中执行的分片任务
 
-        return morning_rain_anywhere, afternoon_rain_anywhere
+        Returns:
+            dict: {"rain": 各提醒时段是否有雨, "errors": {坐标点: 错误信息}}，只包含可序列化的值
+        """
+        return {
+            'rain': list(self.check_rain_for_locations(queries)),
+            'errors': {location: str(error) for location, error in self.location_errors.items()}
+        }
 
+    def fetch_forecasts(self, location_list, max_workers=None):
+        """
+        并发获取多个坐标点的24小时预报
 
-    def check_single_location_rain(self, weather_data):
+        Returns:
+            dict: {坐标点: JSON响应}，失败的坐标点记录在 self.location_errors 中
         """
-        检查单个坐标点的降雨情况
+        self.location_errors = {}
+        forecasts = {}
+        max_workers = max_workers or self.max_workers
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="RainReport") as executor:
+            futures = {executor.submit(self.grid_weather_24h, location): location for location in location_list}
+            for future in as_completed(futures):
+                location = futures[future]
+                try:
+                    forecasts[location] = future.result()
+                except Exception as e:
+                    self.location_errors[location] = e
+                    print(f"处理位置 {location} 时出错: {e}")
+        return forecasts
+
+    def check_rain_for_locations_batch(self, location_list, max_workers=None):
+        """
+        以列式批量方式检查多个坐标点的降雨情况
 
-        Args:
-            weather_data: 天气数据字典
+        所有坐标点的预报先汇总为 (坐标点 × 小时) 矩阵，再按时段做数组归约，
+        结果与 check_rain_for_locations 相同。需要安装numpy。
 
         Returns:
-            tuple: (上午有雨, 下午有雨) 的布尔值
+            tuple: 各提醒时段是否有雨，默认为 (上午有雨, 下午有雨)
         """
-        # 检查上午(8点到13点)是否有雨
-        morning_hours = ['8时', '9时', '10时', '11时', '12时', '13时']
-        morning_rain = False
+        from .rain_batch import ForecastBatch
 
-        for hour in morning_hours:
-            if hour in weather_data and 'text' in weather_data[hour]:
-                if '雨' in weather_data[hour]['text']:
-                    morning_rain = True
-                    break
+        groups = self.group_locations(location_list)
+        forecasts = self.fetch_forecasts(list(groups), max_workers)
+        for query in groups:
+            if query in self.location_errors:
+                for location in groups[query]:
+                    self.location_errors[location] = self.location_errors[query]
 
-        # 检查下午(14点到18点)是否有雨
-        afternoon_hours = ['14时', '15时', '16时', '17时', '18时']
-        afternoon_rain = False
+        queries = [query for query in groups if query in forecasts]
+        batch = ForecastBatch.from_responses(queries, [forecasts[query] for query in queries])
+        windows = tuple(self.alert_windows)
+        rain = batch.rain_in_windows([window.hours for window in windows])
 
-        for hour in afternoon_hours:
-            if hour in weather_data and 'text' in weather_data[hour]:
-                if '雨' in weather_data[hour]['text']:
-                    afternoon_rain = True
-                    break
+        for query, verdict in zip(queries, rain.tolist()):
+            location = "、".join(groups[query])
+            for window, window_rain in zip(windows, verdict):
+                if window_rain:
+                    print(f"位置 {location} {window.label}有雨")
 
-        return morning_rain, afternoon_rain
+        return tuple(bool(rain[:, column].any()) for column in range(len(windows)))
+
+
+    def check_single_location_rain(self, weather_data, windows=None):
+        """
+        检查单个坐标点的降雨情况
+
+        Args:
+            weather_data: 天气数据字典
+            windows: AlertWindow 序列，默认使用类属性 alert_windows
+
+        Returns:
+            tuple: 各时段是否有雨，默认为 (上午有雨, 下午有雨) 的布尔值
+        """
+        verdict = []
+        for window in windows or self.alert_windows:
+            # 检查该时段（默认上午8点到13点、下午14点到18点）是否有雨
+            window_rain = False
+            for hour in window.hour_keys:
+                if hour in weather_data and 'text' in weather_data[hour]:
+                    if '雨' in weather_data[hour]['text']:
+                        window_rain = True
+                        break
+            verdict.append(window_rain)
+        return tuple(verdict)
 
     @require_secret("rain_report", "location_list")
     def location_list(self, secret=None):
@@ -187,8 +532,9 @@ class rain_report:
 
     def rain_or_not(self, arg1):
 
-        # 检查所有坐标点的降雨情况
-        morning_rain, afternoon_rain = self.check_rain_for_locations(self.location_list())
+        # 打开发件箱，补发上次进程退出前未送达的提醒
+        if self.durable_alerts:
+            dingtalk_notify.outbox()
 
         # 设置北京时区
         beijing_tz = pytz.timezone('Asia/Shanghai')
@@ -197,14 +543,30 @@ class rain_report:
         now_beijing = datetime.now(beijing_tz)
         current_time = now_beijing.time()
 
-        # 定义时间范围
-        start_time_morning = time(6, 0, 0)
-        end_time_morning = time(9, 0, 0)
-        start_time_afternoon = time(12, 0, 0)
-        end_time_afternoon = time(15, 0, 0)
+        # 当前时间所在的推送时段
+        windows = tuple(self.alert_windows)
+        window = next((window for window in windows if window.is_active(current_time)), None)
+
+        # 本时段的提醒已经推送过，无需再请求天气
+        store = IdempotencyStore.shared() if self.dedupe_alerts else None
+        alert_key = f"rain_alert:{now_beijing.date().isoformat()}:{window.name if window else None}"
+        if store is not None and window is not None and store.seen(alert_key):
+            print(f"今日提醒“{window.message}”已推送，跳过本次天气检查")
+            return None
+
+        # 检查所有坐标点的降雨情况
+        if self.shard_pool is not None:
+            verdict = self.check_rain_for_locations_sharded(self.location_list())
+        elif self.use_batch_engine:
+            verdict = self.check_rain_for_locations_batch(self.location_list())
+        else:
+            verdict = self.check_rain_for_locations(self.location_list())
 
         # 检查时间并完成推送
-        if start_time_morning <= current_time < end_time_morning and morning_rain:
-            dingtalk_push(msg='上午可能有雨')
-        elif start_time_afternoon <= current_time < end_time_afternoon and afternoon_rain:
-            dingtalk_push(msg='下午可能有雨')
+        if window is not None and verdict[windows.index(window)]:
+            if store is not None and not store.reserve(alert_key):
+                return None
+            future = dingtalk_notify().push_notification_async(msg=window.message, durable=self.durable_alerts)
+            if store is not None:
+                future.add_done_callback(IdempotencyStore.confirm_on_success(store, alert_key, self.alert_ttl))
+            return future
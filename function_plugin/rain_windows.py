@@ -0,0 +1,160 @@
+import threading
+import time as _time
+from datetime import time
+
+
+class AlertWindow:
+    """一个降雨提醒时段。
+
+    Args:
+        name: 时段名称，用于日志与幂等记录，如 "morning"。
+        label: 中文名称，用于输出，如 "上午"。
+        hours: 检测降雨的北京时间小时数，如 range(8, 14)。
+        push_from / push_until: 在该时间区间内（左闭右开）运行时推送本时段的提醒。
+        message: 推送的消息，默认为 "<label>可能有雨"。
+    """
+
+    __slots__ = ('name', 'label', 'hours', 'hour_keys', 'push_from', 'push_until', 'message')
+
+    def __init__(self, name, label, hours, push_from, push_until, message=None):
+        self.name = name
+        self.label = label
+        self.hours = tuple(hours)
+        # 与 extract_weather_data_json 的键格式一致
+        self.hour_keys = tuple(f"{hour}时" for hour in self.hours)
+        self.push_from = push_from
+        self.push_until = push_until
+        self.message = message or f"{label}可能有雨"
+
+    def is_active(self, current_time):
+        return self.push_from <= current_time < self.push_until
+
+    def __repr__(self):
+        return f"AlertWindow({self.name!r}, hours={self.hours}, push={self.push_from}-{self.push_until})"
+
+
+# 默认时段：6-9时推送上午(8-13时)的提醒，12-15时推送下午(14-18时)的提醒
+DEFAULT_ALERT_WINDOWS = (
+    AlertWindow('morning', '上午', range(8, 14), time(6, 0, 0), time(9, 0, 0)),
+    AlertWindow('afternoon', '下午', range(14, 19), time(12, 0, 0), time(15, 0, 0)),
+)
+
+
+def forecast_fingerprint(forecast):
+    """预报中与降雨判断有关的部分：每小时的 (fxTime, text)。
+
+    只有温度、图标等变化时指纹不变，无需重新判断。
+    """
+    return tuple((item.get('fxTime', ''), item.get('text', '')) for item in forecast.get('hourly', ()))
+
+
+class IncrementalRainEvaluator:
+    """按坐标点增量维护各时段的降雨判断。
+
+    每个坐标点记录上一次的预报对象、缓存版本号、指纹与判断结果：预报对象或缓存版本号未变
+    （缓存命中、304续期或接口失败时沿用的过期缓存）时直接复用结果，不再计算指纹；
+    指纹相同时只更新记录；指纹变化时才重新计算该坐标点。各时段有雨的坐标点数随之增减。
+
+    此外记录最近一次完整运行的坐标列表、缓存版本号与缓存最早过期时间：下次运行时
+    坐标列表与缓存版本号都没变、缓存也未过期，说明没有任何预报变化，直接返回上次的结果，
+    耗时与坐标点数量无关。
+
+    Args:
+        windows: AlertWindow 序列。
+    """
+
+    def __init__(self, windows):
+        self.windows = tuple(windows)
+        # {坐标点: (预报对象, 缓存版本号, 指纹, 判断结果)}
+        self._states = {}
+        self._rain_counts = [0] * len(self.windows)
+        self._last_run = None
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.recomputed = 0
+        self.unchanged_runs = 0
+
+    def update(self, location, forecast, evaluate, version=None):
+        """记录坐标点的最新预报，返回 (各时段是否有雨的元组, 是否重新计算)。
+
+        Args:
+            evaluate: 指纹变化时调用 evaluate(forecast) 计算各时段的判断。
+            version: 可选，预报在缓存中的版本号；与上次相同时不再计算指纹。
+        """
+        with self._lock:
+            state = self._states.get(location)
+            if state is not None and (state[0] is forecast or (version is not None and state[1] == version)):
+                self.reused += 1
+                return state[3], False
+
+        fingerprint = forecast_fingerprint(forecast)
+        with self._lock:
+            # 比较与更新在同一次加锁内完成，期间其他线程可能已更新该坐标点
+            state = self._states.get(location)
+            if state is not None and state[2] == fingerprint:
+                self._states[location] = (forecast, version, fingerprint, state[3])
+                self.reused += 1
+                return state[3], False
+
+        verdict = tuple(bool(rain) for rain in evaluate(forecast))
+        with self._lock:
+            previous = self._states.get(location)
+            if previous is not None:
+                self._count(previous[3], -1)
+            self._states[location] = (forecast, version, fingerprint, verdict)
+            self._count(verdict, 1)
+            self.recomputed += 1
+            self._last_run = None
+        return verdict, True
+
+    def discard(self, location):
+        """移除坐标点（例如请求失败或已不在坐标列表中）。"""
+        with self._lock:
+            state = self._states.pop(location, None)
+            if state is not None:
+                self._count(state[3], -1)
+                self._last_run = None
+
+    def retain(self, locations):
+        """只保留给定的坐标点。"""
+        locations = set(locations)
+        for location in [location for location in self._states if location not in locations]:
+            self.discard(location)
+
+    def _count(self, verdict, delta):
+        for index, rain in enumerate(verdict):
+            if rain:
+                self._rain_counts[index] += delta
+
+    def aggregate(self):
+        """返回各时段是否有任一已记录的坐标点有雨。"""
+        with self._lock:
+            return tuple(count > 0 for count in self._rain_counts)
+
+    def record_run(self, run_key, version, valid_until, verdict):
+        """记录一次完整运行（全部坐标点都已判断、没有出错）的结果。
+
+        Args:
+            run_key: 标识坐标列表的可哈希值。
+            version: 运行结束时缓存的版本号。
+            valid_until: 本次用到的缓存条目中最早的过期时间（时间戳）。
+            verdict: 本次运行的汇总结果。
+        """
+        with self._lock:
+            self._last_run = (run_key, version, valid_until, tuple(verdict))
+
+    def unchanged_result(self, run_key, version, now=None):
+        """坐标列表、缓存版本号均与上次完整运行相同且缓存未过期时返回上次的结果，否则返回None。"""
+        with self._lock:
+            last_run = self._last_run
+            if last_run is None or last_run[0] != run_key or last_run[1] != version:
+                return None
+            if (now or _time.time()) >= last_run[2]:
+                return None
+            self.unchanged_runs += 1
+            return last_run[3]
+
+    def stats(self):
+        with self._lock:
+            return {'locations': len(self._states), 'reused': self.reused, 'recomputed': self.recomputed,
+                    'unchanged_runs': self.unchanged_runs}
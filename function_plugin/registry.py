@@ -0,0 +1,183 @@
+"""
+插件注册表
+
+按名称或入口点（entry point）发现插件，插件模块在第一次使用时才导入，
+只发送一条钉钉消息的脚本不必加载邮件、天气相关的依赖。
+
+统计各插件冷启动导入耗时：
+    python -m function_plugin
+    python -m function_plugin dingtalk_notify --budget-ms 300
+"""
+
+import argparse
+import importlib
+import os
+import re
+import sys
+import threading
+import time
+from importlib import metadata
+
+# 第三方包可以在该入口点组下注册插件，值为 "模块:属性"
+ENTRY_POINT_GROUP = "function_plugin.plugins"
+
+_IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+_REPORT_MARKER = "--plugin-import-start--"
+
+
+class PluginRegistry:
+    """插件名到 "模块:属性" 的映射，按需导入并缓存插件对象。
+
+    Args:
+        builtin: 内置插件映射，默认 BUILTIN。
+        group: 入口点组名，首次查找未知插件时扫描。
+    """
+
+    BUILTIN = {
+        "dingtalk_notify": "function_plugin.dingtalk_notify:dingtalk_notify",
+        "email_monitor": "function_plugin.email_monitor:email_monitor",
+        "rain_report": "function_plugin.rain_report:rain_report",
+    }
+
+    def __init__(self, builtin=None, group=ENTRY_POINT_GROUP):
+        self.builtin = dict(self.BUILTIN if builtin is None else builtin)
+        self.group = group
+        self._targets = dict(self.builtin)
+        self._entry_points_scanned = False
+        self._loaded = {}
+        self.load_seconds = {}
+        # 插件模块导入时可能再次通过注册表加载其他插件，使用可重入锁
+        self._lock = threading.RLock()
+
+    def _scan_entry_points(self):
+        if self._entry_points_scanned:
+            return
+        self._entry_points_scanned = True
+        try:
+            entry_points = metadata.entry_points(group=self.group)
+        except Exception as e:
+            print(f"扫描插件入口点 {self.group} 失败: {e}")
+            return
+        for entry_point in entry_points:
+            # 内置插件优先，避免被同名入口点覆盖
+            self._targets.setdefault(entry_point.name, entry_point.value)
+
+    def names(self):
+        """返回全部可用插件名（包括入口点注册的插件）。"""
+        with self._lock:
+            self._scan_entry_points()
+            return sorted(self._targets)
+
+    def target(self, name):
+        """返回插件的 "模块:属性"，未知插件抛出 KeyError。"""
+        with self._lock:
+            if name not in self._targets:
+                self._scan_entry_points()
+            return self._targets[name]
+
+    def is_loaded(self, name):
+        return name in self._loaded
+
+    def load(self, name):
+        """导入并返回插件对象，只在第一次调用时导入模块。"""
+        plugin = self._loaded.get(name)
+        if plugin is not None:
+            return plugin
+        with self._lock:
+            plugin = self._loaded.get(name)
+            if plugin is not None:
+                return plugin
+            module_name, _, attribute = self.target(name).partition(':')
+            start = time.perf_counter()
+            plugin = importlib.import_module(module_name)
+            for part in filter(None, attribute.split('.')):
+                plugin = getattr(plugin, part)
+            self.load_seconds[name] = time.perf_counter() - start
+            self._loaded[name] = plugin
+            return plugin
+
+    def import_report(self, names=None, top=5):
+        """在独立的解释器中用 -X importtime 测量每个插件的冷启动导入耗时。
+
+        Returns:
+            list: 每个插件一个字典 {"plugin", "total_ms", "modules", "packages"}，
+                packages 为按顶层包汇总的自身耗时（毫秒），按耗时降序取前 top 个。
+        """
+        import subprocess
+
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        report = []
+        for name in names or self.names():
+            code = (
+                f"import sys; sys.stderr.write({_REPORT_MARKER!r} + '\\n'); "
+                f"from function_plugin.registry import PluginRegistry; PluginRegistry().load({name!r})"
+            )
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", code],
+                cwd=root, capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                report.append({"plugin": name, "error": result.stderr.strip().splitlines()[-1:]})
+                continue
+            report.append(self._summarize_importtime(name, result.stderr, top))
+        return report
+
+    @staticmethod
+    def _summarize_importtime(name, stderr, top):
+        lines = stderr.split(_REPORT_MARKER, 1)[-1].splitlines()
+        total_us = 0
+        modules = 0
+        packages = {}
+        for line in lines:
+            match = _IMPORTTIME_RE.match(line)
+            if match is None:
+                continue
+            self_us, cumulative_us = int(match.group(1)), int(match.group(2))
+            indent, module = match.group(3), match.group(4)
+            modules += 1
+            if len(indent) == 1:
+                total_us += cumulative_us
+            package = module.split('.', 1)[0]
+            packages[package] = packages.get(package, 0) + self_us
+        heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {
+            "plugin": name,
+            "total_ms": round(total_us / 1000, 1),
+            "modules": modules,
+            "packages": [(package, round(us / 1000, 1)) for package, us in heaviest]
+        }
+
+
+# 包级共享注册表，function_plugin 的属性访问通过它按需加载
+default_registry = PluginRegistry()
+
+
+def invoke(name, method_name, *args):
+    """创建插件实例并调用其方法。只需传递插件名，可作为进程池任务在子进程中执行。"""
+    plugin = default_registry.load(name)
+    return getattr(plugin(), method_name)(*args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='统计插件冷启动导入耗时')
+    parser.add_argument('plugins', nargs='*', help='插件名，默认全部')
+    parser.add_argument('--budget-ms', dest='budget_ms', type=float,
+                        help='单个插件导入耗时预算（毫秒），超出时以非零状态码退出')
+    args = parser.parse_args()
+
+    over_budget = []
+    for item in default_registry.import_report(args.plugins or None):
+        if "error" in item:
+            print(f"{item['plugin']}: 导入失败 {item['error']}")
+            over_budget.append(item['plugin'])
+            continue
+        packages = ", ".join(f"{package} {ms}ms" for package, ms in item['packages'])
+        print(f"{item['plugin']:<20} {item['total_ms']:>8.1f} ms  {item['modules']:>4} 个模块  主要耗时: {packages}")
+        if args.budget_ms is not None and item['total_ms'] > args.budget_ms:
+            over_budget.append(item['plugin'])
+
+    if over_budget:
+        print(f"超出预算的插件: {', '.join(over_budget)}")
+        return 1
+    return 0
+
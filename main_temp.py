@@ -1,5 +1,10 @@
 from function_plugin import dingtalk_notify, email_monitor, rain_report
 from auth_service import SecretsManager
+from function_base import MetricsRegistry, ServiceScheduler
+from function_base.process_pool import ProcessTaskPool, RemoteError
+from function_plugin.registry import invoke
+import argparse
+import logging
 import threading
 import time
 import traceback
@@ -7,13 +12,15 @@ import traceback
 def run_service(service_instance, method_name, *args):
     """安全运行服务方法。"""
     method = getattr(service_instance, method_name)
+    registry = MetricsRegistry.shared()
     try:
-        start_time = time.time()
-        result = method(*args)
-        elapsed = time.time() - start_time
-        print(f"服务执行成功 | 方法: {method_name} | 耗时: {elapsed:.4f}s | 结果: {result}")
+        with registry.span(method_name, "total") as span:
+            result = method(*args)
+        registry.inc("service_runs_total", service=method_name, status="success")
+        print(f"服务执行成功 | 方法: {method_name} | 耗时: {span.elapsed:.4f}s | 结果: {result}")
         return True
     except Exception as e:
+        registry.inc("service_runs_total", service=method_name, status="failure")
         print(f"服务执行失败: {str(e)}")
         print("完整堆栈跟踪:")
         traceback.print_exc()
@@ -26,7 +33,7 @@ def run_single_service(service_instance, method_name, *args):
     print(f"服务 {method_name} 执行完毕")
 
 
-def run_all_services():
+def run_all_services(join_timeout=None):
 
     # 任务列表
     tasks = [
@@ -41,18 +48,113 @@ def run_all_services():
         t = threading.Thread(
             target=run_service,
             args=(instance, method, *args),
-            name=f"ServiceThread-{i + 1}"
+            name=f"ServiceThread-{i + 1}",
+            daemon=True
         )
         t.start()
         threads.append(t)
         time.sleep(0.1)
 
+    # 最多等待 join_timeout 秒，卡住的服务线程不会阻塞其他服务的结果输出与进程退出
+    deadline = None if join_timeout is None else time.monotonic() + join_timeout
     for t in threads:
-        t.join()
+        t.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+    stuck = [t.name for t in threads if t.is_alive()]
+    if stuck:
+        print(f"以下服务线程超过 {join_timeout} 秒仍未结束: {', '.join(stuck)}")
 
     print("所有服务执行完毕")
+    print("============= 指标汇总 =============")
+    print(MetricsRegistry.shared().summary())
+
+
+def run_all_services_in_processes(max_workers=4, task_timeout=300):
+    """进程池模式：钉钉、邮箱服务各在一个子进程中执行，天气坐标点按格点分片到子进程。
+
+    某个服务崩溃或超时只影响它自己，子进程会被自动替换。
+    """
+    registry = MetricsRegistry.shared()
+    tasks = [
+        ("dingtalk_notify", "push_notification_with_args", ["测试消息"]),
+        ("email_monitor", "email_service", ['占位'])
+    ]
+
+    with ProcessTaskPool(max_workers=max_workers, task_timeout=task_timeout) as pool:
+        futures = {method: pool.submit(invoke, plugin, method, *args) for plugin, method, args in tasks}
+
+        # 天气服务在主进程中汇总各分片的结果并推送
+        rain_report.shard_pool = pool
+        try:
+            run_service(rain_report_service, "rain_or_not", '占位')
+        finally:
+            rain_report.shard_pool = None
+
+        for method, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                registry.inc("service_runs_total", service=method, status="failure")
+                print(f"服务执行失败: {method} | {e}")
+                if isinstance(e, RemoteError):
+                    print(e.remote_traceback)
+                continue
+            registry.observe(method, "total", future.elapsed)
+            registry.inc("service_runs_total", service=method, status="success")
+            print(f"服务执行成功 | 方法: {method} | 子进程: {future.worker_pid} | 耗时: {future.elapsed:.4f}s | 结果: {result}")
+        print(f"进程池统计: {pool.stats()}")
+
+    print("所有服务执行完毕")
+    print("============= 指标汇总 =============")
+    print(registry.summary())
+
+
+def run_scheduler(max_workers=4, email_idle=False):
+    """常驻模式：复用服务实例，按各任务的间隔或cron表达式反复执行。"""
+    scheduler = ServiceScheduler(run_service, max_workers=max_workers)
+
+    # 任务列表：(名称, 实例, 方法, 参数, 触发规则)
+    if email_idle:
+        # 邮箱改为IDLE推送模式，单独占用一个常驻线程
+        threading.Thread(
+            target=run_service,
+            args=(email_monitor_service, "email_idle_service", '占位'),
+            name="EmailIdleThread",
+            daemon=True
+        ).start()
+    else:
+        scheduler.add_task("email_service", email_monitor_service, "email_service", ['占位'],
+                           interval=300, jitter=10, run_immediately=True)
+    # 降雨提醒的时段为北京时间，与服务器所在时区无关
+    scheduler.add_task("rain_or_not", rain_report_service, "rain_or_not", ['占位'],
+                       cron="0,30 6-8,12-14 * * *", jitter=30, tz="Asia/Shanghai")
+
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        print("\n调度器被用户中断")
+        scheduler.stop()
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--daemon', action='store_true', help='以常驻调度模式运行')
+    parser.add_argument('--workers', type=int, default=4, help='常驻模式下的最大并发任务数')
+    parser.add_argument('--email-idle', dest='email_idle', action='store_true',
+                        help='常驻模式下邮箱使用IMAP IDLE推送而非定时轮询')
+    parser.add_argument('--secrets-reload', dest='secrets_reload', type=float, default=5,
+                        help='常驻模式下轮询密钥文件变化的间隔（秒），0表示不自动重新加载')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='单次执行模式下使用的子进程数，每个服务在独立子进程中执行，0表示使用线程')
+    parser.add_argument('--task-timeout', dest='task_timeout', type=float, default=300,
+                        help='单个服务的时限（秒）：进程池模式下超时的子进程会被终止并替换，'
+                             '线程模式下超时后不再等待该服务')
+    parser.add_argument('--metrics-port', dest='metrics_port', type=int, default=0,
+                        help='在本机该端口以Prometheus文本格式导出指标（/metrics），0表示不启动')
+    parser.add_argument('--metrics-dump', dest='metrics_dump', type=float, default=300,
+                        help='常驻模式下定期把指标汇总写入日志的间隔（秒），0表示不输出')
+    cli_args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(threadName)s %(levelname)s %(message)s')
+
     SecretsManager.load_secrets()
     print("============= 加载的密钥 =============")
     print(SecretsManager.list_secrets())
@@ -64,8 +166,17 @@ if __name__ == "__main__":
     email_monitor_service = email_monitor()
 
     # 启动服务
-    run_all_services()
-    #run_single_service(email_monitor_service, "email_service", '占位')
-
-
+    if cli_args.metrics_port:
+        MetricsRegistry.shared().start_http_server(cli_args.metrics_port)
 
+    if cli_args.daemon:
+        if cli_args.metrics_dump > 0:
+            MetricsRegistry.shared().start_periodic_dump(cli_args.metrics_dump)
+        if cli_args.secrets_reload > 0:
+            SecretsManager.start_hot_reload(interval=cli_args.secrets_reload)
+        run_scheduler(max_workers=cli_args.workers, email_idle=cli_args.email_idle)
+    elif cli_args.processes > 0:
+        run_all_services_in_processes(max_workers=cli_args.processes, task_timeout=cli_args.task_timeout)
+    else:
+        run_all_services(join_timeout=cli_args.task_timeout)
+    #run_single_service(email_monitor_service, "email_service", '占位')
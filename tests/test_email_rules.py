@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from function_plugin.email_rules import EmailRule, EmailRuleEngine
+
+
+def _names(engine, body, subject="", sender="a@example.com"):
+    return [rule.name for rule in engine.evaluate({'sender': sender, 'subject': subject, 'body': body})]
+
+
+class EmailRuleEngineTest(unittest.TestCase):
+
+    def test_overlapping_patterns_all_match(self):
+        engine = EmailRuleEngine([
+            EmailRule('order_no', body_patterns=[r'订单\d+']),
+            EmailRule('order', body_patterns=['订单']),
+        ])
+        self.assertEqual(_names(engine, "您的订单123已发货"), ['order_no', 'order'])
+
+    def test_backreference_and_inline_flag(self):
+        engine = EmailRuleEngine([
+            EmailRule('repeat', body_patterns=[r'(\w)\1']),
+            EmailRule('flag', body_patterns=['(?i)abc']),
+            EmailRule('plain', body_patterns=['xyz']),
+        ])
+        self.assertEqual(_names(engine, "ABC aa xyz"), ['repeat', 'flag', 'plain'])
+        self.assertEqual(_names(engine, "abx"), [])
+
+    def test_pattern_combined_with_keyword(self):
+        engine = EmailRuleEngine([
+            EmailRule('alarm', subject_keywords=['告警'], body_patterns=[r'P[0-1]\s*级']),
+        ])
+        self.assertEqual(_names(engine, "P0 级故障", subject="系统告警"), ['alarm'])
+        self.assertEqual(_names(engine, "P0 级故障", subject="通知"), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import base64
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from function_plugin.mime_stream import ContentAddressedStore, StreamingMimeParser
+
+
+def _message(attachment_b64):
+    return (
+        b"From: a@example.com\r\n"
+        b"Subject: report\r\n"
+        b"MIME-Version: 1.0\r\n"
+        b"Content-Type: multipart/mixed; boundary=XYZ\r\n"
+        b"\r\n"
+        b"--XYZ\r\n"
+        b"Content-Type: text/plain; charset=utf-8\r\n"
+        b"\r\n"
+        b"see attached\r\n"
+        b"--XYZ\r\n"
+        b"Content-Type: application/octet-stream\r\n"
+        b"Content-Disposition: attachment; filename=data.bin\r\n"
+        b"Content-Transfer-Encoding: base64\r\n"
+        b"\r\n"
+        + attachment_b64 + b"\r\n"
+        b"--XYZ--\r\n"
+    )
+
+
+class StreamingMimeParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def _parse(self, raw, chunk_size=7):
+        parser = StreamingMimeParser(ContentAddressedStore(self.root))
+        for start in range(0, len(raw), chunk_size):
+            parser.feed(raw[start:start + chunk_size])
+        return parser.close()
+
+    def _attachment_bytes(self, result):
+        self.assertEqual(len(result["attachments"]), 1)
+        with open(result["attachments"][0]["path"], "rb") as f:
+            return f.read()
+
+    def test_complete_attachment(self):
+        content = bytes(range(256)) * 4
+        result = self._parse(_message(base64.b64encode(content)))
+        self.assertEqual(result["body"], "see attached")
+        self.assertEqual(self._attachment_bytes(result), content)
+
+    def test_truncated_attachment_keeps_decodable_prefix(self):
+        content = b"0123456789abcdef" * 10
+        encoded = base64.b64encode(content)
+        # 截断后剩余 1 个字符的残缺分组：丢弃残缺部分而不是抛出异常
+        with self.assertLogs(level="WARNING"):
+            result = self._parse(_message(encoded[:-3]))
+        self.assertEqual(result["body"], "see attached")
+        complete_groups = (len(encoded) - 3) // 4
+        self.assertEqual(self._attachment_bytes(result), content[:complete_groups * 3])
+
+    def test_missing_padding_is_restored(self):
+        content = b"hello world!!"
+        encoded = base64.b64encode(content).rstrip(b"=")
+        result = self._parse(_message(encoded))
+        self.assertEqual(self._attachment_bytes(result), content)
+
+    def test_misplaced_padding_does_not_abort(self):
+        with self.assertLogs(level="WARNING"):
+            result = self._parse(_message(b"QU=DQUJD"))
+        self.assertEqual(result["body"], "see attached")
+        self.assertEqual(len(result["attachments"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
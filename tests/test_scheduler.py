@@ -0,0 +1,29 @@
+import os
+import sys
+import unittest
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from function_base.scheduler import ScheduledTask, ServiceScheduler
+
+
+class ScheduledTaskTimezoneTest(unittest.TestCase):
+
+    def test_cron_matches_wall_clock_of_given_timezone(self):
+        task = ScheduledTask("rain", None, "run", cron="0,30 6-8,12-14 * * *", tz="Asia/Shanghai")
+        # UTC 23:10 为北京时间次日 07:10，下一次触发是北京时间 07:30，即 UTC 23:30
+        now = datetime(2024, 6, 1, 23, 10, tzinfo=timezone.utc).timestamp()
+        next_run = datetime.fromtimestamp(task.schedule_next(now), timezone.utc)
+        self.assertEqual(next_run, datetime(2024, 6, 1, 23, 30, tzinfo=timezone.utc))
+
+    def test_task_inherits_scheduler_timezone(self):
+        scheduler = ServiceScheduler(runner=None, tz="Asia/Shanghai")
+        task = scheduler.add_task("rain", None, "run", cron="0 12 * * *")
+        self.assertEqual(str(task.tz), "Asia/Shanghai")
+        next_run = datetime.fromtimestamp(task.next_run, timezone.utc)
+        self.assertEqual((next_run.hour, next_run.minute), (4, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()